@@ -1,17 +1,20 @@
 # apis.py
 # Flask-RESTful API endpoints
+import io
 import os
 import smtplib
-import hashlib
-import hmac
+import functools
 import db
-import uuid
+import hashing
+import batching
+import newclassifier
+import tokens
+import search
 import argparse
 import secrets
 import string
-from flask import Flask, request, jsonify, send_file
+from flask import Flask, Request, request, jsonify, send_file
 from flask_restful import Resource, Api
-from newclassifier import predict
 from waitress import serve
 from schema import *
 from pydantic import ValidationError
@@ -21,13 +24,12 @@ from email.mime.text import MIMEText
 
 def hash_password(password: str):
     """
-    Hashes and salts plaintext password
+    Hashes and salts plaintext password on the password hashing executor
 
     :param password: input password
     :return: hash, salt
     """
-    salt = os.urandom(16)
-    return hashlib.pbkdf2_hmac('sha256', password.encode(), salt, 100000), salt
+    return hashing.executor.hash_password(password)
 
 
 def validate_password(password: str, password_hash: bytes, salt: bytes):
@@ -39,32 +41,82 @@ def validate_password(password: str, password_hash: bytes, salt: bytes):
     :param salt: stored password salt
     :return: boolean indicating validation success
     """
-    if password_hash is None or salt is None:
-        return False
-    return hmac.compare_digest(password_hash, hashlib.pbkdf2_hmac('sha256', password.encode(), salt, 100000))
+    return hashing.executor.verify_password(password, [(password_hash, salt)])
+
+
+def validate_user_password(password: str, user_data: dict):
+    """
+    Validates password string against a user's password and temporary password in one hashing job
+
+    :param password: input password string
+    :param user_data: user record
+    :return: boolean indicating validation success
+    """
+    return hashing.executor.verify_password(password, [
+        (user_data.get('passwordHash'), user_data.get('salt')),
+        (user_data.get('tempPasswordHash'), user_data.get('tempSalt'))
+    ])
+
+
+def server_busy():
+    """
+    Response for requests rejected because the password hashing or image classifier queue is full, or the image
+    classifier is still loading
+
+    :return: 503 response
+    """
+    res = jsonify({
+        'message': 'Server busy. Please try again.'
+    })
+    res.status_code = 503
+    res.headers['Retry-After'] = '1'
+    return res
 
 
 def generate_session_token(user_id: int):
     """
-    Generates session token, writes session to db
+    Generates session token, either written to db or signed depending on SESSION_TOKEN_MODE
 
     :param user_id: user's ID
     :return: session token
     """
-    session_token = str(uuid.uuid4())
-    res, err = db.create_session(user_id, session_token)
-    if res is not None and err is None:
-        return session_token
-    else:
-        return None
+    return tokens.create_session(user_id)
 
 
-def clear_temp():
+def require_session(f):
     """
-    Clears temp directory
+    Decorator for resource methods scoped to a user, rejects requests whose Authorization token does not belong to
+    the `user_id` in the URL
+
+    :param f: resource method taking a `user_id` argument
+    :return: wrapped method, called with `user_id` converted to int
     """
-    for f in os.listdir('./temp'):
-        os.remove(f'./temp/{f}')
+    @functools.wraps(f)
+    def wrapper(self, user_id=None, **kwargs):
+        try:
+            user_id = int(user_id)
+        except (TypeError, ValueError):
+            user_id = None
+
+        # validate session
+        token = request.headers.get('Authorization')
+        sess_user_id, err = tokens.read_session(token) if token and user_id is not None else (None, None)
+        if sess_user_id is None or err is not None or sess_user_id != user_id:
+            res = jsonify({
+                'message': 'Invalid session.'
+            })
+            res.status_code = 403
+            return res
+        return f(self, user_id, **kwargs)
+    return wrapper
+
+
+# most medications returned by the ingredient endpoints
+MAX_INGREDIENT_RESULTS = 100
+# medications returned with a classify-by-image prediction
+MAX_CLASSIFY_RESULTS = 5
+# most classes a classify-by-image request can ask for with topK
+MAX_TOP_K = 10
 
 
 # User resources
@@ -124,6 +176,8 @@ class SignUp(Resource):
             })
             res.status_code = 400
             return res
+        except hashing.HashQueueFullError:
+            return server_busy()
 
 
 class Login(Resource):
@@ -150,8 +204,8 @@ class Login(Resource):
 
             # validate login info
             user_data, err = db.read_user_by_email(req.email)
-            if user_data is not None and 'passwordHash' in user_data and 'salt' in user_data and (validate_password(
-                    req.password, user_data['passwordHash'], user_data['salt']) or validate_password(req.password, user_data['tempPasswordHash'], user_data['tempSalt'])) and err is None:
+            if user_data is not None and 'passwordHash' in user_data and 'salt' in user_data and validate_user_password(
+                    req.password, user_data) and err is None:
                 # valid login details, produce session token
                 res = jsonify({
                     'userId': user_data['userId'],
@@ -171,6 +225,8 @@ class Login(Resource):
             })
             res.status_code = 400
             return res
+        except hashing.HashQueueFullError:
+            return server_busy()
 
 
 class ResetPassword(Resource):
@@ -205,6 +261,7 @@ class ResetPassword(Resource):
             # compose password recovery email message
             sender_address = 'noreply.snaprx@gmail.com'
             temp_pass = ''.join(secrets.choice(string.ascii_uppercase + string.ascii_lowercase) for _ in range(15))
+            temp_password_hash, temp_salt = hash_password(temp_pass)
             msg = MIMEText(f'{user_data["firstName"]},\n\nA request has been made to reset your SnapRx account password. Please use the provided temporary password to access your account.\n\nTemporary password: {temp_pass}', 'plain')
             msg['Subject'] = 'Your SnapRx temporary password'
             msg['From'] = sender_address
@@ -220,7 +277,6 @@ class ResetPassword(Resource):
                 conn.sendmail(sender_address, [req.email], msg.as_string())
 
                 # update temporary password details
-                temp_password_hash, temp_salt = hash_password(temp_pass)
                 db.update_user_temp_password(user_data['userId'], temp_password_hash, temp_salt)
 
                 res = jsonify({
@@ -243,6 +299,8 @@ class ResetPassword(Resource):
             })
             res.status_code = 400
             return res
+        except hashing.HashQueueFullError:
+            return server_busy()
         except Exception as e:
             res = jsonify({
                 'message': str(e)
@@ -252,6 +310,7 @@ class ResetPassword(Resource):
 
 
 class ValidateUserSession(Resource):
+    @require_session
     def post(self, user_id):
         """
         /api/v1/users/<user_id>/validate-session {POST}
@@ -265,31 +324,43 @@ class ValidateUserSession(Resource):
             [message]: status message
             [errors]: list of errors
         """
-        try:
-            # validate session
-            user_id = int(user_id)
-            token = request.headers.get('Authorization')
-            sess_user_id, err = db.read_session(token)
-            if err is not None or sess_user_id != user_id:
-                res = jsonify({
-                    'message': 'Invalid session.'
-                })
-                res.status_code = 403
-            else:
-                res = jsonify({
-                    'message': 'Session validated.'
-                })
-                res.status_code = 200
-            return res
-        except Exception as e:
+        res = jsonify({
+            'message': 'Session validated.'
+        })
+        res.status_code = 200
+        return res
+
+
+class Logout(Resource):
+    @require_session
+    def post(self, user_id):
+        """
+        /api/v1/users/<user_id>/logout {POST}
+
+        End user session.
+
+        Request:
+            N/A
+
+        Response:
+            [message]: status message
+        """
+        _, err = tokens.delete_session(user_id, request.headers.get('Authorization'))
+        if err is None:
             res = jsonify({
-                'message': str(e)
+                'message': 'Logged out.'
             })
-            res.status_code = 403
-            return res
+            res.status_code = 200
+        else:
+            res = jsonify({
+                'message': 'An error occurred when ending session.'
+            })
+            res.status_code = 500
+        return res
 
 
 class UpdatePassword(Resource):
+    @require_session
     def post(self, user_id):
         """
         /api/v1/users/<user_id>/update-password {POST}
@@ -308,25 +379,15 @@ class UpdatePassword(Resource):
             # parse request
             req_json = request.get_json(force=True)
             req = UpdatePasswordReq(**req_json)
-            user_id = int(user_id)
-
-            # validate session
-            token = request.headers.get('Authorization')
-            sess_user_id, err = db.read_session(token)
-            if err is not None or sess_user_id != user_id:
-                res = jsonify({
-                    'message': 'Invalid session.'
-                })
-                res.status_code = 403
-                return res
 
             # fetch user object
             user_data, err = db.read_user_by_id(user_id)
-            if user_data is not None and (validate_password(req.oldPassword, user_data['passwordHash'], user_data['salt']) or validate_password(req.oldPassword, user_data['tempPasswordHash'], user_data['tempSalt'])) and err is None:
+            if user_data is not None and validate_user_password(req.oldPassword, user_data) and err is None:
                 # valid old password, update password
                 password_hash, salt = hash_password(req.newPassword)
                 db.update_user_password(user_data['userId'], password_hash, salt)
                 db.update_user_temp_password(user_data['userId'], None, None)
+                tokens.revoke_user(user_id, keep_token=request.headers.get('Authorization'))
                 res = jsonify({
                     'message': 'User password updated.'
                 })
@@ -344,9 +405,12 @@ class UpdatePassword(Resource):
             })
             res.status_code = 400
             return res
+        except hashing.HashQueueFullError:
+            return server_busy()
 
 
 class User(Resource):
+    @require_session
     def get(self, user_id=None):
         """
         /api/v1/users/<user_id> {GET}
@@ -363,17 +427,6 @@ class User(Resource):
             savedMedications: list of user's saved medications
             [message]: status message
         """
-        # validate session
-        user_id = int(user_id)
-        token = request.headers.get('Authorization')
-        sess_user_id, err = db.read_session(token)
-        if err is not None or sess_user_id != user_id:
-            res = jsonify({
-                'message': 'Invalid session.'
-            })
-            res.status_code = 403
-            return res
-
         user_data, err = db.read_user_by_id(user_id)
         if user_data is not None and err is None:
             res = jsonify({
@@ -390,6 +443,7 @@ class User(Resource):
             res.status_code = 403
         return res
 
+    @require_session
     def put(self, user_id=None):
         """
         /api/v1/users/<user_id> {PUT}
@@ -409,17 +463,6 @@ class User(Resource):
             # parse request
             req_json = request.get_json(force=True)
             req = UpdateUserDetailsReq(**req_json)
-            user_id = int(user_id)
-
-            # validate session
-            token = request.headers.get('Authorization')
-            sess_user_id, err = db.read_session(token)
-            if err is not None or sess_user_id != user_id:
-                res = jsonify({
-                    'message': 'Invalid session.'
-                })
-                res.status_code = 403
-                return res
 
             user_data, err = db.read_user_by_id(user_id)
             if user_data is not None and err is None:
@@ -461,6 +504,7 @@ class User(Resource):
             res.status_code = 400
             return res
 
+    @require_session
     def delete(self, user_id=None):
         """
         /api/v1/users/<user_id> {DELETE}
@@ -478,22 +522,12 @@ class User(Resource):
             # parse request
             req_json = request.get_json(force=True)
             req = DeleteUserReq(**req_json)
-            user_id = int(user_id)
-
-            # validate session
-            token = request.headers.get('Authorization')
-            sess_user_id, err = db.read_session(token)
-            if err is not None or sess_user_id != user_id:
-                res = jsonify({
-                    'message': 'Invalid session.'
-                })
-                res.status_code = 403
-                return res
 
             user_data, err = db.read_user_by_id(user_id)
             if user_data is not None and validate_password(req.password, user_data['passwordHash'], user_data['salt']) and err is None:
                 # valid password, delete user
                 db.delete_user(user_id)
+                tokens.revoke_user(user_id)
                 res = jsonify({
                     'message': 'User account deleted.'
                 })
@@ -511,9 +545,12 @@ class User(Resource):
             })
             res.status_code = 400
             return res
+        except hashing.HashQueueFullError:
+            return server_busy()
 
 
 class UserMedications(Resource):
+    @require_session
     def get(self, user_id):
         """
         /api/v1/users/<user_id>/medications {GET}
@@ -527,17 +564,6 @@ class UserMedications(Resource):
             medications: list of user's saved medications
             [message]: status message
         """
-        # validate session
-        user_id = int(user_id)
-        token = request.headers.get('Authorization')
-        sess_user_id, err = db.read_session(token)
-        if err is not None or sess_user_id != user_id:
-            res = jsonify({
-                'message': 'Invalid session.'
-            })
-            res.status_code = 403
-            return res
-
         user_medications, err = db.read_user_medications(user_id)
         if user_medications is not None and err is None:
             # retrieved user medication data, return success
@@ -553,6 +579,7 @@ class UserMedications(Resource):
             res.status_code = 500
         return res
 
+    @require_session
     def put(self, user_id, med_id):
         """
         /api/v1/users/<user_id>/medications/<med_id> {PUT}
@@ -565,17 +592,6 @@ class UserMedications(Resource):
         Response:
             [message]: status message
         """
-        # validate session
-        user_id = int(user_id)
-        token = request.headers.get('Authorization')
-        sess_user_id, err = db.read_session(token)
-        if err is not None or sess_user_id != user_id:
-            res = jsonify({
-                'message': 'Invalid session.'
-            })
-            res.status_code = 403
-            return res
-
         res, err = db.create_user_medication_map(user_id, med_id)
         if res is not None and err is None:
             res = jsonify({
@@ -589,6 +605,7 @@ class UserMedications(Resource):
             res.status_code = 500
         return res
 
+    @require_session
     def post(self, user_id):
         """
         /api/v1/users/<user_id>/medications/check-saved {POST}
@@ -606,17 +623,6 @@ class UserMedications(Resource):
             # parse request
             req_json = request.get_json(force=True)
             req = CheckSavedMedicationReq(**req_json)
-            user_id = int(user_id)
-
-            # validate session
-            token = request.headers.get('Authorization')
-            sess_user_id, err = db.read_session(token)
-            if err is not None or sess_user_id != user_id:
-                res = jsonify({
-                    'message': 'Invalid session.'
-                })
-                res.status_code = 403
-                return res
 
             user_med_map, err = db.read_user_medication(user_id, req.medId)
             if user_med_map is not None and err is None:
@@ -638,6 +644,7 @@ class UserMedications(Resource):
             res.status_code = 400
             return res
 
+    @require_session
     def delete(self, user_id, med_id):
         """
         /api/v1/users/<user_id>/medications/<med_id> {DELETE}
@@ -650,17 +657,6 @@ class UserMedications(Resource):
         Response:
             [message]: status message
         """
-        # validate session
-        user_id = int(user_id)
-        token = request.headers.get('Authorization')
-        sess_user_id, err = db.read_session(token)
-        if err is not None or sess_user_id != user_id:
-            res = jsonify({
-                'message': 'Invalid session.'
-            })
-            res.status_code = 403
-            return res
-
         res, err = db.delete_user_medication_map(user_id, med_id)
         if res is not None and err is None:
             res = jsonify({
@@ -806,6 +802,9 @@ class SearchMedications(Resource):
 
         Request:
             query: query string
+            [sort]: 'relevance' (default) or 'price' for cheapest first
+            [minPrice]: only medications priced at least this much
+            [maxPrice]: only medications priced at most this much
 
         Response:
             results: list of medications matching search query
@@ -815,7 +814,7 @@ class SearchMedications(Resource):
         try:
             req_json = request.get_json(force=True)
             req = SearchMedicationsReq(**req_json)
-            res, err = db.search_medication(req.query)
+            res, err = search.search_medications(req.query, sort=req.sort, min_price=req.minPrice, max_price=req.maxPrice)
             if err is None:
                 if res is not None:
                     res = jsonify({
@@ -840,6 +839,149 @@ class SearchMedications(Resource):
             return res
 
 
+class SuggestMedications(Resource):
+    def get(self):
+        """
+        /api/v1/medications/suggest?prefix=<prefix>[&limit=<limit>] {GET}
+
+        Get typeahead suggestions of medication names starting with a prefix.
+
+        Request:
+            prefix: beginning of a medication name
+            [limit]: maximum number of suggestions (default 10, max 50)
+
+        Response:
+            suggestions: list of medication names, most common first
+            [message]: status message
+            [errors]: list of errors
+        """
+        try:
+            req = SuggestMedicationsReq(**request.args.to_dict())
+            suggestions, err = search.suggest_medications(req.prefix, req.limit)
+            if err is None:
+                res = jsonify({
+                    'suggestions': suggestions
+                })
+                res.status_code = 200
+            else:
+                res = jsonify({
+                    'message': 'Unable to get medication suggestions.'
+                })
+                res.status_code = 500
+            return res
+        except ValidationError as e:
+            res = jsonify({
+                'errors': e.errors()
+            })
+            res.status_code = 400
+            return res
+
+
+class MedicationsByIngredient(Resource):
+    def get(self):
+        """
+        /api/v1/medications/by-ingredient?name=<name>[&activeOnly=<bool>][&limit=<limit>] {GET}
+
+        Get medications containing an ingredient whose name starts with the given name.
+
+        Request:
+            name: ingredient name or beginning of one
+            [activeOnly]: only match active ingredients (default false)
+            [limit]: maximum number of medications (default 50, max 100)
+
+        Response:
+            results: list of medications containing the ingredient
+            [message]: status message
+            [errors]: list of errors
+        """
+        try:
+            req = MedicationsByIngredientReq(**request.args.to_dict())
+            results, err = db.search_medications_by_ingredient(req.name, req.activeOnly,
+                                                               max(1, min(req.limit, MAX_INGREDIENT_RESULTS)))
+            if err is None:
+                res = jsonify({
+                    'results': results
+                })
+                res.status_code = 200
+            else:
+                res = jsonify({
+                    'message': 'Unable to get medications for provided ingredient.'
+                })
+                res.status_code = 500
+            return res
+        except ValidationError as e:
+            res = jsonify({
+                'errors': e.errors()
+            })
+            res.status_code = 400
+            return res
+
+
+class MedicationIngredients(Resource):
+    def get(self, med_id=None):
+        """
+        /api/v1/medications/<med_id>/ingredients {GET}
+
+        Get the active and inactive ingredients of a medication.
+
+        Request:
+            N/A
+
+        Response:
+            ingredients: list of ingredients, active ingredients first
+            [message]: status message
+        """
+        ingredients, err = db.read_medication_ingredients(med_id)
+        if err is None:
+            res = jsonify({
+                'ingredients': ingredients
+            })
+            res.status_code = 200
+        else:
+            res = jsonify({
+                'message': 'Unable to fetch medication ingredients.'
+            })
+            res.status_code = 500
+        return res
+
+
+class SimilarMedications(Resource):
+    def get(self, med_id=None):
+        """
+        /api/v1/medications/<med_id>/similar[?limit=<limit>] {GET}
+
+        Get medications sharing active ingredients with a medication, most shared ingredients first.
+
+        Request:
+            [limit]: maximum number of medications (default 20, max 100)
+
+        Response:
+            results: list of medications, each with the number of sharedIngredients
+            [message]: status message
+            [errors]: list of errors
+        """
+        try:
+            req = SimilarMedicationsReq(**request.args.to_dict())
+            results, err = db.read_medications_sharing_ingredients(med_id, max(1, min(req.limit, MAX_INGREDIENT_RESULTS)))
+            if err is None:
+                res = jsonify({
+                    'results': results
+                })
+                res.status_code = 200
+            else:
+                res = jsonify({
+                    'message': 'Unable to fetch similar medications.'
+                })
+                res.status_code = 500
+            return res
+        except ValidationError as e:
+            res = jsonify({
+                'errors': e.errors()
+            })
+            res.status_code = 400
+            return res
+
+
 class ClassifyMedicationByImage(Resource):
     def post(self):
         """
@@ -849,26 +991,88 @@ class ClassifyMedicationByImage(Resource):
 
         Request:
             img: uploaded image
+            [topK]: form field or query parameter, number of most probable classes to return (max 10)
 
         Response:
             predMedClass: predicted medication class
             predConfidence: confidence of prediction (0-1)
             results: list of meds matching predicted class
+            [predictions]: with topK, list of the topK most probable classes, each with predMedClass, predConfidence
+                and results
             [message]: status message
             [errors]: list of errors
         """
-        img = request.files['img']
-        img_path = f'temp/{img.filename}'
-        img.save(img_path)
-        prediction, confidence = predict(img_path)
-        clear_temp()
-        results, err = db.search_medication(prediction.split(' ')[0])
-        if results is not None and err is None and len(results) != 0:
+        img = request.files.get('img')
+        if img is None:
+            res = jsonify({
+                'message': 'No image uploaded.'
+            })
+            res.status_code = 400
+            return res
+        try:
+            req = ClassifyMedicationByImageReq(**{**request.args.to_dict(), **request.form.to_dict()})
+        except ValidationError as e:
+            res = jsonify({
+                'errors': e.errors()
+            })
+            res.status_code = 400
+            return res
+        try:
+            # the upload is decoded from memory, it is never written to disk
+            image = newclassifier.load_image(img.stream)
+        except ValueError:
             res = jsonify({
+                'message': 'Unable to read uploaded image.'
+            })
+            res.status_code = 400
+            return res
+
+        # requests arriving while the model is still loading are turned away instead of holding a thread until it is
+        if not newclassifier.is_ready() and newclassifier.is_loading():
+            return server_busy()
+        try:
+            # a repeated image skips the model, its MAX_TOP_K most probable classes are cached whatever topK asked for
+            key = newclassifier.cache_key(image)
+            predictions = newclassifier.prediction_cache.get(key)
+            if predictions is None:
+                predictions = newclassifier.predict_top_k(image, MAX_TOP_K)
+                newclassifier.prediction_cache.set(key, predictions)
+        except batching.BatchQueueFullError:
+            return server_busy()
+        except Exception as e:
+            # the model failed to load (the next request tries again) or to run
+            print(e)
+            res = jsonify({
+                'message': 'Image classifier is unavailable.'
+            })
+            res.status_code = 500
+            return res
+        predictions = predictions[:1 if req.topK is None else max(1, min(req.topK, MAX_TOP_K))]
+
+        # the medications of every returned class are read in one query
+        class_results, err = db.read_class_medications([name for name, _ in predictions], MAX_CLASSIFY_RESULTS)
+        # classes the class map (classmap.py) has no medications for keep the old catalog search, at any rank
+        for name, _ in predictions:
+            if class_results is None or err is not None:
+                break
+            if len(class_results[name]) == 0:
+                results, err = db.search_medication(name.split(' ')[0])
+                if results is not None:
+                    class_results[name] = results[:MAX_CLASSIFY_RESULTS]
+        prediction, confidence = predictions[0]
+        if class_results is not None and err is None and len(class_results[prediction]) != 0:
+            body = {
                 'predMedClass': prediction,
                 'predConfidence': str(round(confidence, 2)),
-                'results': results[:5]
-            })
+                'results': class_results[prediction]
+            }
+            if req.topK is not None:
+                body['predictions'] = [{
+                    'predMedClass': name,
+                    'predConfidence': str(round(probability, 2)),
+                    'results': class_results[name]
+                } for name, probability in predictions]
+            res = jsonify(body)
             res.status_code = 200
         else:
             res = jsonify({
@@ -909,7 +1113,7 @@ class ClassifyMedicationByDescription(Resource):
         """
         /api/v1/medications/classify-by-description {POST}
 
-        Classify medication by physical description.
+        Classify medication by physical description, best matching medications first.
 
         Request:
             [shape]: shape of medication
@@ -928,7 +1132,7 @@ class ClassifyMedicationByDescription(Resource):
             req_json = request.get_json(force=True)
             req = ClassifyMedicationByDescriptionReq(**req_json)
 
-            res, err = db.search_medication_by_attributes(
+            res, err = search.search_medications_by_attributes(
                 req.shape,
                 req.size,
                 req.imprintFront,
@@ -955,8 +1159,76 @@ class ClassifyMedicationByDescription(Resource):
             return res
 
 
+# Server resources
+
+class Metrics(Resource):
+    def get(self):
+        """
+        /api/v1/metrics {GET}
+
+        Get server cache and connection pool counters.
+
+        Request:
+            N/A
+
+        Response:
+            sessionCache: session validation cache counters
+            dbPool: database connection pool usage
+            passwordHashing: password hashing executor counters
+            imageClassifier: image classifier micro-batching counters
+            predictionCache: image classifier prediction cache counters
+        """
+        res = jsonify({
+            'sessionCache': db.session_cache.stats(),
+            'dbPool': db.pool.stats(),
+            'passwordHashing': hashing.executor.stats(),
+            'imageClassifier': newclassifier.batcher.stats(),
+            'predictionCache': newclassifier.prediction_cache.stats()
+        })
+        res.status_code = 200
+        return res
+
+
+class Readiness(Resource):
+    def get(self):
+        """
+        /api/v1/ready {GET}
+
+        Check whether the server is ready for classify-by-image requests, i.e. the image classifier is loaded and
+        warmed up. Responds 503 while it is still loading, so load balancers can hold traffic back.
+
+        Request:
+            N/A
+
+        Response:
+            ready: boolean indicating readiness
+            classifier: image classifier load state
+        """
+        status = newclassifier.status()
+        res = jsonify({
+            'ready': status['ready'],
+            'classifier': status
+        })
+        res.status_code = 200 if status['ready'] else 503
+        return res
+
+
+class InMemoryRequest(Request):
+    """
+    Request whose uploaded files are buffered in memory instead of being spooled to temporary files once they are
+    larger than 500KB, bounded by MAX_UPLOAD_BYTES
+    """
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return io.BytesIO()
+
+
+# largest request body accepted, larger requests get a 413
+MAX_UPLOAD_BYTES = int(os.environ.get('MAX_UPLOAD_BYTES', 16 * 1024 * 1024))
+
 # init app and api objects
 app = Flask(__name__)
+app.request_class = InMemoryRequest
+app.config['MAX_CONTENT_LENGTH'] = MAX_UPLOAD_BYTES
 api = Api(app)
 
 # swagger documentation setup
@@ -985,6 +1257,8 @@ api.add_resource(ResetPassword,
                  API_BASE + 'users/reset-password')
 api.add_resource(ValidateUserSession,
                  API_BASE + 'users/<user_id>/validate-session')
+api.add_resource(Logout,
+                 API_BASE + 'users/<user_id>/logout')
 api.add_resource(UpdatePassword,
                  API_BASE + 'users/<user_id>/update-password')
 api.add_resource(UserMedications,
@@ -998,6 +1272,14 @@ api.add_resource(Medication,
                  API_BASE + 'medications/<med_id>')
 api.add_resource(SearchMedications,
                  API_BASE + 'medications/search')
+api.add_resource(SuggestMedications,
+                 API_BASE + 'medications/suggest')
+api.add_resource(MedicationsByIngredient,
+                 API_BASE + 'medications/by-ingredient')
+api.add_resource(MedicationIngredients,
+                 API_BASE + 'medications/<med_id>/ingredients')
+api.add_resource(SimilarMedications,
+                 API_BASE + 'medications/<med_id>/similar')
 api.add_resource(ClassifyMedicationByImage,
                  API_BASE + 'medications/classify-by-image')
 api.add_resource(MedicationImage,
@@ -1005,12 +1287,21 @@ api.add_resource(MedicationImage,
 api.add_resource(ClassifyMedicationByDescription,
                  API_BASE + 'medications/classify-by-description')
 
+# Attach server resource endpoints
+api.add_resource(Metrics,
+                 API_BASE + 'metrics')
+api.add_resource(Readiness,
+                 API_BASE + 'ready')
+
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument('-prod', action='store_true')
     args = parser.parse_args()
 
+    # load the image classifier as CLASSIFIER_LOAD_MODE asks, by default in the background while the server starts
+    newclassifier.start()
+
     # determine whether to run production or dev environment
     if args.prod:
         serve(app, host='0.0.0.0', port='8080')
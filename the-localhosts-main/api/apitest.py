@@ -1,8 +1,19 @@
+import io
 import os
+import tempfile
+import time
 import unittest
 import json
+import numpy as np
 import apis
+import newclassifier
 import db
+import hashing
+import batching
+import numpyengine
+import tokens
+import search
+from concurrent.futures import ThreadPoolExecutor
 
 
 class TestApiMethods(unittest.TestCase):
@@ -147,14 +158,6 @@ class TestApiMethods(unittest.TestCase):
         session_token = apis.generate_session_token(int(self._test_user_data['userId']))
         self.assertIsNot(session_token, None) 
         
-    def test_clear_temp(self):
-        """
-        Test clearing temp directory function
-        """
-        apis.clear_temp()
-        self.assertFalse(next(os.scandir('./temp'), None))
-
-
     def test_signup(self):
         """
         Test user sign up API: /api/v1/users/signup {POST}
@@ -183,6 +186,22 @@ class TestApiMethods(unittest.TestCase):
         self.assertTrue(b'userId' in res.data)
         self.assertTrue(b'token' in res.data)
 
+    def test_login_hash_queue_full(self):
+        """
+        Test that logins are rejected with 503 while the password hashing queue is full
+        """
+        queue_limit = hashing.executor.queue_limit
+        hashing.executor.queue_limit = 0
+        try:
+            res = self._tester.post('/api/v1/users/login', data=json.dumps({
+                'email': self._test_user_data['email'],
+                'password': self._test_user_data['password']
+            }))
+        finally:
+            hashing.executor.queue_limit = queue_limit
+        self.assertEqual(res.status_code, 503)
+        self.assertIn('Retry-After', res.headers)
+
     def test_reset_password(self):
         """
         Test user reset password API: /api/v1/users/reset-password {POST} 
@@ -207,6 +226,98 @@ class TestApiMethods(unittest.TestCase):
         self.assertEqual(res.content_type, 'application/json')
         self.assertTrue(b'message' in res.data)
 
+    def test_signed_session_token(self):
+        """
+        Test that signed session tokens authenticate without a Sessions row and stop working once revoked
+        """
+        token = tokens.issue_token(self._test_user_data['userId'])
+        res = self._tester.post(
+            f'/api/v1/users/{self._test_user_data["userId"]}/validate-session',
+            headers={
+                'Authorization': token
+            })
+        self.assertEqual(res.status_code, 200)
+
+        _, err = tokens.revoke_token(token)
+        self.assertIsNone(err)
+        res = self._tester.post(
+            f'/api/v1/users/{self._test_user_data["userId"]}/validate-session',
+            headers={
+                'Authorization': token
+            })
+        self.assertEqual(res.status_code, 403)
+
+        # the revocation is stored, so a restarted or another process reads it back
+        with tokens._revocation_lock:
+            tokens.revoked_tokens.clear()
+            tokens._revocation_sync['lastId'] = 0
+        tokens.sync_revocations(force=True)
+        self.assertIsNone(tokens.verify_token(token))
+
+        # revoking every token of the user spares only the kept session
+        kept = tokens.issue_token(self._test_user_data['userId'])
+        other = tokens.issue_token(self._test_user_data['userId'])
+        time.sleep(0.002)
+        _, err = tokens.revoke_user(self._test_user_data['userId'], keep_token=kept)
+        self.assertIsNone(err)
+        self.assertEqual(tokens.verify_token(kept), self._test_user_data['userId'])
+        self.assertIsNone(tokens.verify_token(other))
+
+    def test_invalid_user_session(self):
+        """
+        Test that user-scoped APIs reject tokens belonging to another user
+        """
+        res = self._tester.get(
+            f'/api/v1/users/{self._test_user_data["userId"]}',
+            headers={
+                'Authorization': self._test_user2_token
+            })
+        self.assertEqual(res.status_code, 403)
+        self.assertEqual(res.content_type, 'application/json')
+
+    def test_session_cache(self):
+        """
+        Test that repeated session validation is served from the session cache
+        """
+        db.session_cache.clear()
+        misses = db.session_cache.misses
+        hits = db.session_cache.hits
+        for _ in range(3):
+            res = self._tester.post(
+                f'/api/v1/users/{self._test_user_data["userId"]}/validate-session',
+                headers={
+                    'Authorization': self._test_user_token
+                })
+            self.assertEqual(res.status_code, 200)
+        self.assertEqual(db.session_cache.misses - misses, 1)
+        self.assertEqual(db.session_cache.hits - hits, 2)
+
+    def test_metrics(self):
+        """
+        Test server metrics API: /api/v1/metrics {GET}
+        """
+        res = self._tester.get('/api/v1/metrics')
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.content_type, 'application/json')
+        self.assertTrue(b'sessionCache' in res.data)
+        self.assertTrue(b'passwordHashing' in res.data)
+        self.assertTrue(b'imageClassifier' in res.data)
+        self.assertTrue(b'predictionCache' in res.data)
+
+    def test_readiness(self):
+        """
+        Test readiness API: /api/v1/ready {GET}
+        """
+        res = self._tester.get('/api/v1/ready')
+        self.assertEqual(res.status_code, 200 if newclassifier.is_ready() else 503)
+        self.assertEqual(json.loads(res.data)['ready'], newclassifier.is_ready())
+
+        # once loaded and warmed up the server reports ready
+        newclassifier.load()
+        res = self._tester.get('/api/v1/ready')
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(json.loads(res.data)['ready'])
+
     def test_update_password(self):
         """
         Test user update password API: /api/v1/users/<user_id>/update-password {POST}
@@ -351,17 +462,154 @@ class TestApiMethods(unittest.TestCase):
         """
         Test search medications API: /api/v1/medications/search {POST}
         """
-        res = self._tester.post(f'/api/v1/medications/search', data=json.dumps({
+        res = self._tester.post('/api/v1/medications/search', data=json.dumps({
             'query': 'Ibuprofen'
         }))
         self.assertEqual(res.status_code, 200)
         self.assertEqual(res.content_type, 'application/json')
 
+    def test_search_medications_ranking(self):
+        """
+        Test that search results match every query term, including term prefixes
+        """
+        res = self._tester.post('/api/v1/medications/search', data=json.dumps({
+            'query': 'ibupro abc'
+        }))
+        self.assertEqual(res.status_code, 200)
+        results = json.loads(res.data)['results']
+        self.assertNotEqual(len(results), 0)
+        for r in results:
+            self.assertIn('ibupro', f'{r["medName"]} {r["rxString"]}'.lower())
+
+    def test_search_medications_by_price(self):
+        """
+        Test sorting and filtering search results by price
+        """
+        med_ids = []
+        for price in (7.5, None, 2.5):
+            med_id, err = db.create_medication('', 'Pricesorttest', '', 'round', 10, '', '', 'white', price, None)
+            self.assertIsNone(err)
+            med_ids.append(med_id)
+
+        try:
+            res = self._tester.post('/api/v1/medications/search', data=json.dumps({
+                'query': 'pricesorttest',
+                'sort': 'price'
+            }))
+            self.assertEqual(res.status_code, 200)
+            self.assertEqual([r['medId'] for r in json.loads(res.data)['results']], [med_ids[2], med_ids[0], med_ids[1]])
+
+            res = self._tester.post('/api/v1/medications/search', data=json.dumps({
+                'query': 'pricesorttest',
+                'minPrice': 5
+            }))
+            self.assertEqual(res.status_code, 200)
+            self.assertEqual([r['medId'] for r in json.loads(res.data)['results']], [med_ids[0]])
+
+            res = self._tester.post('/api/v1/medications/search', data=json.dumps({
+                'query': 'pricesorttest',
+                'sort': 'cheapest'
+            }))
+            self.assertEqual(res.status_code, 400)
+        finally:
+            for med_id in med_ids:
+                db.delete_medication(med_id)
+
+    def test_suggest_medications(self):
+        """
+        Test medication name suggestions API: /api/v1/medications/suggest {GET}
+        """
+        res = self._tester.get('/api/v1/medications/suggest?prefix=ibu')
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.content_type, 'application/json')
+        suggestions = json.loads(res.data)['suggestions']
+        self.assertIn(self._test_medication_data['medName'].lower(), [name.lower() for name in suggestions])
+        for name in suggestions:
+            self.assertTrue(name.lower().startswith('ibu'))
+
+        # non-positive limits are raised to one suggestion rather than slicing the list from its end
+        for limit in (0, -1):
+            res = self._tester.get(f'/api/v1/medications/suggest?prefix=ibu&limit={limit}')
+            self.assertEqual(res.status_code, 200)
+            self.assertEqual(json.loads(res.data)['suggestions'], suggestions[:1])
+
+    def test_search_index_rebuild_keeps_changes(self):
+        """
+        Test that medications changed while a search index is being rebuilt are not undone by the rebuild
+        """
+        def row(med_id, med_name):
+            return {'medId': med_id, 'rxString': '', 'medName': med_name, 'shape': 'round', 'size': 10,
+                    'imprintFront': '', 'imprintBack': '', 'color': 'white', 'price': None, 'priceSource': None}
+
+        index = search.MedicationSearchIndex(max_age=0)
+        db.medication_listeners.remove(index._on_change)
+        index.load([row(1, 'Rebuildtest Deleted')])
+
+        # the rebuild reads the rows before one medication is created and another deleted
+        build = index._build
+
+        def racing_build(rows):
+            index._on_change(2, row(2, 'Rebuildtest Created'))
+            index._on_change(1, None)
+            return build(rows)
+
+        index._build = racing_build
+        self.assertTrue(index.load([row(1, 'Rebuildtest Deleted')]))
+        self.assertEqual(index.search('rebuildtest'), [2])
+
+    def test_medication_ingredients(self):
+        """
+        Test ingredient APIs: /api/v1/medications/by-ingredient, /api/v1/medications/<med_id>/ingredients and
+        /api/v1/medications/<med_id>/similar {GET}
+        """
+        med_id = self._test_medication_data['medId']
+        other_med_id, err = db.create_medication('', 'Ingredient Test', '', 'round', 10, '', '', 'white', None, None)
+        self.assertIsNone(err)
+        ingredient_ids, err = db.create_ingredients(['TESTINGREDIENT ACTIVE', 'TESTINGREDIENT INACTIVE'])
+        self.assertIsNone(err)
+        active_id, inactive_id = ingredient_ids['TESTINGREDIENT ACTIVE'], ingredient_ids['TESTINGREDIENT INACTIVE']
+        _, err = db.replace_medication_ingredients([med_id, other_med_id], [
+            (med_id, active_id, True),
+            (med_id, inactive_id, False),
+            (other_med_id, active_id, True)
+        ])
+        self.assertIsNone(err)
+
+        try:
+            res = self._tester.get(f'/api/v1/medications/{med_id}/ingredients')
+            self.assertEqual(res.status_code, 200)
+            ingredients = json.loads(res.data)['ingredients']
+            self.assertEqual([i['ingredientName'] for i in ingredients], ['TESTINGREDIENT ACTIVE', 'TESTINGREDIENT INACTIVE'])
+            self.assertTrue(ingredients[0]['isActiveIngredient'])
+
+            res = self._tester.get('/api/v1/medications/by-ingredient?name=testingredient%20in')
+            self.assertEqual(res.status_code, 200)
+            self.assertEqual([m['medId'] for m in json.loads(res.data)['results']], [med_id])
+
+            res = self._tester.get('/api/v1/medications/by-ingredient?name=testingredient&activeOnly=true')
+            self.assertEqual(res.status_code, 200)
+            self.assertEqual({m['medId'] for m in json.loads(res.data)['results']}, {med_id, other_med_id})
+
+            res = self._tester.get(f'/api/v1/medications/{med_id}/similar')
+            self.assertEqual(res.status_code, 200)
+            results = json.loads(res.data)['results']
+            self.assertEqual([(m['medId'], m['sharedIngredients']) for m in results], [(other_med_id, 1)])
+
+            # a missing or blank name would match every ingredient
+            res = self._tester.get('/api/v1/medications/by-ingredient')
+            self.assertEqual(res.status_code, 400)
+            res = self._tester.get('/api/v1/medications/by-ingredient?name=%20')
+            self.assertEqual(res.status_code, 400)
+        finally:
+            db.delete_medication(other_med_id)
+            db.delete_ingredient(active_id)
+            db.delete_ingredient(inactive_id)
+
     def test_classify_medication_by_description(self):
         """
         Test classify medication by description API: /api/v1/medications/classify-by-description {POST}
         """
-        res = self._tester.post(f'/api/v1/medications/classify-by-description', data=json.dumps({
+        res = self._tester.post('/api/v1/medications/classify-by-description', data=json.dumps({
             'shape': 'round',
             'size': 10,
             'imprintFront': 'ABC',
@@ -372,6 +620,254 @@ class TestApiMethods(unittest.TestCase):
         self.assertEqual(res.content_type, 'application/json')
         self.assertTrue(b'results' in res.data)
 
+    def test_classify_medication_by_fuzzy_imprint(self):
+        """
+        Test that misread and partial imprints still find the medication, exact matches ranked first
+        """
+        res = self._tester.post('/api/v1/medications/classify-by-description', data=json.dumps({
+            'shape': 'round',
+            'imprintFront': 'A8C',
+            'imprintBack': 'XY'
+        }))
+        self.assertEqual(res.status_code, 200)
+        results = json.loads(res.data)['results']
+        self.assertIn(self._test_medication_data['medId'], [r['medId'] for r in results])
+
+    def test_classify_medication_by_partial_description(self):
+        """
+        Test that a medication matching most of a description is still returned when one attribute is wrong
+        """
+        res = self._tester.post('/api/v1/medications/classify-by-description', data=json.dumps({
+            'shape': 'round',
+            'size': 10,
+            'imprintFront': 'ABC',
+            'imprintBack': 'XYZ',
+            'color': 'purple'
+        }))
+        self.assertEqual(res.status_code, 200)
+        results = json.loads(res.data)['results']
+        self.assertIn(self._test_medication_data['medId'], [r['medId'] for r in results])
+
+    def test_micro_batcher(self):
+        """
+        Test that concurrently submitted items are batched and each caller gets its own result
+        """
+        batch_sizes = []
+
+        def double(items):
+            batch_sizes.append(len(items))
+            return [item * 2 for item in items]
+
+        batcher = batching.MicroBatcher(double, max_batch_size=4, max_wait=0.05)
+        with ThreadPoolExecutor(max_workers=16) as pool:
+            results = list(pool.map(batcher.submit, range(32)))
+        self.assertEqual(results, [i * 2 for i in range(32)])
+        self.assertLessEqual(max(batch_sizes), 4)
+        self.assertLess(len(batch_sizes), 32)
+        self.assertEqual(batcher.stats()['items'], 32)
+
+        # a failing batch fails each of its callers, and a full queue rejects new items
+        with self.assertRaises(ZeroDivisionError):
+            batching.MicroBatcher(lambda items: [1 / 0]).submit(1)
+        with self.assertRaises(batching.BatchQueueFullError):
+            batching.MicroBatcher(double, queue_limit=0).submit(1)
+
+    def test_load_image(self):
+        """
+        Test in-memory decoding of uploaded images to the model input size
+        """
+        with open(f'./static/img/{self._test_medication_class}.JPG', 'rb') as f:
+            data = f.read()
+        arr = newclassifier.load_image(data)
+        self.assertEqual(arr.shape, (*newclassifier.IMAGE_SIZE, 3))
+        self.assertEqual(arr.dtype.name, 'float32')
+        self.assertTrue((newclassifier.load_image(io.BytesIO(data)) == arr).all())
+        with self.assertRaises(ValueError):
+            newclassifier.load_image(b'not an image')
+
+    def test_numpy_engine(self):
+        """
+        Test that the NumPy engine's outputs match Keras' for the layer types train.py builds, and for the trained model
+        """
+        from keras import layers, models
+        model = models.Sequential([
+            layers.Rescaling(1. / 255, input_shape=(20, 18, 3)),
+            layers.Conv2D(8, (3, 3), activation='relu'),
+            layers.MaxPooling2D(2, 2),
+            layers.Conv2D(6, (3, 2), strides=(2, 1), padding='same', activation='relu'),
+            layers.MaxPooling2D((3, 3), strides=(1, 1), padding='same'),
+            layers.Flatten(),
+            layers.Dropout(0.5),
+            layers.Dense(16, activation='relu'),
+            layers.Dense(5, activation='softmax')
+        ])
+        images = np.random.default_rng(0).uniform(0, 255, (4, 20, 18, 3)).astype(np.float32)
+        with tempfile.TemporaryDirectory() as path:
+            numpyengine.save(model, path, list('abcde'))
+            engine = numpyengine.NumpyModel(path)
+            self.assertEqual(engine.class_names, list('abcde'))
+            np.testing.assert_allclose(engine.predict_on_batch(images), model.predict_on_batch(images), atol=1e-5)
+
+            if os.path.exists(newclassifier.MODEL_PATH):
+                trained = models.load_model(newclassifier.MODEL_PATH)
+                with open(f'./static/img/{self._test_medication_class}.JPG', 'rb') as f:
+                    image = newclassifier.load_image(f.read())[None]
+                numpyengine.save(trained, path, [str(i) for i in range(trained.output_shape[-1])])
+                np.testing.assert_allclose(numpyengine.NumpyModel(path).predict_on_batch(image),
+                                           trained.predict_on_batch(image), atol=1e-5)
+
+    def test_classify_medication_by_image_concurrent(self):
+        """
+        Test that concurrent classify-by-image uploads sharing a filename each get the prediction for their own image
+        """
+        names = [self._test_medication_class, 'AMOXICILLIN 500MG CAP']
+        images = {}
+        for name in names:
+            with open(f'./static/img/{name}.JPG', 'rb') as f:
+                images[name] = f.read()
+
+        def classify(name: str):
+            res = apis.app.test_client().post('/api/v1/medications/classify-by-image', data={
+                'img': (io.BytesIO(images[name]), 'upload.jpg')
+            }, content_type='multipart/form-data')
+            return res.status_code, json.loads(res.data).get('predMedClass')
+
+        # decoded inputs and predictions match the ones of sequential requests
+        decoded = {name: newclassifier.load_image(images[name]) for name in names}
+        expected = {name: classify(name) for name in names}
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            arrays = list(pool.map(lambda name: newclassifier.load_image(io.BytesIO(images[name])), names * 8))
+            results = list(pool.map(classify, names * 8))
+        for name, arr in zip(names * 8, arrays):
+            self.assertTrue((arr == decoded[name]).all())
+        self.assertEqual(results, [expected[name] for name in names * 8])
+
+        res = self._tester.post('/api/v1/medications/classify-by-image', data={
+            'img': (io.BytesIO(b'not an image'), 'upload.jpg')
+        }, content_type='multipart/form-data')
+        self.assertEqual(res.status_code, 400)
+
+    def test_prediction_cache(self):
+        """
+        Test that a re-uploaded image is answered from the prediction cache, under a key naming the served model version
+        """
+        with open(f'./static/img/{self._test_medication_class}.JPG', 'rb') as f:
+            image = f.read()
+
+        def classify():
+            res = self._tester.post('/api/v1/medications/classify-by-image', data={
+                'img': (io.BytesIO(image), 'upload.jpg')
+            }, content_type='multipart/form-data')
+            self.assertEqual(res.status_code, 200)
+            return json.loads(res.data)
+
+        newclassifier.prediction_cache.clear()
+        first = classify()
+        hits = newclassifier.prediction_cache.stats()['hits']
+        items = newclassifier.batcher.stats()['items']
+        self.assertEqual(classify(), first)
+        self.assertEqual(newclassifier.prediction_cache.stats()['hits'], hits + 1)
+        self.assertEqual(newclassifier.batcher.stats()['items'], items)
+
+        key = newclassifier.cache_key(newclassifier.load_image(image))
+        self.assertEqual(key[0], newclassifier.model_version)
+        self.assertEqual(newclassifier.prediction_cache.get(key)[0][0], first['predMedClass'])
+
+    def test_classify_medication_by_image_top_k(self):
+        """
+        Test classify-by-image top-k predictions: /api/v1/medications/classify-by-image {POST}
+        """
+        with open(f'./static/img/{self._test_medication_class}.JPG', 'rb') as f:
+            image = f.read()
+        res = self._tester.post('/api/v1/medications/classify-by-image', data={
+            'img': (io.BytesIO(image), 'upload.jpg'),
+            'topK': '3'
+        }, content_type='multipart/form-data')
+        self.assertEqual(res.status_code, 200)
+        data = json.loads(res.data)
+        predictions = data['predictions']
+        self.assertEqual(len(predictions), 3)
+        self.assertEqual(len({prediction['predMedClass'] for prediction in predictions}), 3)
+        self.assertEqual(predictions[0]['predMedClass'], data['predMedClass'])
+        self.assertEqual(predictions[0]['results'], data['results'])
+        confidences = [float(prediction['predConfidence']) for prediction in predictions]
+        self.assertEqual(confidences, sorted(confidences, reverse=True))
+
+        # without topK the response has no predictions list, and topK is validated
+        res = self._tester.post('/api/v1/medications/classify-by-image', data={
+            'img': (io.BytesIO(image), 'upload.jpg')
+        }, content_type='multipart/form-data')
+        self.assertNotIn('predictions', json.loads(res.data))
+        res = self._tester.post('/api/v1/medications/classify-by-image?topK=many', data={
+            'img': (io.BytesIO(image), 'upload.jpg')
+        }, content_type='multipart/form-data')
+        self.assertEqual(res.status_code, 400)
+
+    def test_classify_medication_by_image_unavailable(self):
+        """
+        Test that classify-by-image answers with JSON errors while the model is loading or after it failed to load
+        """
+        with open(f'./static/img/{self._test_medication_class}.JPG', 'rb') as f:
+            image = f.read()
+
+        def classify():
+            return self._tester.post('/api/v1/medications/classify-by-image', data={
+                'img': (io.BytesIO(image), 'upload.jpg')
+            }, content_type='multipart/form-data')
+
+        def fail_load():
+            raise OSError('model file missing')
+
+        newclassifier.load()
+        model, load_runtime = newclassifier.model, newclassifier._load_runtime
+        newclassifier.model = None
+        try:
+            newclassifier._load_state['loading'] = True
+            res = classify()
+            self.assertEqual(res.status_code, 503)
+            self.assertIn('Retry-After', res.headers)
+
+            newclassifier._load_state['loading'] = False
+            newclassifier._load_runtime = fail_load
+            res = classify()
+            self.assertEqual(res.status_code, 500)
+            self.assertEqual(res.content_type, 'application/json')
+        finally:
+            newclassifier._load_state['loading'] = False
+            newclassifier._load_state['error'] = None
+            newclassifier._load_runtime = load_runtime
+            newclassifier.model = model
+
+    def test_classify_medication_by_image_fallback(self):
+        """
+        Test that classes without class map medications fall back to catalog search at every rank
+        """
+        with open(f'./static/img/{self._test_medication_class}.JPG', 'rb') as f:
+            image = f.read()
+        # a class name that is in no class map, whose first word finds the test medication
+        unmapped = f'{self._test_medication_data["medName"]} Unmappedtest'
+
+        def classify(predictions):
+            predict_top_k = newclassifier.predict_top_k
+            newclassifier.predict_top_k = lambda arr, k: predictions
+            newclassifier.prediction_cache.clear()
+            try:
+                res = self._tester.post('/api/v1/medications/classify-by-image', data={
+                    'img': (io.BytesIO(image), 'upload.jpg'),
+                    'topK': '2'
+                }, content_type='multipart/form-data')
+            finally:
+                newclassifier.predict_top_k = predict_top_k
+                newclassifier.prediction_cache.clear()
+            self.assertEqual(res.status_code, 200)
+            predictions = json.loads(res.data)['predictions']
+            return {prediction['predMedClass']: prediction['results'] for prediction in predictions}
+
+        first = classify([(unmapped, 0.6), (self._test_medication_class, 0.3)])
+        second = classify([(self._test_medication_class, 0.6), (unmapped, 0.3)])
+        self.assertNotEqual(first[unmapped], [])
+        self.assertEqual(second[unmapped], first[unmapped])
+
     def test_get_medication_image(self):
         """
         Test get medication details API: /api/v1/medications/img/<med_name> {GET}
@@ -0,0 +1,87 @@
+# attributes.py
+# Compact integer codes for medication physical attributes
+
+import functools
+import os
+import re
+
+# Pillbox SPL shape names, stored as their index + 1 in Medications.shapeCode (0 = unknown)
+SHAPES = [
+    'BULLET', 'CAPSULE', 'CLOVER', 'DIAMOND', 'DOUBLE CIRCLE', 'FREEFORM', 'GEAR', 'HEPTAGON', 'HEXAGON', 'OCTAGON',
+    'OVAL', 'PENTAGON', 'RECTANGLE', 'ROUND', 'SEMI-CIRCLE', 'SQUARE', 'TEAR', 'TRAPEZOID', 'TRIANGLE'
+]
+# Pillbox SPL color names, stored as bit (1 << index) in Medications.colorMask so multi-colored pills set several bits
+COLORS = [
+    'BLACK', 'BLUE', 'BROWN', 'GRAY', 'GREEN', 'ORANGE', 'PINK', 'PURPLE', 'RED', 'TURQUOISE', 'WHITE', 'YELLOW'
+]
+
+# accepted size difference (mm) when matching a described size
+SIZE_TOLERANCE = int(os.environ.get('SIZE_TOLERANCE', 1))
+
+_SHAPE_CODES = {name: i + 1 for i, name in enumerate(SHAPES)}
+_COLOR_BITS = {name: 1 << i for i, name in enumerate(COLORS)}
+_COLOR_SEPARATORS = re.compile(r'[;,/&]|\bAND\b')
+
+
+def _normalize(text: str):
+    # drop qualifiers such as 'PENTAGON (5 SIDED)'
+    return ' '.join(re.sub(r'\(.*?\)', ' ', str(text)).upper().split())
+
+
+@functools.lru_cache(maxsize=1024)
+def shape_code(shape: [str, None]):
+    """
+    Get the code of a stored shape name
+
+    :param shape: shape name
+    :return: shape code, 0 if unknown
+    """
+    if shape is None:
+        return 0
+    return _SHAPE_CODES.get(_normalize(shape), 0)
+
+
+@functools.lru_cache(maxsize=1024)
+def color_mask(color: [str, None]):
+    """
+    Get the bitmask of a stored, possibly multi-colored, color name (e.g. 'WHITE;BLUE')
+
+    :param color: color name(s)
+    :return: color bitmask, 0 if unknown
+    """
+    if color is None:
+        return 0
+    mask = 0
+    for part in _COLOR_SEPARATORS.split(_normalize(color)):
+        mask |= _COLOR_BITS.get(part.strip(), 0)
+    return mask
+
+
+def matching_shape_codes(query: str):
+    """
+    Get the codes of every shape whose name contains a described shape
+
+    :param query: described shape
+    :return: list of shape codes
+    """
+    query = _normalize(query)
+    if query in _SHAPE_CODES:
+        return [_SHAPE_CODES[query]]
+    return [code for name, code in _SHAPE_CODES.items() if query in name]
+
+
+def matching_color_bits(query: str):
+    """
+    Get the bits of every color whose name contains a described color
+
+    :param query: described color
+    :return: color bitmask, 0 if no color matches
+    """
+    query = _normalize(query)
+    if query in _COLOR_BITS:
+        return _COLOR_BITS[query]
+    mask = 0
+    for name, bit in _COLOR_BITS.items():
+        if query in name:
+            mask |= bit
+    return mask
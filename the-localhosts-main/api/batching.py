@@ -0,0 +1,127 @@
+# batching.py
+# Dynamic micro-batching of work items submitted by concurrent request threads
+#
+# Model inference has a high fixed cost per call, so running one image per call wastes most of the throughput the
+# model could deliver. Request threads submit items to a MicroBatcher and block; a single worker thread runs queued
+# items as one batch as soon as max_batch_size items are waiting or the oldest one has waited max_wait seconds, and
+# hands every request its own result.
+
+import collections
+import threading
+import time
+from concurrent.futures import Future
+
+
+class BatchQueueFullError(Exception):
+    """
+    Raised when an item is submitted while queue_limit items are already waiting
+    """
+    pass
+
+
+class MicroBatcher:
+    """
+    Runs items submitted from many threads through a batch function, max_batch_size at a time
+
+    Attributes:
+        fn: function of a list of items returning a list of results in the same order
+        max_batch_size: most items run in one call of fn
+        max_wait: seconds the oldest waiting item may wait for the batch to fill up
+        queue_limit: items waiting at once, beyond which new items are rejected
+    """
+
+    def __init__(self, fn, max_batch_size: int = 16, max_wait: float = 0.005, queue_limit: int = 256,
+                 name: str = 'batcher'):
+        self.fn = fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.queue_limit = queue_limit
+        self.name = name
+        self._queue = collections.deque()
+        self._cond = threading.Condition()
+        self._thread = None
+        self._batches = 0
+        self._items = 0
+        self._rejected = 0
+        self._failed = 0
+        self._peak_queued = 0
+        self._wait_time = 0.0
+        self._run_time = 0.0
+
+    def submit(self, item):
+        """
+        Queue an item and wait for its result
+
+        :param item: input to the batch function
+        :return: result of the batch function for this item
+        """
+        future = Future()
+        with self._cond:
+            if len(self._queue) >= self.queue_limit:
+                self._rejected += 1
+                raise BatchQueueFullError()
+            self._queue.append((item, future, time.perf_counter()))
+            self._peak_queued = max(self._peak_queued, len(self._queue))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+                self._thread.start()
+            self._cond.notify()
+        return future.result()
+
+    def _next_batch(self):
+        with self._cond:
+            while not self._queue:
+                self._cond.wait()
+            # wait for a full batch, at most until the oldest item has waited max_wait
+            deadline = self._queue[0][2] + self.max_wait
+            while len(self._queue) < self.max_batch_size:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            return [self._queue.popleft() for _ in range(min(len(self._queue), self.max_batch_size))]
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            start = time.perf_counter()
+            try:
+                results = self.fn([item for item, _, _ in batch])
+                if len(results) != len(batch):
+                    raise RuntimeError(f'{self.name} returned {len(results)} results for {len(batch)} items')
+            except Exception as e:
+                for _, future, _ in batch:
+                    future.set_exception(e)
+                with self._cond:
+                    self._failed += len(batch)
+                continue
+            end = time.perf_counter()
+            for (_, future, _), result in zip(batch, results):
+                future.set_result(result)
+            with self._cond:
+                self._batches += 1
+                self._items += len(batch)
+                self._wait_time += sum(start - queued_at for _, _, queued_at in batch)
+                self._run_time += end - start
+
+    def stats(self):
+        """
+        Get batcher counters
+
+        :return: dict of batcher counters
+        """
+        with self._cond:
+            return {
+                'maxBatchSize': self.max_batch_size,
+                'maxWaitMs': round(self.max_wait * 1000, 2),
+                'queueLimit': self.queue_limit,
+                'queued': len(self._queue),
+                'peakQueued': self._peak_queued,
+                'batches': self._batches,
+                'items': self._items,
+                'rejected': self._rejected,
+                'failed': self._failed,
+                'avgBatchSize': round(self._items / self._batches, 2) if self._batches else 0.0,
+                'avgWaitMs': round(self._wait_time / self._items * 1000, 2) if self._items else 0.0,
+                'avgBatchMs': round(self._run_time / self._batches * 1000, 2) if self._batches else 0.0
+            }
@@ -0,0 +1,117 @@
+# classmap.py
+# Class-to-medication map: the medications each image classifier class stands for, stored in ClassMedMap
+#
+# Classes are C3PI image set names (model/getdata.py) and medications are matched to them by name once, when the
+# model or the catalog is published, so classify-by-image reads a class' medications with one primary key lookup
+# instead of searching the catalog for the first word of the label. A medication matches a class if its name is the
+# class name, ignoring case, spacing and '/' (written '-' in class names). Classes with no such medication fall back to
+# the medications whose names extend the class name by whole words ('ADALAT CC' -> 'Adalat CC 30 mg'), then to the
+# longest whole-word prefix of the class name that is a medication name ('AMOXICILLIN Tablets USP' -> 'Amoxicillin').
+#
+# Usage (from api), after publishing a model or importing medications (getdbdata.py runs it after every import):
+#   python classmap.py [-classnames ../model/class_names.pickle]
+
+import argparse
+import bisect
+import json
+import os
+import pickle
+import re
+import db
+
+CLASS_NAMES_PATH = os.environ.get('CLASSIFIER_CLASS_NAMES_PATH', '../model/class_names.pickle')
+
+WHITESPACE_RE = re.compile(r'\s+')
+
+
+def class_key(name: str):
+    """
+    Normalize a class or medication name to the key they are matched on
+
+    :param name: class or medication name, e.g. 'AMLODIPINE BESYLATE and BENAZEPRIL  HCl'
+    :return: lowercase name with single spaces and '/' as '-', e.g. 'amlodipine besylate and benazepril hcl'
+    """
+    return WHITESPACE_RE.sub(' ', str(name).replace('/', '-')).strip().lower()
+
+
+def load_class_names(path: str = CLASS_NAMES_PATH):
+    """
+    Read the class names of a model
+
+    :param path: class_names.pickle written by model/train.py, or an export manifest (.json) written by model/export.py
+    :return: list of class names
+    """
+    if path.endswith('.json'):
+        with open(path) as f:
+            return json.load(f)['classNames']
+    with open(path, 'rb') as f:
+        return pickle.load(f)
+
+
+def match_classes(class_names: list, medications: list):
+    """
+    Match classes to medications by name
+
+    :param class_names: class names
+    :param medications: rows with medId and medName
+    :return: list of (className, medId), dict of number of classes matched 'exact', by 'prefix' or 'unmatched'
+    """
+    ids_by_key = {}
+    for row in medications:
+        ids_by_key.setdefault(class_key(row['medName']), []).append(row['medId'])
+    keys = sorted(ids_by_key)
+
+    mappings = []
+    counts = {'exact': 0, 'prefix': 0, 'unmatched': 0}
+    for class_name in class_names:
+        key = class_key(class_name)
+        matched = list(ids_by_key.get(key, []))
+        if matched:
+            counts['exact'] += 1
+        else:
+            # medication names that are the class name followed by more words
+            start = bisect.bisect_left(keys, f'{key} ')
+            end = bisect.bisect_left(keys, f'{key}!')
+            for extended in keys[start:end]:
+                matched.extend(ids_by_key[extended])
+            # else the longest medication name the class name starts with
+            words = key.split(' ')
+            for n in range(len(words) - 1, 0, -1):
+                if matched:
+                    break
+                matched = list(ids_by_key.get(' '.join(words[:n]), []))
+            counts['prefix' if matched else 'unmatched'] += 1
+        mappings.extend((class_name, med_id) for med_id in sorted(set(matched)))
+    return mappings, counts
+
+
+def build(class_names: list, batch_size: int = 1000):
+    """
+    Rebuild the stored medications of each class from the current catalog
+
+    :param class_names: class names of the published model
+    :param batch_size: rows per statement
+    :return: dict of mapping and class match counts, err
+    """
+    medications, err = db.read_medication_names()
+    if err is not None:
+        return None, err
+    mappings, counts = match_classes(class_names, medications)
+    _, err = db.replace_class_medications(class_names, mappings, batch_size)
+    if err is not None:
+        return None, err
+    return {'mappings': len(mappings), **counts}, None
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-classnames', default=CLASS_NAMES_PATH,
+                        help='class_names.pickle or the manifest (.json) of an exported model')
+    parser.add_argument('-batchsize', type=int, default=1000)
+    args = parser.parse_args()
+
+    result, err = build(load_class_names(args.classnames), args.batchsize)
+    if err is not None:
+        print(err['err'])
+    else:
+        print(f'Mapped classes to medications: {result}')
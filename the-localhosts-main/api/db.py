@@ -4,20 +4,25 @@
 import pymysql
 import base64
 import os
+import attributes
+from dbpool import ConnectionPool
+from cache import TTLCache
 
-# connection object
-conn = pymysql.connect(host=os.environ.get('DB_HOST'),
-                       user=os.environ.get('DB_USER'),
-                       password=os.environ.get('DB_PASS'),
-                       db='snaprx',
-                       cursorclass=pymysql.cursors.DictCursor)
+# connection pool, each request thread checks out its own connection
+pool = ConnectionPool(max_size=int(os.environ.get('DB_POOL_SIZE', 10)),
+                      timeout=float(os.environ.get('DB_POOL_TIMEOUT', 10)),
+                      idle_check=float(os.environ.get('DB_POOL_IDLE_CHECK', 30)),
+                      host=os.environ.get('DB_HOST'),
+                      user=os.environ.get('DB_USER'),
+                      password=os.environ.get('DB_PASS'),
+                      db='snaprx',
+                      cursorclass=pymysql.cursors.DictCursor)
 
 
 # USERS
 def create_user(first_name: str, last_name: str, email: str, password_hash: bytes, salt: bytes):
     try:
-        conn.ping()
-        with conn.cursor() as curs:
+        with pool.connection() as conn, conn.cursor() as curs:
             password_hash = base64.b64encode(password_hash)
             salt = base64.b64encode(salt)
             sql = 'INSERT INTO Users (`firstName`, `lastName`, `email`, `passwordHash`, `salt`) VALUES (%s, %s, %s, %s, %s)'
@@ -33,8 +38,7 @@ def create_user(first_name: str, last_name: str, email: str, password_hash: byte
 
 def read_user_by_id(user_id: int):
     try:
-        conn.ping()
-        with conn.cursor() as curs:
+        with pool.connection() as conn, conn.cursor() as curs:
             sql = 'SELECT * FROM Users WHERE `userId`=%s'
             curs.execute(sql, (user_id,))
             conn.commit()
@@ -55,8 +59,7 @@ def read_user_by_id(user_id: int):
 
 def read_user_by_email(email: str):
     try:
-        conn.ping()
-        with conn.cursor() as curs:
+        with pool.connection() as conn, conn.cursor() as curs:
             sql = 'SELECT * FROM Users WHERE `email`=%s'
             curs.execute(sql, (email,))
             conn.commit()
@@ -77,8 +80,7 @@ def read_user_by_email(email: str):
 
 def update_user(user_id: int, first_name: str, last_name: str, email: str):
     try:
-        conn.ping()
-        with conn.cursor() as curs:
+        with pool.connection() as conn, conn.cursor() as curs:
             sql = '''
             UPDATE Users 
             SET `firstName`=%s, `lastName`=%s, `email`=%s
@@ -96,8 +98,7 @@ def update_user(user_id: int, first_name: str, last_name: str, email: str):
 
 def update_user_password(user_id: int, password_hash: bytes, salt: bytes):
     try:
-        conn.ping()
-        with conn.cursor() as curs:
+        with pool.connection() as conn, conn.cursor() as curs:
             password_hash = base64.b64encode(password_hash)
             salt = base64.b64encode(salt)
             sql = '''
@@ -107,6 +108,7 @@ def update_user_password(user_id: int, password_hash: bytes, salt: bytes):
             '''
             curs.execute(sql, (password_hash, salt, user_id))
             conn.commit()
+            invalidate_user_sessions(user_id)
             return None, None
     except Exception as e:
         print(e)
@@ -117,8 +119,7 @@ def update_user_password(user_id: int, password_hash: bytes, salt: bytes):
 
 def update_user_temp_password(user_id: int, temp_password_hash: [bytes, None], temp_salt: [bytes, None]):
     try:
-        conn.ping()
-        with conn.cursor() as curs:
+        with pool.connection() as conn, conn.cursor() as curs:
             password_hash = base64.b64encode(temp_password_hash) if temp_password_hash is not None else None
             salt = base64.b64encode(temp_salt) if temp_salt is not None else None
             sql = '''
@@ -138,11 +139,11 @@ def update_user_temp_password(user_id: int, temp_password_hash: [bytes, None], t
 
 def delete_user(user_id: int):
     try:
-        conn.ping()
-        with conn.cursor() as curs:
+        with pool.connection() as conn, conn.cursor() as curs:
             sql = 'DELETE FROM Users WHERE `userId`=%s'
             curs.execute(sql, (user_id,))
             conn.commit()
+            invalidate_user_sessions(user_id)
             return None, None
     except Exception as e:
         print(e)
@@ -152,12 +153,32 @@ def delete_user(user_id: int):
 
 
 # SESSIONS
+# sessions are keyed by token and expire SESSION_TTL seconds after they were last used
+SESSION_TTL = int(os.environ.get('SESSION_TTL', 3600))
+# minimum number of seconds between sliding expiry refreshes of the same session
+SESSION_REFRESH_INTERVAL = int(os.environ.get('SESSION_REFRESH_INTERVAL', 60))
+# number of expired sessions removed per statement when purging
+SESSION_PURGE_BATCH = 5000
+
+# validated token -> userId cache, entries are dropped when a session, its user or the user's password changes
+session_cache = TTLCache(max_size=int(os.environ.get('SESSION_CACHE_SIZE', 10000)),
+                         ttl=float(os.environ.get('SESSION_CACHE_TTL', 30)))
+
+
+def invalidate_user_sessions(user_id: int):
+    """
+    Drop every cached session belonging to a user
+
+    :param user_id: user's ID
+    """
+    session_cache.invalidate_where(lambda _, cached_user_id: cached_user_id == user_id)
+
+
 def create_session(user_id: int, token: str):
     try:
-        conn.ping()
-        with conn.cursor() as curs:
-            sql = 'INSERT INTO Sessions (`userId`, `token`) VALUES (%s, %s)'
-            curs.execute(sql, (user_id, token))
+        with pool.connection() as conn, conn.cursor() as curs:
+            sql = 'INSERT INTO Sessions (`userId`, `token`, `expiresAt`) VALUES (%s, %s, DATE_ADD(NOW(), INTERVAL %s SECOND))'
+            curs.execute(sql, (user_id, token, SESSION_TTL))
             conn.commit()
             return True, None
     except Exception as e:
@@ -168,13 +189,27 @@ def create_session(user_id: int, token: str):
 
 
 def read_session(token: str):
+    user_id = session_cache.get(token)
+    if user_id is not None:
+        return user_id, None
     try:
-        conn.ping()
-        with conn.cursor() as curs:
-            sql = 'SELECT userId FROM Sessions WHERE `token`=%s'
+        with pool.connection() as conn, conn.cursor() as curs:
+            sql = '''
+            SELECT `userId`, TIMESTAMPDIFF(SECOND, NOW(), `expiresAt`) AS `remaining`
+            FROM Sessions
+            WHERE `token`=%s AND `expiresAt` > NOW()
+            '''
             curs.execute(sql, (token,))
+            res = curs.fetchone()
+            user_id = res['userId']
+
+            # sliding expiry, only written back once per refresh interval
+            if SESSION_TTL - res['remaining'] >= SESSION_REFRESH_INTERVAL:
+                sql = 'UPDATE Sessions SET `expiresAt`=DATE_ADD(NOW(), INTERVAL %s SECOND) WHERE `token`=%s'
+                curs.execute(sql, (SESSION_TTL, token))
             conn.commit()
-            return curs.fetchone()['userId'], None
+            session_cache.set(token, user_id)
+            return user_id, None
     except Exception as e:
         print(e)
         return None, {
@@ -184,11 +219,11 @@ def read_session(token: str):
 
 def delete_session(user_id: int, token: str):
     try:
-        conn.ping()
-        with conn.cursor() as curs:
-            sql = 'DELETE FROM Sessions WHERE `userId`=%s AND `token`=%s'
-            curs.execute(sql, (user_id, token))
+        with pool.connection() as conn, conn.cursor() as curs:
+            sql = 'DELETE FROM Sessions WHERE `token`=%s AND `userId`=%s'
+            curs.execute(sql, (token, user_id))
             conn.commit()
+            session_cache.invalidate(token)
             return None, None
     except Exception as e:
         print(e)
@@ -197,18 +232,132 @@ def delete_session(user_id: int, token: str):
         }
 
 
+def delete_user_sessions(user_id: int):
+    try:
+        with pool.connection() as conn, conn.cursor() as curs:
+            sql = 'DELETE FROM Sessions WHERE `userId`=%s'
+            curs.execute(sql, (user_id,))
+            conn.commit()
+            invalidate_user_sessions(user_id)
+            return curs.rowcount, None
+    except Exception as e:
+        print(e)
+        return None, {
+            'err': f'Unable to delete sessions for user with ID {user_id}'
+        }
+
+
+def purge_sessions():
+    try:
+        with pool.connection() as conn, conn.cursor() as curs:
+            # delete in batches so the purge never holds locks on the whole table
+            sql = 'DELETE FROM Sessions WHERE `expiresAt` < NOW() LIMIT %s'
+            purged = 0
+            while True:
+                curs.execute(sql, (SESSION_PURGE_BATCH,))
+                conn.commit()
+                purged += curs.rowcount
+                if curs.rowcount < SESSION_PURGE_BATCH:
+                    return purged, None
+    except Exception as e:
+        print(e)
+        return None, {
+            'err': 'Unable to purge expired sessions'
+        }
+
+
+def create_revocation(token_id: bytes, user_id: int, not_before: int, exempt_token_id: bytes, expires_at: int):
+    # a revocation of one signed token (token_id) or of every token issued to user_id before not_before (ms) except
+    # exempt_token_id, kept until expires_at (epoch seconds) when the revoked tokens have expired anyway
+    try:
+        with pool.connection() as conn, conn.cursor() as curs:
+            sql = '''
+            INSERT INTO Revocations (`tokenId`, `userId`, `notBefore`, `exemptTokenId`, `expiresAt`)
+            VALUES (%s, %s, %s, %s, FROM_UNIXTIME(%s))
+            '''
+            curs.execute(sql, (token_id, user_id, not_before, exempt_token_id, expires_at))
+            conn.commit()
+            return curs.lastrowid, None
+    except Exception as e:
+        print(e)
+        return None, {
+            'err': 'Unable to store session revocation'
+        }
+
+
+def read_revocations(after_id: int, overlap: int = 60):
+    # live revocations with an ID after after_id. rows created in the last `overlap` seconds are read again, since a
+    # revocation committed late can have a lower ID than one already read
+    try:
+        with pool.connection() as conn, conn.cursor() as curs:
+            sql = '''
+            SELECT `revocationId`, `tokenId`, `userId`, `notBefore`, `exemptTokenId`, UNIX_TIMESTAMP(`expiresAt`) AS `expiresAt`
+            FROM Revocations
+            WHERE `expiresAt` > NOW() AND (`revocationId` > %s OR `createdAt` > DATE_SUB(NOW(), INTERVAL %s SECOND))
+            ORDER BY `revocationId`
+            '''
+            curs.execute(sql, (after_id, overlap))
+            conn.commit()
+            return curs.fetchall(), None
+    except Exception as e:
+        print(e)
+        return None, {
+            'err': 'Unable to read session revocations'
+        }
+
+
 # MEDICATIONS
+# columns returned to API clients, internal lookup columns (e.g. shapeCode, colorMask) are left out
+MEDICATION_COLUMNS = '`medId`, `rxString`, `medName`, `medDetails`, `shape`, `size`, `imprintFront`, `imprintBack`, `color`, `price`, `priceSource`'
+# MEDICATION_COLUMNS qualified with the `m` alias of Medications in joins
+JOINED_MEDICATION_COLUMNS = ', '.join(f'm.{c.strip()}' for c in MEDICATION_COLUMNS.split(','))
+
+# assignments applied when a bulk-loaded row's sourceKey already exists
+MEDICATION_UPSERT = '''ON DUPLICATE KEY UPDATE `rxString`=VALUES(`rxString`), `medName`=VALUES(`medName`), `medDetails`=VALUES(`medDetails`), `shape`=VALUES(`shape`), `size`=VALUES(`size`), `imprintFront`=VALUES(`imprintFront`), `imprintBack`=VALUES(`imprintBack`), `color`=VALUES(`color`), `price`=VALUES(`price`), `priceSource`=VALUES(`priceSource`), `sourceHash`=VALUES(`sourceHash`), `shapeCode`=VALUES(`shapeCode`), `colorMask`=VALUES(`colorMask`)'''
+
+# callbacks of (medId, row) run after a medication is created or updated, and of (medId, None) after it is deleted
+medication_listeners = []
+
+
+def add_medication_listener(listener):
+    """
+    Register a callback for medication changes, used to keep in-memory indexes current
+
+    :param listener: function of (medId, row or None)
+    """
+    medication_listeners.append(listener)
+
+
+def notify_medication_change(med_id: int, row: [dict, None]):
+    """
+    Run every medication listener, a failing listener never fails the database write that triggered it
+
+    :param med_id: ID of changed medication
+    :param row: new medication row, None if the medication was deleted
+    """
+    for listener in medication_listeners:
+        try:
+            listener(med_id, row)
+        except Exception as e:
+            print(e)
+
+
 def create_medication(rx_string: str, med_name: str, med_details: str, shape: str, size: int, imprint_front: str, imprint_back: str, color: str, price: float, price_source: str):
     try:
-        conn.ping()
-        with conn.cursor() as curs:
+        with pool.connection() as conn, conn.cursor() as curs:
             sql = '''
-            INSERT INTO Medications (`rxString`, `medName`, `medDetails`, `shape`, `size`, `imprintFront`, `imprintBack`, `color`, `price`, `priceSource`)
-            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+            INSERT INTO Medications (`rxString`, `medName`, `medDetails`, `shape`, `size`, `imprintFront`, `imprintBack`, `color`, `price`, `priceSource`, `shapeCode`, `colorMask`)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
             '''
             curs.execute(sql, (
-                rx_string, med_name, med_details, shape, size, imprint_front, imprint_back, color, price, price_source))
+                rx_string, med_name, med_details, shape, size, imprint_front, imprint_back, color, price, price_source,
+                attributes.shape_code(shape), attributes.color_mask(color)))
             conn.commit()
+            notify_medication_change(curs.lastrowid, {
+                'medId': curs.lastrowid, 'rxString': rx_string, 'medName': med_name, 'shape': shape, 'size': size,
+                'imprintFront': imprint_front, 'imprintBack': imprint_back, 'color': color, 'price': price,
+                'priceSource': price_source
+            })
             return curs.lastrowid, None
     except Exception as e:
         print(e)
@@ -217,11 +366,154 @@ def create_medication(rx_string: str, med_name: str, med_details: str, shape: st
         }
 
 
+def create_medications(medications: list, batch_size: int = 1000, progress=None, upsert: bool = False):
+    # bulk load for catalog imports: multi-row INSERTs of batch_size rows, committed once as a single transaction.
+    # listeners aren't notified per row, in-memory indexes pick the rows up on their next rebuild.
+    # with upsert, rows whose sourceKey already exists are updated in place
+    try:
+        with pool.connection() as conn, conn.cursor() as curs:
+            sql = f'''
+            INSERT INTO Medications (`rxString`, `medName`, `medDetails`, `shape`, `size`, `imprintFront`, `imprintBack`, `color`, `price`, `priceSource`, `sourceKey`, `sourceHash`, `shapeCode`, `colorMask`)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+            {MEDICATION_UPSERT if upsert else ""}
+            '''
+            for i in range(0, len(medications), batch_size):
+                curs.executemany(sql, [
+                    (*med, attributes.shape_code(med[3]), attributes.color_mask(med[7]))
+                    for med in medications[i:i + batch_size]
+                ])
+                if progress is not None:
+                    progress(min(i + batch_size, len(medications)))
+            conn.commit()
+            return len(medications), None
+    except Exception as e:
+        print(e)
+        return None, {
+            'err': 'Unable to bulk create medications'
+        }
+
+
+def read_medication_sources():
+    try:
+        with pool.connection() as conn, conn.cursor() as curs:
+            sql = '''
+            SELECT `medId`, `sourceKey`, `sourceHash`, `rxString`, `imprintFront`, `imprintBack`
+            FROM Medications
+            '''
+            curs.execute(sql)
+            conn.commit()
+            return curs.fetchall(), None
+    except Exception as e:
+        print(e)
+        return None, {
+            'err': 'Unable to read medication sources.'
+        }
+
+
+def update_medication_source_keys(source_keys: list, batch_size: int = 1000):
+    # source_keys: list of (sourceKey, medId), for rows imported before source keys were recorded
+    try:
+        with pool.connection() as conn, conn.cursor() as curs:
+            sql = 'UPDATE Medications SET `sourceKey`=%s WHERE `medId`=%s'
+            for i in range(0, len(source_keys), batch_size):
+                curs.executemany(sql, source_keys[i:i + batch_size])
+            conn.commit()
+            return len(source_keys), None
+    except Exception as e:
+        print(e)
+        return None, {
+            'err': 'Unable to update medication source keys.'
+        }
+
+
+def read_medication_ids_by_source(source_keys: list, batch_size: int = 1000):
+    try:
+        med_ids = {}
+        with pool.connection() as conn, conn.cursor() as curs:
+            for i in range(0, len(source_keys), batch_size):
+                batch = source_keys[i:i + batch_size]
+                curs.execute(f'''
+                SELECT `medId`, `sourceKey` FROM Medications
+                WHERE `sourceKey` IN ({", ".join(["%s"] * len(batch))})
+                ''', tuple(batch))
+                for row in curs.fetchall():
+                    med_ids[row['sourceKey']] = row['medId']
+            conn.commit()
+            return med_ids, None
+    except Exception as e:
+        print(e)
+        return None, {
+            'err': 'Unable to read medication IDs by source key.'
+        }
+
+
+def delete_medications(med_ids: list, batch_size: int = 1000):
+    try:
+        with pool.connection() as conn, conn.cursor() as curs:
+            for i in range(0, len(med_ids), batch_size):
+                batch = med_ids[i:i + batch_size]
+                curs.execute(f'DELETE FROM Medications WHERE `medId` IN ({", ".join(["%s"] * len(batch))})', tuple(batch))
+            conn.commit()
+            for med_id in med_ids:
+                notify_medication_change(med_id, None)
+            return len(med_ids), None
+    except Exception as e:
+        print(e)
+        return None, {
+            'err': 'Unable to delete medications.'
+        }
+
+
+def read_import_checkpoint(source: str):
+    try:
+        with pool.connection() as conn, conn.cursor() as curs:
+            sql = 'SELECT `rowsDone` FROM ImportCheckpoints WHERE `source`=%s'
+            curs.execute(sql, (source,))
+            conn.commit()
+            row = curs.fetchone()
+            return row['rowsDone'] if row is not None else 0, None
+    except Exception as e:
+        print(e)
+        return None, {
+            'err': f'Unable to read import checkpoint for {source}'
+        }
+
+
+def update_import_checkpoint(source: str, rows_done: int):
+    try:
+        with pool.connection() as conn, conn.cursor() as curs:
+            sql = '''
+            INSERT INTO ImportCheckpoints (`source`, `rowsDone`) VALUES (%s, %s)
+            ON DUPLICATE KEY UPDATE `rowsDone`=VALUES(`rowsDone`)
+            '''
+            curs.execute(sql, (source, rows_done))
+            conn.commit()
+            return None, None
+    except Exception as e:
+        print(e)
+        return None, {
+            'err': f'Unable to update import checkpoint for {source}'
+        }
+
+
+def delete_import_checkpoint(source: str):
+    try:
+        with pool.connection() as conn, conn.cursor() as curs:
+            sql = 'DELETE FROM ImportCheckpoints WHERE `source`=%s'
+            curs.execute(sql, (source,))
+            conn.commit()
+            return None, None
+    except Exception as e:
+        print(e)
+        return None, {
+            'err': f'Unable to delete import checkpoint for {source}'
+        }
+
+
 def read_medication(med_id: int):
     try:
-        conn.ping()
-        with conn.cursor() as curs:
-            sql = 'SELECT * FROM Medications WHERE `medId`=%s'
+        with pool.connection() as conn, conn.cursor() as curs:
+            sql = f'SELECT {MEDICATION_COLUMNS} FROM Medications WHERE `medId`=%s'
             curs.execute(sql, (med_id,))
             conn.commit()
             return curs.fetchone(), None
@@ -232,17 +524,71 @@ def read_medication(med_id: int):
         }
 
 
+def read_medications(med_ids: list):
+    try:
+        if len(med_ids) == 0:
+            return [], None
+        with pool.connection() as conn, conn.cursor() as curs:
+            sql = f'SELECT {MEDICATION_COLUMNS} FROM Medications WHERE `medId` IN ({", ".join(["%s"] * len(med_ids))})'
+            curs.execute(sql, tuple(med_ids))
+            conn.commit()
+
+            # preserve the order of the requested IDs
+            rows = {row['medId']: row for row in curs.fetchall()}
+            return [rows[med_id] for med_id in med_ids if med_id in rows], None
+    except Exception as e:
+        print(e)
+        return None, {
+            'err': 'Unable to read medications.'
+        }
+
+
+def read_all_medications():
+    try:
+        with pool.connection() as conn, conn.cursor() as curs:
+            sql = '''
+            SELECT `medId`, `rxString`, `medName`, `shape`, `size`, `imprintFront`, `imprintBack`, `color`, `price`, `priceSource`
+            FROM Medications
+            '''
+            curs.execute(sql)
+            conn.commit()
+            return curs.fetchall(), None
+    except Exception as e:
+        print(e)
+        return None, {
+            'err': 'Unable to read medication catalog.'
+        }
+
+
+def read_medication_names():
+    try:
+        with pool.connection() as conn, conn.cursor() as curs:
+            curs.execute('SELECT `medId`, `medName` FROM Medications')
+            conn.commit()
+            return curs.fetchall(), None
+    except Exception as e:
+        print(e)
+        return None, {
+            'err': 'Unable to read medication names.'
+        }
+
+
 def update_medication(med_id: int, rx_string: str, med_name: str, med_details: str, shape: str, size: int, imprint_front: str, imprint_back: str, color: str, price: float, price_source: str):
     try:
-        conn.ping()
-        with conn.cursor() as curs:
+        with pool.connection() as conn, conn.cursor() as curs:
             sql = '''
             UPDATE Medications
-            SET `rxString`=%s, `medName`=%s, `medDetails`=%s, `shape`=%s, `size`=%s, `imprintFront`=%s, `imprintBack`=%s, `color`=%s, `price`=%s, `priceSource`=%s
+            SET `rxString`=%s, `medName`=%s, `medDetails`=%s, `shape`=%s, `size`=%s, `imprintFront`=%s, `imprintBack`=%s, `color`=%s, `price`=%s, `priceSource`=%s, `shapeCode`=%s, `colorMask`=%s
             WHERE `medId`=%s
             '''
-            curs.execute(sql, (rx_string, med_name, med_details, shape, size, imprint_front, imprint_back, color, price, med_id, price_source))
+            curs.execute(sql, (rx_string, med_name, med_details, shape, size, imprint_front, imprint_back, color, price, price_source,
+                               attributes.shape_code(shape), attributes.color_mask(color), med_id))
             conn.commit()
+            notify_medication_change(med_id, {
+                'medId': med_id, 'rxString': rx_string, 'medName': med_name, 'shape': shape, 'size': size,
+                'imprintFront': imprint_front, 'imprintBack': imprint_back, 'color': color, 'price': price,
+                'priceSource': price_source
+            })
             return None, None
     except Exception as e:
         print(e)
@@ -253,11 +599,11 @@ def update_medication(med_id: int, rx_string: str, med_name: str, med_details: s
 
 def delete_medication(med_id: int):
     try:
-        conn.ping()
-        with conn.cursor() as curs:
+        with pool.connection() as conn, conn.cursor() as curs:
             sql = 'DELETE FROM Medications WHERE `medId`=%s'
             curs.execute(sql, (med_id,))
             conn.commit()
+            notify_medication_change(med_id, None)
             return True, None
     except Exception as e:
         print(e)
@@ -268,10 +614,9 @@ def delete_medication(med_id: int):
 
 def search_medication(query: str):
     try:
-        conn.ping()
-        with conn.cursor() as curs:
-            sql = '''
-            SELECT * FROM Medications
+        with pool.connection() as conn, conn.cursor() as curs:
+            sql = f'''
+            SELECT {MEDICATION_COLUMNS} FROM Medications
             WHERE 
                 `rxString` LIKE CONCAT('%%', %s, '%%') OR 
                 `medName` LIKE CONCAT('%%', %s, '%%') OR 
@@ -295,37 +640,38 @@ def search_medication(query: str):
 
 def search_medication_by_attributes(shape: str, size: int, imprint_front: str, imprint_back: str, color: str, color2: str):
     try:
-        conn.ping()
-        with conn.cursor() as curs:
+        # shape and colors are matched through their indexed integer codes, size through a range
+        conditions = []
+        args_tup = ()
+        if shape is not None:
+            shape_codes = attributes.matching_shape_codes(shape)
+            if len(shape_codes) == 0:
+                return [], None
+            conditions.append(f'`shapeCode` IN ({", ".join(["%s"] * len(shape_codes))})')
+            args_tup = args_tup + tuple(shape_codes)
+        if size is not None:
+            conditions.append('`size` BETWEEN %s AND %s')
+            args_tup = args_tup + (size - attributes.SIZE_TOLERANCE, size + attributes.SIZE_TOLERANCE)
+        if imprint_front is not None:
+            conditions.append("`imprintFront` LIKE CONCAT('%%', %s, '%%')")
+            args_tup = args_tup + (imprint_front.upper(),)
+        if imprint_back is not None:
+            conditions.append("`imprintBack` LIKE CONCAT('%%', %s, '%%')")
+            args_tup = args_tup + (imprint_back.upper(),)
+        for c in (color, color2):
+            if c is not None:
+                color_bits = attributes.matching_color_bits(c)
+                if color_bits == 0:
+                    return [], None
+                conditions.append('(`colorMask` & %s) <> 0')
+                args_tup = args_tup + (color_bits,)
+
+        with pool.connection() as conn, conn.cursor() as curs:
             sql = f'''
-            SELECT * FROM Medications
-            WHERE
-                {"`shape` LIKE CONCAT('%%', %s, '%%')" if shape is not None else ""}
-                {"AND" if size is not None and shape is not None else ""}
-                {"`size` LIKE CONCAT('%%', %s, '%%')" if size is not None else ""}
-                {"AND" if imprint_front is not None and (shape is not None or size is not None) else ""}
-                {"`imprintFront` LIKE CONCAT('%%', %s, '%%')" if imprint_front is not None else ""}
-                {"AND" if imprint_back is not None and (shape is not None or size is not None or imprint_front is not None) else ""}
-                {"`imprintBack` LIKE CONCAT('%%', %s, '%%')" if imprint_back is not None else ""}
-                {"AND" if color is not None and (shape is not None or size is not None or imprint_front is not None or imprint_back is not None) else ""}
-                {"`color` LIKE CONCAT('%%', %s, '%%')" if color is not None else ""}
-                {"AND" if color2 is not None and (shape is not None or size is not None or imprint_front is not None or imprint_back is not None or color is not None) else ""}
-                {"`color` LIKE CONCAT('%%', %s, '%%')" if color2 is not None else ""}
-                LIMIT 50
-            '''
-            args_tup = ()
-            if shape is not None:
-                args_tup = args_tup + (shape.upper(),)
-            if size is not None:
-                args_tup = args_tup + (size,)
-            if imprint_front is not None:
-                args_tup = args_tup + (imprint_front.upper(),)
-            if imprint_back is not None:
-                args_tup = args_tup + (imprint_back.upper(),)
-            if color is not None:
-                args_tup = args_tup + (color.upper(),)
-            if color2 is not None:
-                args_tup = args_tup + (color2.upper(),)
+            SELECT {MEDICATION_COLUMNS} FROM Medications
+            WHERE {" AND ".join(conditions) if len(conditions) != 0 else "TRUE"}
+            LIMIT 50
+            '''
             curs.execute(sql, args_tup)
             conn.commit()
             return curs.fetchall(), None
@@ -336,11 +682,30 @@ def search_medication_by_attributes(shape: str, size: int, imprint_front: str, i
         }
 
 
+def backfill_medication_attribute_codes(batch_size: int = 1000):
+    try:
+        with pool.connection() as conn, conn.cursor() as curs:
+            curs.execute('SELECT `medId`, `shape`, `color` FROM Medications')
+            rows = curs.fetchall()
+            sql = 'UPDATE Medications SET `shapeCode`=%s, `colorMask`=%s WHERE `medId`=%s'
+            for i in range(0, len(rows), batch_size):
+                curs.executemany(sql, [
+                    (attributes.shape_code(row['shape']), attributes.color_mask(row['color']), row['medId'])
+                    for row in rows[i:i + batch_size]
+                ])
+                conn.commit()
+            return len(rows), None
+    except Exception as e:
+        print(e)
+        return None, {
+            'err': 'Unable to backfill medication attribute codes.'
+        }
+
+
 # INGREDIENTS
 def create_ingredient(ingredient_name: str):
     try:
-        conn.ping()
-        with conn.cursor() as curs:
+        with pool.connection() as conn, conn.cursor() as curs:
             sql = '''
             INSERT INTO Ingredients (`ingredientName`)
             VALUES (%s)
@@ -355,10 +720,33 @@ def create_ingredient(ingredient_name: str):
         }
 
 
+def create_ingredients(ingredient_names: list, batch_size: int = 1000):
+    # bulk load for catalog imports: inserts names not stored yet and returns the IDs of all of them
+    try:
+        ingredient_names = list(dict.fromkeys(ingredient_names))
+        ingredient_ids = {}
+        with pool.connection() as conn, conn.cursor() as curs:
+            for i in range(0, len(ingredient_names), batch_size):
+                batch = ingredient_names[i:i + batch_size]
+                curs.executemany('INSERT IGNORE INTO Ingredients (`ingredientName`) VALUES (%s)', batch)
+                curs.execute(f'''
+                SELECT `ingredientId`, `ingredientName` FROM Ingredients
+                WHERE `ingredientName` IN ({", ".join(["%s"] * len(batch))})
+                ''', tuple(batch))
+                for row in curs.fetchall():
+                    ingredient_ids[row['ingredientName']] = row['ingredientId']
+            conn.commit()
+            return ingredient_ids, None
+    except Exception as e:
+        print(e)
+        return None, {
+            'err': 'Unable to bulk create ingredients'
+        }
+
+
 def delete_ingredient(ingredient_id: int):
     try:
-        conn.ping()
-        with conn.cursor() as curs:
+        with pool.connection() as conn, conn.cursor() as curs:
             sql = '''
             DELETE FROM Ingredients
             WHERE `ingredientId`=%s
@@ -373,11 +761,107 @@ def delete_ingredient(ingredient_id: int):
         }
 
 
+# PRICES
+def read_prices(source: str = None):
+    try:
+        with pool.connection() as conn, conn.cursor() as curs:
+            sql = f'''
+            SELECT `priceName`, `source`, `price` FROM Prices
+            {"WHERE `source`=%s" if source is not None else ""}
+            '''
+            curs.execute(sql, (source,) if source is not None else None)
+            conn.commit()
+            return curs.fetchall(), None
+    except Exception as e:
+        print(e)
+        return None, {
+            'err': 'Unable to read prices.'
+        }
+
+
+def read_prices_by_name(price_names: list):
+    try:
+        if len(price_names) == 0:
+            return [], None
+        with pool.connection() as conn, conn.cursor() as curs:
+            sql = f'''
+            SELECT `priceName`, `source`, `price` FROM Prices
+            WHERE `priceName` IN ({", ".join(["%s"] * len(price_names))})
+            '''
+            curs.execute(sql, tuple(price_names))
+            conn.commit()
+            return curs.fetchall(), None
+    except Exception as e:
+        print(e)
+        return None, {
+            'err': 'Unable to read prices by name.'
+        }
+
+
+def upsert_prices(source: str, prices: list, batch_size: int = 1000):
+    # prices: list of (priceName, price) from one source, committed as a single transaction
+    try:
+        with pool.connection() as conn, conn.cursor() as curs:
+            sql = '''
+            INSERT INTO Prices (`priceName`, `source`, `price`) VALUES (%s, %s, %s)
+            ON DUPLICATE KEY UPDATE `price`=VALUES(`price`)
+            '''
+            for i in range(0, len(prices), batch_size):
+                curs.executemany(sql, [(name, source, price) for name, price in prices[i:i + batch_size]])
+            conn.commit()
+            return len(prices), None
+    except Exception as e:
+        print(e)
+        return None, {
+            'err': f'Unable to write {source} prices.'
+        }
+
+
+def delete_prices(source: str, price_names: list, batch_size: int = 1000):
+    try:
+        with pool.connection() as conn, conn.cursor() as curs:
+            for i in range(0, len(price_names), batch_size):
+                batch = price_names[i:i + batch_size]
+                curs.execute(f'''
+                DELETE FROM Prices
+                WHERE `source`=%s AND `priceName` IN ({", ".join(["%s"] * len(batch))})
+                ''', (source, *batch))
+            conn.commit()
+            return len(price_names), None
+    except Exception as e:
+        print(e)
+        return None, {
+            'err': f'Unable to delete {source} prices.'
+        }
+
+
+def update_medication_prices(prices: list):
+    # prices: list of (price, priceSource, priceName), applied to every medication with that priceName.
+    # the updated medications are read back for the listeners after the commit, and only if there are any
+    try:
+        with pool.connection() as conn, conn.cursor() as curs:
+            sql = 'UPDATE Medications SET `price`=%s, `priceSource`=%s WHERE `priceName`=%s'
+            curs.executemany(sql, prices)
+            conn.commit()
+            if medication_listeners and prices:
+                price_names = [price_name for _, _, price_name in prices]
+                sql = f'SELECT {MEDICATION_COLUMNS} FROM Medications WHERE `priceName` IN ({", ".join(["%s"] * len(price_names))})'
+                curs.execute(sql, tuple(price_names))
+                conn.commit()
+                for row in curs.fetchall():
+                    notify_medication_change(row['medId'], row)
+            return len(prices), None
+    except Exception as e:
+        print(e)
+        return None, {
+            'err': 'Unable to update medication prices.'
+        }
+
+
 # USER:IMAGE MAP
 def create_user_image_map(user_id: int, image_id: int):
     try:
-        conn.ping()
-        with conn.cursor() as curs:
+        with pool.connection() as conn, conn.cursor() as curs:
             sql = '''
             INSERT INTO UserImageMap (`userId`, `imageId`)
             VALUES (%s, %s)
@@ -394,8 +878,7 @@ def create_user_image_map(user_id: int, image_id: int):
 
 def read_user_images(user_id: int):
     try:
-        conn.ping()
-        with conn.cursor() as curs:
+        with pool.connection() as conn, conn.cursor() as curs:
             sql = '''
             SELECT 
                 Images.URL
@@ -415,8 +898,7 @@ def read_user_images(user_id: int):
 
 def delete_user_image_map(user_id: int, image_id: int):
     try:
-        conn.ping()
-        with conn.cursor() as curs:
+        with pool.connection() as conn, conn.cursor() as curs:
             sql = '''
             DELETE FROM UserImageMap
             WHERE `userId`=%s AND `imageId`=%s
@@ -434,8 +916,7 @@ def delete_user_image_map(user_id: int, image_id: int):
 # USER:MEDICATION MAP
 def create_user_medication_map(user_id: int, med_id: int):
     try:
-        conn.ping()
-        with conn.cursor() as curs:
+        with pool.connection() as conn, conn.cursor() as curs:
             sql = '''
             INSERT INTO UserMedMap (`userId`, `medId`)
             VALUES (%s, %s)
@@ -452,8 +933,7 @@ def create_user_medication_map(user_id: int, med_id: int):
 
 def read_user_medications(user_id: int):
     try:
-        conn.ping()
-        with conn.cursor() as curs:
+        with pool.connection() as conn, conn.cursor() as curs:
             sql = '''
             SELECT
                 Medications.medId, 
@@ -483,8 +963,7 @@ def read_user_medications(user_id: int):
 
 def read_user_medication(user_id: int, med_id: int):
     try:
-        conn.ping()
-        with conn.cursor() as curs:
+        with pool.connection() as conn, conn.cursor() as curs:
             sql = '''
             SELECT *
             FROM UserMedMap
@@ -502,8 +981,7 @@ def read_user_medication(user_id: int, med_id: int):
 
 def delete_user_medication_map(user_id: int, med_id: int):
     try:
-        conn.ping()
-        with conn.cursor() as curs:
+        with pool.connection() as conn, conn.cursor() as curs:
             sql = '''
             DELETE FROM UserMedMap
             WHERE `userId`=%s AND `medId`=%s
@@ -521,8 +999,7 @@ def delete_user_medication_map(user_id: int, med_id: int):
 # MEDICATION:INGREDIENT MAP
 def create_medication_ingredient_map(med_id: int, ingredient_id: int, is_active: bool):
     try:
-        conn.ping()
-        with conn.cursor() as curs:
+        with pool.connection() as conn, conn.cursor() as curs:
             sql = '''
             INSERT INTO MedIngredientMap (`medId`, `ingredientId`, `isActiveIngredient`)
             VALUES (%s, %s, %s)
@@ -537,13 +1014,36 @@ def create_medication_ingredient_map(med_id: int, ingredient_id: int, is_active:
         }
 
 
+def replace_medication_ingredients(med_ids: list, mappings: list, batch_size: int = 1000):
+    # bulk load for catalog imports: replaces the ingredients of med_ids with mappings of (medId, ingredientId, isActive)
+    try:
+        with pool.connection() as conn, conn.cursor() as curs:
+            for i in range(0, len(med_ids), batch_size):
+                batch = med_ids[i:i + batch_size]
+                curs.execute(f'DELETE FROM MedIngredientMap WHERE `medId` IN ({", ".join(["%s"] * len(batch))})', tuple(batch))
+            sql = '''
+            INSERT IGNORE INTO MedIngredientMap (`medId`, `ingredientId`, `isActiveIngredient`)
+            VALUES (%s, %s, %s)
+            '''
+            for i in range(0, len(mappings), batch_size):
+                curs.executemany(sql, mappings[i:i + batch_size])
+            conn.commit()
+            return len(mappings), None
+    except Exception as e:
+        print(e)
+        return None, {
+            'err': 'Unable to bulk replace medication ingredients'
+        }
+
+
 def read_medication_ingredients(med_id: int):
     try:
-        conn.ping()
-        with conn.cursor() as curs:
+        with pool.connection() as conn, conn.cursor() as curs:
             sql = '''
-            SELECT `ingredientId`, `isActiveIngredient` FROM MedIngredientMap
-            WHERE `medId`=%s
+            SELECT mi.`ingredientId`, i.`ingredientName`, mi.`isActiveIngredient` FROM MedIngredientMap mi
+            JOIN Ingredients i ON i.`ingredientId`=mi.`ingredientId`
+            WHERE mi.`medId`=%s
+            ORDER BY mi.`isActiveIngredient` DESC, i.`ingredientName`
             '''
             curs.execute(sql, (med_id,))
             conn.commit()
@@ -555,10 +1055,54 @@ def read_medication_ingredients(med_id: int):
         }
 
 
+def search_medications_by_ingredient(ingredient_name: str, active_only: bool, limit: int):
+    try:
+        with pool.connection() as conn, conn.cursor() as curs:
+            # prefix match on the unique ingredient name index, then the ingredient index of MedIngredientMap
+            sql = f'''
+            SELECT DISTINCT {JOINED_MEDICATION_COLUMNS} FROM Ingredients i
+            JOIN MedIngredientMap mi ON mi.`ingredientId`=i.`ingredientId`
+            JOIN Medications m ON m.`medId`=mi.`medId`
+            WHERE i.`ingredientName` LIKE CONCAT(%s, '%%') {"AND mi.`isActiveIngredient`" if active_only else ""}
+            ORDER BY m.`medId`
+            LIMIT %s
+            '''
+            curs.execute(sql, (ingredient_name.upper().replace('%', r'\%').replace('_', r'\_'), limit))
+            conn.commit()
+            return curs.fetchall(), None
+    except Exception as e:
+        print(e)
+        return None, {
+            'err': f'Unable to search medications by ingredient {ingredient_name}'
+        }
+
+
+def read_medications_sharing_ingredients(med_id: int, limit: int):
+    try:
+        with pool.connection() as conn, conn.cursor() as curs:
+            # medications sharing the most active ingredients with med_id first
+            sql = f'''
+            SELECT {JOINED_MEDICATION_COLUMNS}, COUNT(*) AS `sharedIngredients` FROM MedIngredientMap a
+            JOIN MedIngredientMap b ON b.`ingredientId`=a.`ingredientId` AND b.`isActiveIngredient` AND b.`medId`<>a.`medId`
+            JOIN Medications m ON m.`medId`=b.`medId`
+            WHERE a.`medId`=%s AND a.`isActiveIngredient`
+            GROUP BY m.`medId`
+            ORDER BY `sharedIngredients` DESC, m.`medId`
+            LIMIT %s
+            '''
+            curs.execute(sql, (med_id, limit))
+            conn.commit()
+            return curs.fetchall(), None
+    except Exception as e:
+        print(e)
+        return None, {
+            'err': f'Unable to read medications sharing ingredients with medication with ID {med_id}'
+        }
+
+
 def delete_medication_ingredient_map(med_id: int, ingredient_id: int):
     try:
-        conn.ping()
-        with conn.cursor() as curs:
+        with pool.connection() as conn, conn.cursor() as curs:
             sql = '''
             DELETE FROM MedIngredientMap
             WHERE `medId`=%s AND `ingredientId`=%s
@@ -571,3 +1115,54 @@ def delete_medication_ingredient_map(med_id: int, ingredient_id: int):
         return None, {
             'err': f'Unable to delete medication:ingredient mapping {med_id}:{ingredient_id}'
         }
+
+
+# CLASS:MEDICATION MAP
+def replace_class_medications(class_names: list, mappings: list, batch_size: int = 1000):
+    # replaces the medications of class_names with mappings of (className, medId) in one transaction
+    try:
+        with pool.connection() as conn, conn.cursor() as curs:
+            for i in range(0, len(class_names), batch_size):
+                batch = class_names[i:i + batch_size]
+                curs.execute(f'DELETE FROM ClassMedMap WHERE `className` IN ({", ".join(["%s"] * len(batch))})', tuple(batch))
+            sql = '''
+            INSERT IGNORE INTO ClassMedMap (`className`, `medId`)
+            VALUES (%s, %s)
+            '''
+            for i in range(0, len(mappings), batch_size):
+                curs.executemany(sql, mappings[i:i + batch_size])
+            conn.commit()
+            return len(mappings), None
+    except Exception as e:
+        print(e)
+        return None, {
+            'err': 'Unable to replace class medications'
+        }
+
+
+def read_class_medications(class_names: list, limit: int):
+    # medications of several classes in one query, returned as a dict of className -> up to limit medications
+    try:
+        if len(class_names) == 0:
+            return {}, None
+        with pool.connection() as conn, conn.cursor() as curs:
+            sql = f'''
+            SELECT c.`className`, {JOINED_MEDICATION_COLUMNS} FROM ClassMedMap c
+            JOIN Medications m ON m.`medId`=c.`medId`
+            WHERE c.`className` IN ({", ".join(["%s"] * len(class_names))})
+            ORDER BY c.`className`, c.`medId`
+            '''
+            curs.execute(sql, tuple(class_names))
+            conn.commit()
+
+            results = {class_name: [] for class_name in class_names}
+            for row in curs.fetchall():
+                class_medications = results[row.pop('className')]
+                if len(class_medications) < limit:
+                    class_medications.append(row)
+            return results, None
+    except Exception as e:
+        print(e)
+        return None, {
+            'err': f'Unable to read medications of classes {", ".join(class_names)}'
+        }
@@ -4,6 +4,7 @@
 import pymysql
 import argparse
 import os
+import db
 from pymysql.constants import CLIENT
 
 INIT_DB_SQL = '''
@@ -27,13 +28,29 @@ INIT_DB_SQL = '''
             `userId` INT NOT NULL, 
             `token` VARCHAR(36) NOT NULL, 
             `timestamp` DATETIME DEFAULT CURRENT_TIMESTAMP,
-            PRIMARY KEY (`userId`, `token`),
+            `expiresAt` DATETIME NOT NULL,
+            PRIMARY KEY (`token`),
+            KEY idx_sessions_user (`userId`),
+            KEY idx_sessions_expires (`expiresAt`),
             CONSTRAINT fk_sessions_user FOREIGN KEY (`userId`)
                 REFERENCES Users(`userId`)
                 ON DELETE CASCADE
                 ON UPDATE CASCADE
         );
         
+        CREATE TABLE Revocations(
+            `revocationId` INT NOT NULL AUTO_INCREMENT,
+            `tokenId` BINARY(8),
+            `userId` INT,
+            `notBefore` BIGINT,
+            `exemptTokenId` BINARY(8),
+            `createdAt` DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            `expiresAt` DATETIME NOT NULL,
+            PRIMARY KEY (`revocationId`),
+            KEY idx_revocations_created (`createdAt`),
+            KEY idx_revocations_expires (`expiresAt`)
+        );
+        
         CREATE TABLE Medications(
             `medId` INT NOT NULL AUTO_INCREMENT,
             `rxString` TEXT,
@@ -46,13 +63,25 @@ INIT_DB_SQL = '''
             `color` TEXT,
             `price` FLOAT,
             `priceSource` TEXT,
-            PRIMARY KEY (`medId`)
+            `shapeCode` TINYINT UNSIGNED NOT NULL DEFAULT 0,
+            `colorMask` SMALLINT UNSIGNED NOT NULL DEFAULT 0,
+            `sourceKey` CHAR(40),
+            `sourceHash` CHAR(40),
+            `priceName` VARCHAR(255) AS (LEFT(LOWER(TRIM(`medName`)), 255)) STORED,
+            PRIMARY KEY (`medId`),
+            UNIQUE KEY idx_medications_source (`sourceKey`),
+            KEY idx_medications_price_name (`priceName`),
+            KEY idx_medications_price (`price`),
+            KEY idx_medications_shape_size (`shapeCode`, `size`),
+            KEY idx_medications_size (`size`),
+            KEY idx_medications_color (`colorMask`)
         );
         
         CREATE TABLE Ingredients(
             `ingredientId` INT NOT NULL AUTO_INCREMENT,
-            `ingredientName` TEXT,
-            PRIMARY KEY (`ingredientId`)
+            `ingredientName` VARCHAR(255) NOT NULL,
+            PRIMARY KEY (`ingredientId`),
+            UNIQUE KEY idx_ingredients_name (`ingredientName`)
         );
         
         CREATE TABLE MedIngredientMap(
@@ -60,6 +89,7 @@ INIT_DB_SQL = '''
             `ingredientId` INT NOT NULL,
             `isActiveIngredient` BOOL NOT NULL,
             PRIMARY KEY (`medId`, `ingredientId`),
+            KEY idx_medingredientmap_ingredient (`ingredientId`, `isActiveIngredient`),
             CONSTRAINT fk_medIngredientMap_med FOREIGN KEY (`medId`)
                 REFERENCES Medications(`medId`)
                 ON DELETE CASCADE
@@ -84,11 +114,45 @@ INIT_DB_SQL = '''
                 ON UPDATE CASCADE
         );
         
+        CREATE TABLE Prices(
+            `priceName` VARCHAR(255) NOT NULL,
+            `source` VARCHAR(32) NOT NULL,
+            `price` DECIMAL(10, 2) NOT NULL,
+            `updatedAt` DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+            PRIMARY KEY (`priceName`, `source`),
+            KEY idx_prices_source (`source`)
+        );
+        
+        CREATE TABLE ClassMedMap(
+            `className` VARCHAR(255) NOT NULL,
+            `medId` INT NOT NULL,
+            PRIMARY KEY (`className`, `medId`),
+            KEY idx_classmedmap_med (`medId`),
+            CONSTRAINT fk_classMedMap_med FOREIGN KEY (`medId`)
+                REFERENCES Medications(`medId`)
+                ON DELETE CASCADE
+                ON UPDATE CASCADE
+        );
+        
+        CREATE TABLE ImportCheckpoints(
+            `source` VARCHAR(255) NOT NULL,
+            `rowsDone` INT NOT NULL,
+            `updatedAt` DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+            PRIMARY KEY (`source`)
+        );
+        
         CREATE EVENT delete_sessions
-        ON SCHEDULE AT CURRENT_TIMESTAMP + INTERVAL 1 HOUR
+        ON SCHEDULE EVERY 5 MINUTE
+        ON COMPLETION PRESERVE
+        DO BEGIN
+              DELETE FROM Sessions WHERE `expiresAt` < NOW();
+        END;
+        
+        CREATE EVENT delete_revocations
+        ON SCHEDULE EVERY 5 MINUTE
         ON COMPLETION PRESERVE
         DO BEGIN
-              DELETE FROM Sessions WHERE `timestamp` < DATE_SUB(NOW(), INTERVAL 1 HOUR);
+              DELETE FROM Revocations WHERE `expiresAt` < NOW();
         END;
         '''
 
@@ -208,5 +272,6 @@ if __name__ == '__main__':
         if args.dummydata:
             curs.execute(INSERT_DUMMY_DATA_SQL)
             conn.commit()
+            db.backfill_medication_attribute_codes()
 
         conn.close()
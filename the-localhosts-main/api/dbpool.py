@@ -0,0 +1,146 @@
+# dbpool.py
+# Thread-safe pool of MySQL connections shared by db.py
+
+import queue
+import threading
+import time
+from contextlib import contextmanager
+
+import pymysql
+
+
+class PoolExhaustedError(Exception):
+    """
+    Raised when no connection becomes available before the checkout timeout
+    """
+    pass
+
+
+class ConnectionPool:
+    """
+    Bounded pool of pymysql connections
+
+    Each thread checks out its own connection for the duration of a `with pool.connection()` block, so concurrent
+    requests run their queries in parallel instead of sharing one socket. Nested checkouts on the same thread reuse
+    the connection that thread already holds. Connections are created lazily up to `max_size`, and an idle
+    connection is only pinged when it has been sitting in the pool for longer than `idle_check` seconds.
+
+    Attributes:
+        max_size: maximum number of open connections
+        timeout: seconds to wait for a free connection before raising PoolExhaustedError
+        idle_check: idle time (seconds) after which a connection is validated before reuse
+    """
+
+    def __init__(self, max_size: int = 10, timeout: float = 10.0, idle_check: float = 30.0, **connect_kwargs):
+        self.max_size = max_size
+        self.timeout = timeout
+        self.idle_check = idle_check
+        self._connect_kwargs = connect_kwargs
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(max_size)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._open = 0
+
+    def _connect(self):
+        conn = pymysql.connect(**self._connect_kwargs)
+        with self._lock:
+            self._open += 1
+        return conn
+
+    def _close(self, conn):
+        with self._lock:
+            self._open -= 1
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def _acquire(self):
+        if not self._slots.acquire(timeout=self.timeout):
+            raise PoolExhaustedError(f'No database connection available after {self.timeout}s')
+        try:
+            while True:
+                try:
+                    conn, last_used = self._idle.get_nowait()
+                except queue.Empty:
+                    return self._connect()
+
+                # only validate connections that have been idle long enough to have been dropped by the server
+                if time.monotonic() - last_used < self.idle_check:
+                    return conn
+                try:
+                    conn.ping(reconnect=False)
+                    return conn
+                except Exception:
+                    self._close(conn)
+        except Exception:
+            self._slots.release()
+            raise
+
+    def _release(self, conn, discard: bool):
+        try:
+            if discard or not conn.open:
+                self._close(conn)
+            else:
+                self._idle.put((conn, time.monotonic()))
+        finally:
+            self._slots.release()
+
+    @contextmanager
+    def connection(self):
+        """
+        Check out a connection for the current thread
+
+        :return: context manager yielding a pymysql connection
+        """
+        held = getattr(self._local, 'conn', None)
+        if held is not None:
+            yield held
+            return
+
+        conn = self._acquire()
+        self._local.conn = conn
+        discard = False
+        try:
+            yield conn
+        except (pymysql.err.OperationalError, pymysql.err.InterfaceError):
+            # connection-level failure, don't hand this socket to another thread
+            discard = True
+            raise
+        except Exception:
+            try:
+                conn.rollback()
+            except Exception:
+                discard = True
+            raise
+        finally:
+            self._local.conn = None
+            self._release(conn, discard)
+
+    def stats(self):
+        """
+        Get current pool usage
+
+        :return: dict of open, idle and in-use connection counts
+        """
+        with self._lock:
+            open_conns = self._open
+        idle = self._idle.qsize()
+        return {
+            'maxSize': self.max_size,
+            'open': open_conns,
+            'idle': idle,
+            'inUse': open_conns - idle
+        }
+
+    def close_all(self):
+        """
+        Close every idle connection in the pool
+        """
+        while True:
+            try:
+                conn, _ = self._idle.get_nowait()
+            except queue.Empty:
+                return
+            self._close(conn)
@@ -1,6 +1,13 @@
 import unittest
+import threading
+import json
+import os
+import tempfile
 import db
 import apis
+import prices
+import classmap
+import getdbdata
 
 
 class TestDBMethods(unittest.TestCase):
@@ -84,3 +91,158 @@ class TestDBMethods(unittest.TestCase):
         updated_pass_hash, updated_pass_salt = apis.hash_password(updated_pass)
         _, err = db.update_user_password(new_user_id, updated_pass_hash, updated_pass_salt)
         self.assertIsNone(err)
+
+    def test_concurrent_pool_checkout(self):
+        # create user to read from several threads at once
+        new_user_email = 'test@email.com'
+        new_user_pass_hash, new_user_pass_salt = apis.hash_password('testpass')
+        db.create_user('First', 'Last', new_user_email, new_user_pass_hash, new_user_pass_salt)
+
+        errors = []
+
+        def read_user():
+            for _ in range(20):
+                res, err = db.read_user_by_email(new_user_email)
+                if err is not None or res['email'] != new_user_email:
+                    errors.append(err)
+
+        threads = [threading.Thread(target=read_user) for _ in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(errors, [])
+        self.assertLessEqual(db.pool.stats()['open'], db.pool.max_size)
+
+    def test_session_lifecycle(self):
+        # create user to own the session
+        new_user_pass_hash, new_user_pass_salt = apis.hash_password('testpass')
+        new_user_id, _ = db.create_user('First', 'Last', 'test@email.com', new_user_pass_hash, new_user_pass_salt)
+        token = 'a0b1c2d3-e4f5-4a6b-8c7d-9e0f1a2b3c4d'
+
+        res, err = db.create_session(new_user_id, token)
+        self.assertTrue(res)
+        self.assertIsNone(err)
+
+        # token lookup resolves to the owning user
+        res, err = db.read_session(token)
+        self.assertEqual(res, new_user_id)
+        self.assertIsNone(err)
+
+        # deleted sessions can no longer be read
+        db.delete_session(new_user_id, token)
+        res, err = db.read_session(token)
+        self.assertIsNone(res)
+        self.assertIsNotNone(err)
+
+    def test_purge_sessions(self):
+        res, err = db.purge_sessions()
+        self.assertIsInstance(res, int)
+        self.assertIsNone(err)
+
+    def test_price_feed_refresh(self):
+        med_id, _ = db.create_medication('', 'Pricefeedtest', '', 'round', 10, '', '', 'white', None, None)
+        fd, path = tempfile.mkstemp(suffix='.json')
+        changes = []
+
+        def listener(changed_id, row):
+            if changed_id == med_id:
+                changes.append((row['price'], row['priceSource']))
+
+        db.add_medication_listener(listener)
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump([
+                    {'name': 'Pricefeedtest (Tablets)', 'price': '$1,250.00 '},
+                    {'name': 'Pricefeedtest', 'price': '$12.50 '},
+                    {'name': 'Unpriced', 'price': 'N/A'}
+                ], f)
+
+            # the last listing of a name wins and its best price is materialized on the medication
+            res, err = prices.refresh_feed('Test', path)
+            self.assertIsNone(err)
+            self.assertEqual(res, {'prices': 1, 'changed': 1, 'removed': 0, 'skipped': 1})
+            med, _ = db.read_medication(med_id)
+            self.assertEqual((med['price'], med['priceSource']), (12.5, 'Test'))
+            # in-memory indexes are told about the new price
+            self.assertEqual(changes, [(12.5, 'Test')])
+
+            # an unchanged feed writes nothing
+            res, err = prices.refresh_feed('Test', path)
+            self.assertIsNone(err)
+            self.assertEqual(res['changed'], 0)
+            self.assertEqual(len(changes), 1)
+
+            # pruning a price missing from the feed clears it from the medication
+            with open(path, 'w') as f:
+                json.dump([], f)
+            res, err = prices.refresh_feed('Test', path, prune=True)
+            self.assertIsNone(err)
+            self.assertEqual(res['removed'], 1)
+            med, _ = db.read_medication(med_id)
+            self.assertIsNone(med['price'])
+            self.assertEqual(changes[-1], (None, None))
+        finally:
+            db.medication_listeners.remove(listener)
+            os.remove(path)
+            db.delete_prices('Test', ['pricefeedtest'])
+            db.delete_medication(med_id)
+
+    def test_source_fingerprints(self):
+        fd, path = tempfile.mkstemp(suffix='.csv')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                f.write(','.join(getdbdata.PILLBOX_COLUMNS) + '\n')
+                f.write('10,ROUND,AB;12,WHITE,,,,,Fingerprinttest 5 MG,1001,Fingerprinttest,Labs\n')
+                f.write(',OVAL,34,BLUE,,,,,Fingerprinttest 10 MG,,Fingerprinttest,Labs\n')
+                f.write('12,ROUND,AB;12,WHITE,,,,,Fingerprinttest 5 MG,1001,Fingerprinttest,Labs\n')
+            price_data, _ = getdbdata.load_price_data([])
+
+            def fingerprints(chunk_size: int):
+                occurrences = {}
+                medications = [med for chunk in getdbdata.read_chunks(path, chunk_size)
+                               for med in getdbdata.prepare_medications(chunk, price_data, occurrences)]
+                return [med[10:] for med in medications], occurrences
+
+            # keys and hashes don't depend on the types pandas infers for each chunk
+            single, occurrences = fingerprints(1)
+            full, _ = fingerprints(1000)
+            self.assertEqual(single, full)
+
+            # a row repeating an earlier row's identity gets its own key
+            self.assertEqual(len({key for key, _ in single}), 3)
+            self.assertEqual(getdbdata.duplicate_rows(occurrences), 1)
+        finally:
+            os.remove(path)
+
+    def test_class_medication_map(self):
+        med_ids = [db.create_medication('', name, '', 'round', 10, '', '', 'white', None, None)[0]
+                   for name in ['Classmaptest', 'Classmaptest 10 mg', 'CLASSMAPTEST/B', 'Classmaptestx']]
+        class_names = ['CLASSMAPTEST', 'Classmaptest 10', 'Classmaptest-b  Tablets USP', 'Classmaptestx 5MG',
+                       'Unmatched classmaptest']
+        try:
+            # exact names win, then names extending the class name, then the longest name the class name starts with
+            mappings, counts = classmap.match_classes(class_names, [
+                {'medId': med_id, 'medName': name} for med_id, name in
+                zip(med_ids, ['Classmaptest', 'Classmaptest 10 mg', 'CLASSMAPTEST/B', 'Classmaptestx'])
+            ])
+            self.assertEqual(mappings, [('CLASSMAPTEST', med_ids[0]), ('Classmaptest 10', med_ids[1]),
+                                        ('Classmaptest-b  Tablets USP', med_ids[2]), ('Classmaptestx 5MG', med_ids[3])])
+            self.assertEqual(counts, {'exact': 1, 'prefix': 3, 'unmatched': 1})
+
+            _, err = db.replace_class_medications(class_names, mappings)
+            self.assertIsNone(err)
+            meds, err = db.read_class_medications(['Classmaptest-b  Tablets USP', 'Classmaptest 10', 'Unmatched'], 5)
+            self.assertIsNone(err)
+            self.assertEqual({class_name: [med['medId'] for med in class_meds] for class_name, class_meds in meds.items()},
+                             {'Classmaptest-b  Tablets USP': [med_ids[2]], 'Classmaptest 10': [med_ids[1]],
+                              'Unmatched': []})
+
+            # mappings of deleted medications go with them
+            db.delete_medication(med_ids[2])
+            meds, _ = db.read_class_medications(['Classmaptest-b  Tablets USP'], 5)
+            self.assertEqual(meds, {'Classmaptest-b  Tablets USP': []})
+        finally:
+            db.replace_class_medications(class_names, [])
+            for med_id in med_ids:
+                db.delete_medication(med_id)
@@ -0,0 +1,35 @@
+# dbupdateclassmap.py
+# Adds ClassMedMap table, the medications of each image classifier class (classmap.py)
+
+import pymysql
+import os
+from pymysql.constants import CLIENT
+
+UPDATE_CLASS_MAP_SQL = '''
+        USE snaprx;
+
+        CREATE TABLE IF NOT EXISTS ClassMedMap(
+            `className` VARCHAR(255) NOT NULL,
+            `medId` INT NOT NULL,
+            PRIMARY KEY (`className`, `medId`),
+            KEY idx_classmedmap_med (`medId`),
+            CONSTRAINT fk_classMedMap_med FOREIGN KEY (`medId`)
+                REFERENCES Medications(`medId`)
+                ON DELETE CASCADE
+                ON UPDATE CASCADE
+        );
+        '''
+
+if __name__ == '__main__':
+    # connection object
+    conn = pymysql.connect(host=os.environ.get('DB_HOST'),
+                           user=os.environ.get('DB_USER'),
+                           password=os.environ.get('DB_PASS'),
+                           client_flag=CLIENT.MULTI_STATEMENTS)
+
+    # query to add class:medication map table
+    with conn.cursor() as curs:
+        curs.execute(UPDATE_CLASS_MAP_SQL)
+        conn.commit()
+
+        conn.close()
@@ -0,0 +1,31 @@
+# dbupdateimports.py
+# Adds ImportCheckpoints table used to resume interrupted streaming catalog imports (getdbdata.py -stream)
+
+import pymysql
+import os
+from pymysql.constants import CLIENT
+
+UPDATE_IMPORTS_SQL = '''
+        USE snaprx;
+
+        CREATE TABLE IF NOT EXISTS ImportCheckpoints(
+            `source` VARCHAR(255) NOT NULL,
+            `rowsDone` INT NOT NULL,
+            `updatedAt` DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+            PRIMARY KEY (`source`)
+        );
+        '''
+
+if __name__ == '__main__':
+    # connection object
+    conn = pymysql.connect(host=os.environ.get('DB_HOST'),
+                           user=os.environ.get('DB_USER'),
+                           password=os.environ.get('DB_PASS'),
+                           client_flag=CLIENT.MULTI_STATEMENTS)
+
+    # query to add import checkpoints table
+    with conn.cursor() as curs:
+        curs.execute(UPDATE_IMPORTS_SQL)
+        conn.commit()
+
+        conn.close()
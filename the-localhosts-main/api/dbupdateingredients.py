@@ -0,0 +1,60 @@
+# dbupdateingredients.py
+# Updates Ingredients and MedIngredientMap tables with the indexes used for ingredient lookups
+
+import pymysql
+import os
+from pymysql.constants import CLIENT
+
+# ingredient names are normalized the way getdbdata.py writes them (upper case, trimmed, at most 255 characters), and
+# ingredients whose names are then equal are merged into the one with the lowest ID before the unique index is added.
+# a medication mapped to several of them keeps one mapping, active if any of them was, and the merged ingredients' own
+# mappings are deleted with them (ON DELETE CASCADE)
+UPDATE_INGREDIENTS_SQL = '''
+        USE snaprx;
+
+        DELETE FROM Ingredients WHERE `ingredientName` IS NULL OR TRIM(`ingredientName`) = '';
+
+        UPDATE Ingredients SET `ingredientName` = LEFT(UPPER(TRIM(`ingredientName`)), 255);
+
+        CREATE TEMPORARY TABLE IngredientMerge AS
+        SELECT i.`ingredientId`, k.`keepId`
+        FROM Ingredients i
+        JOIN (
+            SELECT `ingredientName`, MIN(`ingredientId`) AS `keepId` FROM Ingredients GROUP BY `ingredientName`
+        ) k ON k.`ingredientName` = i.`ingredientName`
+        WHERE i.`ingredientId` <> k.`keepId`;
+
+        INSERT INTO MedIngredientMap (`medId`, `ingredientId`, `isActiveIngredient`)
+        SELECT * FROM (
+            SELECT mi.`medId`, m.`keepId`, MAX(mi.`isActiveIngredient`) AS `isActive`
+            FROM MedIngredientMap mi
+            JOIN IngredientMerge m ON m.`ingredientId` = mi.`ingredientId`
+            GROUP BY mi.`medId`, m.`keepId`
+        ) merged
+        ON DUPLICATE KEY UPDATE `isActiveIngredient` = GREATEST(`isActiveIngredient`, VALUES(`isActiveIngredient`));
+
+        DELETE FROM Ingredients WHERE `ingredientId` IN (SELECT `ingredientId` FROM IngredientMerge);
+
+        DROP TEMPORARY TABLE IngredientMerge;
+
+        ALTER TABLE Ingredients
+        MODIFY `ingredientName` VARCHAR(255) NOT NULL,
+        ADD UNIQUE KEY idx_ingredients_name (`ingredientName`);
+
+        ALTER TABLE MedIngredientMap
+        ADD KEY idx_medingredientmap_ingredient (`ingredientId`, `isActiveIngredient`);
+        '''
+
+if __name__ == '__main__':
+    # connection object
+    conn = pymysql.connect(host=os.environ.get('DB_HOST'),
+                           user=os.environ.get('DB_USER'),
+                           password=os.environ.get('DB_PASS'),
+                           client_flag=CLIENT.MULTI_STATEMENTS)
+
+    # query to merge duplicate ingredients and add ingredient indexes
+    with conn.cursor() as curs:
+        curs.execute(UPDATE_INGREDIENTS_SQL)
+        conn.commit()
+
+        conn.close()
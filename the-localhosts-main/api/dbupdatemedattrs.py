@@ -0,0 +1,38 @@
+# dbupdatemedattrs.py
+# Updates Medications table with indexed `shapeCode` and `colorMask` attribute codes, and fills them in for existing rows
+
+import pymysql
+import os
+import db
+from pymysql.constants import CLIENT
+
+UPDATE_MEDICATIONS_SQL = '''
+        USE snaprx;
+
+        ALTER TABLE Medications
+        ADD `shapeCode` TINYINT UNSIGNED NOT NULL DEFAULT 0,
+        ADD `colorMask` SMALLINT UNSIGNED NOT NULL DEFAULT 0,
+        ADD KEY idx_medications_shape_size (`shapeCode`, `size`),
+        ADD KEY idx_medications_size (`size`),
+        ADD KEY idx_medications_color (`colorMask`);
+        '''
+
+if __name__ == '__main__':
+    # connection object
+    conn = pymysql.connect(host=os.environ.get('DB_HOST'),
+                           user=os.environ.get('DB_USER'),
+                           password=os.environ.get('DB_PASS'),
+                           client_flag=CLIENT.MULTI_STATEMENTS)
+
+    # query to add attribute code columns
+    with conn.cursor() as curs:
+        curs.execute(UPDATE_MEDICATIONS_SQL)
+        conn.commit()
+
+        conn.close()
+
+    # compute codes for existing medications
+    n, err = db.backfill_medication_attribute_codes()
+    if err is not None:
+        raise RuntimeError(err)
+    print(f'Updated attribute codes for {n} medications.')
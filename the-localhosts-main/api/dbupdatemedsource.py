@@ -0,0 +1,29 @@
+# dbupdatemedsource.py
+# Updates Medications table with `sourceKey` and `sourceHash` columns used by incremental catalog syncs (getdbdata.py -sync)
+
+import pymysql
+import os
+from pymysql.constants import CLIENT
+
+UPDATE_MEDICATIONS_SQL = '''
+        USE snaprx;
+
+        ALTER TABLE Medications
+        ADD `sourceKey` CHAR(40),
+        ADD `sourceHash` CHAR(40),
+        ADD UNIQUE KEY idx_medications_source (`sourceKey`);
+        '''
+
+if __name__ == '__main__':
+    # connection object
+    conn = pymysql.connect(host=os.environ.get('DB_HOST'),
+                           user=os.environ.get('DB_USER'),
+                           password=os.environ.get('DB_PASS'),
+                           client_flag=CLIENT.MULTI_STATEMENTS)
+
+    # query to add source columns
+    with conn.cursor() as curs:
+        curs.execute(UPDATE_MEDICATIONS_SQL)
+        conn.commit()
+
+        conn.close()
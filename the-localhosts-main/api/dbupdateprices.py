@@ -0,0 +1,38 @@
+# dbupdateprices.py
+# Adds Prices table and the Medications price name/price indexes used by the price store (prices.py)
+
+import pymysql
+import os
+from pymysql.constants import CLIENT
+
+UPDATE_PRICES_SQL = '''
+        USE snaprx;
+
+        CREATE TABLE IF NOT EXISTS Prices(
+            `priceName` VARCHAR(255) NOT NULL,
+            `source` VARCHAR(32) NOT NULL,
+            `price` DECIMAL(10, 2) NOT NULL,
+            `updatedAt` DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+            PRIMARY KEY (`priceName`, `source`),
+            KEY idx_prices_source (`source`)
+        );
+
+        ALTER TABLE Medications
+        ADD COLUMN `priceName` VARCHAR(255) AS (LEFT(LOWER(TRIM(`medName`)), 255)) STORED,
+        ADD KEY idx_medications_price_name (`priceName`),
+        ADD KEY idx_medications_price (`price`);
+        '''
+
+if __name__ == '__main__':
+    # connection object
+    conn = pymysql.connect(host=os.environ.get('DB_HOST'),
+                           user=os.environ.get('DB_USER'),
+                           password=os.environ.get('DB_PASS'),
+                           client_flag=CLIENT.MULTI_STATEMENTS)
+
+    # query to add price store table and indexes
+    with conn.cursor() as curs:
+        curs.execute(UPDATE_PRICES_SQL)
+        conn.commit()
+
+        conn.close()
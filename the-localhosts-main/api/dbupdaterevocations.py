@@ -0,0 +1,47 @@
+# dbupdaterevocations.py
+# Adds Revocations table, the signed session token revocations shared by every API process (tokens.py), and
+# schedules cleanup of expired revocations
+
+import pymysql
+import os
+from pymysql.constants import CLIENT
+
+UPDATE_REVOCATIONS_SQL = '''
+        USE snaprx;
+
+        CREATE TABLE IF NOT EXISTS Revocations(
+            `revocationId` INT NOT NULL AUTO_INCREMENT,
+            `tokenId` BINARY(8),
+            `userId` INT,
+            `notBefore` BIGINT,
+            `exemptTokenId` BINARY(8),
+            `createdAt` DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            `expiresAt` DATETIME NOT NULL,
+            PRIMARY KEY (`revocationId`),
+            KEY idx_revocations_created (`createdAt`),
+            KEY idx_revocations_expires (`expiresAt`)
+        );
+
+        DROP EVENT IF EXISTS delete_revocations;
+
+        CREATE EVENT delete_revocations
+        ON SCHEDULE EVERY 5 MINUTE
+        ON COMPLETION PRESERVE
+        DO BEGIN
+              DELETE FROM Revocations WHERE `expiresAt` < NOW();
+        END;
+        '''
+
+if __name__ == '__main__':
+    # connection object
+    conn = pymysql.connect(host=os.environ.get('DB_HOST'),
+                           user=os.environ.get('DB_USER'),
+                           password=os.environ.get('DB_PASS'),
+                           client_flag=CLIENT.MULTI_STATEMENTS)
+
+    # query to add revocations table
+    with conn.cursor() as curs:
+        curs.execute(UPDATE_REVOCATIONS_SQL)
+        conn.commit()
+
+        conn.close()
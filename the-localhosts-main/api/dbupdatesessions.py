@@ -0,0 +1,48 @@
+# dbupdatesessions.py
+# Updates Sessions table to be keyed by `token` with an `expiresAt` column, and reschedules expired session cleanup
+# to run repeatedly instead of once
+
+import pymysql
+import os
+from pymysql.constants import CLIENT
+
+UPDATE_SESSIONS_SQL = '''
+        USE snaprx;
+
+        DROP EVENT IF EXISTS delete_sessions;
+
+        DELETE FROM Sessions WHERE `timestamp` < DATE_SUB(NOW(), INTERVAL 1 HOUR);
+
+        ALTER TABLE Sessions
+        ADD `expiresAt` DATETIME,
+        ADD KEY idx_sessions_user (`userId`),
+        DROP PRIMARY KEY,
+        ADD PRIMARY KEY (`token`);
+
+        UPDATE Sessions SET `expiresAt` = DATE_ADD(`timestamp`, INTERVAL 1 HOUR);
+
+        ALTER TABLE Sessions
+        MODIFY `expiresAt` DATETIME NOT NULL,
+        ADD KEY idx_sessions_expires (`expiresAt`);
+
+        CREATE EVENT delete_sessions
+        ON SCHEDULE EVERY 5 MINUTE
+        ON COMPLETION PRESERVE
+        DO BEGIN
+              DELETE FROM Sessions WHERE `expiresAt` < NOW();
+        END;
+        '''
+
+if __name__ == '__main__':
+    # connection object
+    conn = pymysql.connect(host=os.environ.get('DB_HOST'),
+                           user=os.environ.get('DB_USER'),
+                           password=os.environ.get('DB_PASS'),
+                           client_flag=CLIENT.MULTI_STATEMENTS)
+
+    # query to migrate Sessions table
+    with conn.cursor() as curs:
+        curs.execute(UPDATE_SESSIONS_SQL)
+        conn.commit()
+
+        conn.close()
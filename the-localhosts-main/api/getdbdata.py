@@ -1,64 +1,396 @@
 import pandas as pd
 import argparse
 import db
-import json
+import hashlib
+import math
+import numpy as np
+import os
+import time
+import openpyxl
+import classmap
+import prices
+
+PILLBOX_COLUMNS = ['splsize', 'splshape_text', 'splimprint', 'splcolor_text', 'spl_strength', 'spl_ingredients', 'spl_inactive_ing', 'source', 'rxstring', 'rxcui', 'medicine_name', 'author']
+
+
+def load_price_data(rows: list = None):
+    """
+    Load the best price of every medication name from the price store (prices.py)
+
+    :param rows: price store rows with priceName, source and price, read from the database if not given
+    :return: DataFrame indexed by price name with price and price_source columns, err
+    """
+    if rows is None:
+        rows, err = db.read_prices()
+        if err is not None:
+            return None, err
+    best = prices.best_prices(rows)
+    return pd.DataFrame({
+        'price': [price for price, _ in best.values()],
+        'price_source': [source for _, source in best.values()]
+    }, index=pd.Index(list(best), name='name')), None
+
+
+def prepare_medications(df: pd.DataFrame, price_data: pd.DataFrame, occurrences: dict = None):
+    """
+    Convert Pillbox rows to medication rows for db.create_medications
+
+    :param df: Pillbox rows with PILLBOX_COLUMNS, missing values filled with ''
+    :param price_data: best prices from load_price_data
+    :param occurrences: source identity -> rows seen so far, shared by the chunks of one file so rows repeating an
+        identity get distinct source keys
+    :return: list of medication tuples, ending with source key and source fingerprint
+    """
+    # join best prices on the price name Medications derives from medName
+    names = df['medicine_name'].astype(str).str.strip().str.lower().str[:255]
+    price = names.map(price_data['price'])
+    price_source = names.map(price_data['price_source'])
+
+    # split 'FRONT;BACK' imprints, back imprints only kept when there are exactly two parts
+    imprints = df['splimprint'].astype(str).str.split(';', n=2, expand=True).reindex(columns=[0, 1, 2])
+    imprint_front = imprints[0]
+    imprint_back = imprints[1].where(imprints[2].isna(), '').fillna('')
+
+    medications = pd.DataFrame({
+        'rxString': df['rxstring'],
+        'medName': df['medicine_name'],
+        'medDetails': 'Active ingredients: ' + df['spl_ingredients'].astype(str) + '. Inactive ingredients: ' + df['spl_inactive_ing'].astype(str) + '.',
+        'shape': df['splshape_text'],
+        'size': df['splsize'].where(df['splsize'] != '', -1),
+        'imprintFront': imprint_front,
+        'imprintBack': imprint_back,
+        'color': df['splcolor_text'],
+        'price': price.astype(object).where(price.notna(), None),
+        'priceSource': price_source.astype(object).where(price_source.notna(), None)
+    })
+    rows = zip(*(medications[column].tolist() for column in medications.columns))
+
+    # rows are identified across imports by rxcui (rxstring if missing), manufacturer and imprint, and fingerprinted
+    # by their prepared values so a sync can tell which rows changed. Values are normalized first, pandas reads a
+    # column as float in chunks with a missing value and as int in chunks without
+    rxcui = [_source_value(value) for value in df['rxcui'].tolist()]
+    rxstring = [_source_value(value) for value in df['rxstring'].tolist()]
+    authors = [_source_value(value) for value in df['author'].tolist()]
+    imprints = [_source_value(value) for value in df['splimprint'].tolist()]
+    if occurrences is None:
+        occurrences = {}
+    medications = []
+    for row, identity in zip(rows, zip(rxcui, rxstring, authors, imprints)):
+        identity = '\x1f'.join((identity[0] or identity[1], *identity[2:]))
+        # rows sharing an identity are told apart by their order in the file, the first keeps the plain identity
+        n = occurrences.get(identity, 0)
+        occurrences[identity] = n + 1
+        if n:
+            identity = f'{identity}\x1f#{n}'
+        medications.append((*row, _sha1(identity), _sha1('\x1f'.join(_source_value(value) for value in row))))
+    return medications
+
+
+def _source_value(value):
+    # one text form per value whatever type pandas read it as: integral numbers without '.0', missing values as ''
+    if value is None or (isinstance(value, (float, np.floating)) and math.isnan(value)):
+        return ''
+    if isinstance(value, (int, float, np.integer, np.floating)) and not isinstance(value, bool):
+        return str(int(value)) if float(value).is_integer() else repr(float(value))
+    return str(value).strip()
+
+
+def duplicate_rows(occurrences: dict):
+    """
+    Count rows that shared a source identity with an earlier row of the file
+
+    :param occurrences: identity counts filled in by prepare_medications
+    :return: number of rows stored under numbered source keys
+    """
+    return sum(n - 1 for n in occurrences.values())
+
+
+def _sha1(text: str):
+    return hashlib.sha1(text.encode()).hexdigest()
+
+
+def prepare_ingredients(df: pd.DataFrame):
+    """
+    Parse the active and inactive ingredient lists of Pillbox rows
+
+    :param df: Pillbox rows with PILLBOX_COLUMNS, missing values filled with ''
+    :return: list of (active ingredient names, inactive ingredient names) per row
+    """
+    return list(zip(_ingredient_names(df['spl_ingredients']), _ingredient_names(df['spl_inactive_ing'])))
+
+
+def _ingredient_names(column: pd.Series):
+    # 'ACETAMINOPHEN[325 mg];HYDROCODONE BITARTRATE[5 mg]' -> ['ACETAMINOPHEN', 'HYDROCODONE BITARTRATE']
+    names = column.astype(str).str.upper().str.replace(r'\[[^\]]*\]', '', regex=True).str.split(';')
+    return [list(dict.fromkeys(n for n in (' '.join(name.split())[:255] for name in row) if n)) for row in names.tolist()]
+
+
+def write_ingredients(medications: list, ingredients: list, batch_size: int):
+    """
+    Store the ingredients of written medications, replacing the ones they had before
+
+    :param medications: medication tuples from prepare_medications, already written
+    :param ingredients: (active, inactive) ingredient names from prepare_ingredients, aligned with medications
+    :param batch_size: rows per INSERT statement
+    :return: number of medication:ingredient mappings written, err
+    """
+    med_ids, err = db.read_medication_ids_by_source([med[10] for med in medications], batch_size)
+    if err is not None:
+        return None, err
+    ingredient_ids, err = db.create_ingredients([name for names in ingredients for group in names for name in group], batch_size)
+    if err is not None:
+        return None, err
+
+    mappings = []
+    for med, (active, inactive) in zip(medications, ingredients):
+        med_id = med_ids.get(med[10])
+        if med_id is None:
+            continue
+        # names the database collation folds onto another stored name are skipped
+        mappings += [(med_id, ingredient_ids[name], True) for name in active if name in ingredient_ids]
+        mappings += [(med_id, ingredient_ids[name], False) for name in inactive if name in ingredient_ids]
+    return db.replace_medication_ingredients(list(set(med_ids.values())), mappings, batch_size)
+
+
+def report_duplicates(occurrences: dict):
+    duplicates = duplicate_rows(occurrences)
+    if duplicates:
+        print(f'{duplicates} rows repeat the rxcui, author and imprint of an earlier row, they are stored under numbered source keys')
 
-if __name__ == '__main__':
-    # parse arguments for data path
-    parser = argparse.ArgumentParser()
-    parser.add_argument('-path', default='./static/pillboxdata.csv')
-    args = parser.parse_args()
 
+def read_chunks(path: str, chunk_size: int):
+    """
+    Read a Pillbox Excel or CSV export in DataFrame chunks, without loading the whole file
+
+    :param path: path to Excel or CSV file
+    :param chunk_size: rows per chunk
+    :return: generator of DataFrames with PILLBOX_COLUMNS, missing values filled with ''
+    """
+    try:
+        workbook = openpyxl.load_workbook(path, read_only=True)
+    except Exception:
+        workbook = None
+
+    if workbook is None:
+        for chunk in pd.read_csv(path, header=0, skip_blank_lines=True, chunksize=chunk_size):
+            yield chunk[PILLBOX_COLUMNS].fillna('')
+        return
+
+    try:
+        rows = workbook.active.iter_rows(values_only=True)
+        header = next(rows)
+        chunk = []
+        for row in rows:
+            chunk.append(row)
+            if len(chunk) == chunk_size:
+                yield pd.DataFrame(chunk, columns=header)[PILLBOX_COLUMNS].fillna('')
+                chunk = []
+        if chunk:
+            yield pd.DataFrame(chunk, columns=header)[PILLBOX_COLUMNS].fillna('')
+    finally:
+        workbook.close()
+
+
+def stream_import(path: str, chunk_size: int, batch_size: int, restart: bool = False):
+    """
+    Import a Pillbox export chunk by chunk, checkpointing each committed chunk so an interrupted import resumes after
+    the last one
+
+    :param path: path to Excel or CSV file
+    :param chunk_size: rows read, prepared and committed at a time
+    :param batch_size: rows per INSERT statement
+    :param restart: ignore an existing checkpoint and import from the first row
+    :return: number of medications imported by this run, err
+    """
+    # the file size is part of the source key, so a replaced file doesn't resume from a stale checkpoint
+    source = f'{os.path.basename(path)}:{os.path.getsize(path)}'
+    rows_done, err = (0, None) if restart else db.read_import_checkpoint(source)
+    if err is not None:
+        return None, err
+    if rows_done:
+        print(f'Resuming {source} after {rows_done} rows')
+
+    price_data, err = load_price_data()
+    if err is not None:
+        return None, err
+    start = time.perf_counter()
+    imported = 0
+    position = 0
+    occurrences = {}
+    for chunk in read_chunks(path, chunk_size):
+        chunk_start, position = position, position + len(chunk)
+        # skipped chunks are still prepared, so repeated identities get the same numbered keys as in the first run
+        medications = prepare_medications(chunk, price_data, occurrences)
+        if position <= rows_done:
+            continue
+        skipped = max(rows_done - chunk_start, 0)
+        chunk, medications = chunk.iloc[skipped:], medications[skipped:]
+
+        # writing a chunk twice only updates it, so the checkpoint is recorded after the chunk's ingredients
+        count, err = db.create_medications(medications, batch_size, upsert=True)
+        if err is None:
+            _, err = write_ingredients(medications, prepare_ingredients(chunk), batch_size)
+        if err is None:
+            _, err = db.update_import_checkpoint(source, position)
+        if err is not None:
+            return imported, err
+        imported += count
+        print(f'{position} rows committed ({imported / (time.perf_counter() - start):.0f} rows/s)')
+
+    db.delete_import_checkpoint(source)
+    report_duplicates(occurrences)
+    return imported, None
+
+
+def sync_import(path: str, chunk_size: int, batch_size: int, prune: bool = False):
+    """
+    Bring the catalog in line with a Pillbox export, writing only new and changed rows
+
+    Rows imported before source keys were recorded are matched on rxString and imprints the first time they are
+    synced. Syncs are idempotent, so an interrupted sync is simply run again.
+
+    :param path: path to Excel or CSV file
+    :param chunk_size: rows read and written at a time
+    :param batch_size: rows per INSERT statement
+    :param prune: delete medications that are no longer in the export (and users' saved copies of them)
+    :return: dict of inserted, updated, unchanged and deleted row counts and of rows repeating an earlier row's
+        identity, err
+    """
+    sources, err = db.read_medication_sources()
+    if err is not None:
+        return None, err
+    # sourceKey -> (medId, sourceHash), and (rxString, imprintFront, imprintBack) -> medId of rows without a sourceKey
+    known = {}
+    unkeyed = {}
+    for row in sources:
+        if row['sourceKey'] is not None:
+            known[row['sourceKey']] = (row['medId'], row['sourceHash'])
+        else:
+            unkeyed.setdefault((row['rxString'], row['imprintFront'], row['imprintBack']), row['medId'])
+
+    price_data, err = load_price_data()
+    if err is not None:
+        return None, err
+    counts = {'inserted': 0, 'updated': 0, 'unchanged': 0, 'deleted': 0, 'duplicates': 0}
+    seen = set()
+    position = 0
+    occurrences = {}
+    for chunk in read_chunks(path, chunk_size):
+        position += len(chunk)
+        changed = []
+        changed_ingredients = []
+        adopted = []
+        for med, med_ingredients in zip(prepare_medications(chunk, price_data, occurrences), prepare_ingredients(chunk)):
+            source_key, source_hash = med[10], med[11]
+            seen.add(source_key)
+            if source_key in known:
+                med_id, known_hash = known[source_key]
+                if known_hash == source_hash:
+                    counts['unchanged'] += 1
+                    continue
+                counts['updated'] += 1
+            else:
+                med_id = unkeyed.pop((med[0], med[5], med[6]), None)
+                if med_id is not None:
+                    adopted.append((source_key, med_id))
+                    counts['updated'] += 1
+                else:
+                    counts['inserted'] += 1
+            known[source_key] = (med_id, source_hash)
+            changed.append(med)
+            changed_ingredients.append(med_ingredients)
+
+        # give matched rows their source key first, so the upsert updates them in place
+        if adopted:
+            _, err = db.update_medication_source_keys(adopted, batch_size)
+            if err is not None:
+                return counts, err
+        if changed:
+            _, err = db.create_medications(changed, batch_size, upsert=True)
+            if err is None:
+                _, err = write_ingredients(changed, changed_ingredients, batch_size)
+            if err is not None:
+                return counts, err
+        print(f'{position} rows synced ({counts["inserted"]} inserted, {counts["updated"]} updated, {counts["unchanged"]} unchanged)')
+
+    counts['duplicates'] = duplicate_rows(occurrences)
+    if prune:
+        removed = [med_id for source_key, (med_id, _) in known.items() if source_key not in seen and med_id is not None]
+        counts['deleted'], err = db.delete_medications(removed, batch_size)
+        if err is not None:
+            return counts, err
+    return counts, None
+
+
+def full_import(path: str, batch_size: int):
+    """
+    Import a Pillbox export read into memory at once, medications committed as a single transaction
+
+    :param path: path to Excel or CSV file
+    :param batch_size: rows per INSERT statement
+    :return: number of medications imported, err
+    """
     # parse input file to df
     try:
-        df = pd.read_excel(open(args.path, 'rb'), header=0)
+        df = pd.read_excel(open(path, 'rb'), header=0)
     except:
-        df = pd.read_csv(open(args.path, 'rb'), header=0, skip_blank_lines=True)
-    df = df[['splsize', 'splshape_text', 'splimprint', 'splcolor_text', 'spl_strength', 'spl_ingredients', 'spl_inactive_ing', 'source', 'rxstring', 'rxcui', 'medicine_name', 'author']]
+        df = pd.read_csv(open(path, 'rb'), header=0, skip_blank_lines=True)
+    df = df[PILLBOX_COLUMNS]
     df = df.fillna('')
 
-    # get price data
-    price_data = {}
-    with open('./static/price_data/amazondrugprice.json') as f:
-        data = json.load(f)
-        for _, item in enumerate(data):
-            med_name = item['name'].split('(')[0].strip()
-            med_price = float(item['price'].replace(',', '').replace('$', '').strip())
-            price_data[med_name.lower()] = {
-                'source': 'Amazon',
-                'price': med_price
-            }
-    with open('./static/price_data/costcoprice.json') as f:
-        data = json.load(f)
-        for _, item in enumerate(data):
-            med_name = item['name'].split('(')[0].strip()
-            med_price = float(item['price'].replace(',', '').replace('$', '').strip())
-            if med_name not in price_data or price_data[med_name]['price'] > med_price:
-                price_data[med_name.lower()] = {
-                    'source': 'Costco',
-                    'price': med_price
-                }
-
-    # append price data to df
-    df[['price', 'price_source']] = None
-    for i, row in df.iterrows():
-        med_name_l = row['medicine_name'].lower()
-        if med_name_l in price_data:
-            df.at[i, 'price'] = price_data[med_name_l]['price']
-            df.at[i, 'price_source'] = price_data[med_name_l]['source']
-
-    # write df to mysql
-    for _, row in df.iterrows():
-        imprints = str(row['splimprint']).split(';')
-        db.create_medication(
-            row['rxstring'],
-            row['medicine_name'],
-            f'Active ingredients: {row["spl_ingredients"]}. Inactive ingredients: {row["spl_inactive_ing"]}.',
-            row['splshape_text'],
-            row['splsize'] if row['splsize'] != '' else -1,
-            imprints[0],
-            imprints[1] if len(imprints) == 2 else '',
-            row['splcolor_text'],
-            row['price'],
-            row['price_source']
-        )
+    # build medication rows with best price data
+    price_data, err = load_price_data()
+    if err is not None:
+        return None, err
+    occurrences = {}
+    medications = prepare_medications(df, price_data, occurrences)
+    report_duplicates(occurrences)
+
+    # write medications to mysql in batches
+    start = time.perf_counter()
+
+    def report(done: int):
+        elapsed = time.perf_counter() - start
+        print(f'{done}/{len(medications)} medications written ({done / elapsed:.0f} rows/s)')
+
+    # rows already imported under the same source key are updated rather than duplicated
+    count, err = db.create_medications(medications, batch_size, report, upsert=True)
+    if err is not None:
+        return None, err
+    _, err = write_ingredients(medications, prepare_ingredients(df), batch_size)
+    return count, err
+
+
+if __name__ == '__main__':
+    # parse arguments for data path
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-path', default='./static/pillboxdata.csv')
+    parser.add_argument('-batchsize', type=int, default=1000)
+    parser.add_argument('-stream', action='store_true', help='read, prepare and commit the file in chunks')
+    parser.add_argument('-chunksize', type=int, default=50000)
+    parser.add_argument('-restart', action='store_true', help='ignore the checkpoint of an interrupted -stream import')
+    parser.add_argument('-sync', action='store_true', help='only insert new and update changed medications')
+    parser.add_argument('-prune', action='store_true', help='with -sync, delete medications missing from the file')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    # bring the price store up to date first, only changed feed prices are written
+    _, err = prices.refresh_feeds(batch_size=args.batchsize)
+    if err is None:
+        if args.sync:
+            result, err = sync_import(args.path, args.chunksize, args.batchsize, args.prune)
+        elif args.stream:
+            result, err = stream_import(args.path, args.chunksize, args.batchsize, args.restart)
+        else:
+            result, err = full_import(args.path, args.batchsize)
+    if err is not None:
+        print(err['err'])
+    else:
+        if args.sync:
+            print(f'Synced medications in {time.perf_counter() - start:.1f}s: {result}')
+        else:
+            print(f'Imported {result} medications in {time.perf_counter() - start:.1f}s')
+        # new and renamed medications change which of them each image classifier class maps to
+        if os.path.exists(classmap.CLASS_NAMES_PATH):
+            mapped, err = classmap.build(classmap.load_class_names(), args.batchsize)
+            print(err['err'] if err is not None else f'Mapped classes to medications: {mapped}')
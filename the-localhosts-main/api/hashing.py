@@ -0,0 +1,158 @@
+# hashing.py
+# Bounded worker pool for PBKDF2 password hashing
+#
+# Each hash takes 100,000 PBKDF2-SHA256 iterations. Running them on a worker pool spreads a login burst across cores,
+# and the queue limit turns a burst larger than the pool can absorb into fast 503s instead of request threads piling
+# up behind hash work and stalling unrelated endpoints.
+
+import hashlib
+import hmac
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+HASH_ITERATIONS = 100000
+# 'thread' hashes in worker threads, 'process' in worker processes, 'inline' on the calling thread. threads hash in
+# parallel, hashlib releases the GIL while OpenSSL runs PBKDF2
+HASH_EXECUTOR = os.environ.get('PASSWORD_HASH_EXECUTOR', 'thread')
+HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS', os.cpu_count() or 1))
+# hash jobs queued or running at once, beyond which new jobs are rejected
+HASH_QUEUE_LIMIT = int(os.environ.get('PASSWORD_HASH_QUEUE_LIMIT', 4 * HASH_WORKERS))
+
+
+class HashQueueFullError(Exception):
+    """
+    Raised when a hash job is submitted while HASH_QUEUE_LIMIT jobs are already queued or running
+    """
+    pass
+
+
+def _pbkdf2(password: str, salt: bytes):
+    return hashlib.pbkdf2_hmac('sha256', password.encode(), salt, HASH_ITERATIONS)
+
+
+def _hash_job(password: str, salt: bytes):
+    start = time.perf_counter()
+    return _pbkdf2(password, salt), time.perf_counter() - start
+
+
+def _verify_job(password: str, credentials: list):
+    start = time.perf_counter()
+    for password_hash, salt in credentials:
+        if password_hash is not None and salt is not None and hmac.compare_digest(password_hash, _pbkdf2(password, salt)):
+            return True, time.perf_counter() - start
+    return False, time.perf_counter() - start
+
+
+class HashExecutor:
+    """
+    Runs password hash jobs on a lazily started worker pool, bounded by a queue limit
+    """
+
+    def __init__(self, kind: str = HASH_EXECUTOR, workers: int = HASH_WORKERS, queue_limit: int = HASH_QUEUE_LIMIT):
+        self.kind = kind
+        self.workers = workers
+        self.queue_limit = queue_limit
+        self._pool = None
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._peak_pending = 0
+        self._completed = 0
+        self._rejected = 0
+        self._queue_time = 0.0
+        self._hash_time = 0.0
+
+    def _get_pool(self):
+        with self._lock:
+            if self._pool is None:
+                if self.kind == 'process':
+                    # workers are spawned, not forked: the pool starts on the first login, when forking could copy
+                    # a lock held by another thread (TensorFlow's, the DB pool's) into a worker and deadlock it.
+                    # spawned workers re-import the main module, whose __main__ guard keeps them from serving
+                    self._pool = ProcessPoolExecutor(max_workers=self.workers,
+                                                     mp_context=multiprocessing.get_context('spawn'))
+                else:
+                    self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='hash')
+            return self._pool
+
+    def _run(self, job, *args):
+        with self._lock:
+            if self._pending >= self.queue_limit:
+                self._rejected += 1
+                raise HashQueueFullError()
+            self._pending += 1
+            self._peak_pending = max(self._peak_pending, self._pending)
+
+        start = time.perf_counter()
+        try:
+            if self.kind == 'inline':
+                result, hash_time = job(*args)
+            else:
+                result, hash_time = self._get_pool().submit(job, *args).result()
+        except BrokenProcessPool:
+            # a worker process died, start a fresh pool for the next job
+            with self._lock:
+                self._pool = None
+            raise
+        finally:
+            with self._lock:
+                self._pending -= 1
+        with self._lock:
+            self._completed += 1
+            self._queue_time += time.perf_counter() - start - hash_time
+            self._hash_time += hash_time
+        return result
+
+    def hash_password(self, password: str):
+        """
+        Hash and salt a plaintext password
+
+        :param password: input password
+        :return: hash, salt
+        """
+        salt = os.urandom(16)
+        return self._run(_hash_job, password, salt), salt
+
+    def verify_password(self, password: str, credentials: list):
+        """
+        Validate a password against one or more stored hashes in a single job, stopping at the first match
+
+        :param password: input password
+        :param credentials: list of (password hash, salt), entries with a None hash or salt never match
+        :return: boolean indicating whether any hash matched
+        """
+        return self._run(_verify_job, password, credentials)
+
+    def stats(self):
+        """
+        Get executor counters
+
+        :return: dict of executor counters
+        """
+        with self._lock:
+            return {
+                'executor': self.kind,
+                'workers': self.workers,
+                'queueLimit': self.queue_limit,
+                'pending': self._pending,
+                'peakPending': self._peak_pending,
+                'completed': self._completed,
+                'rejected': self._rejected,
+                'avgQueueMs': round(self._queue_time / self._completed * 1000, 2) if self._completed else 0.0,
+                'avgHashMs': round(self._hash_time / self._completed * 1000, 2) if self._completed else 0.0
+            }
+
+    def shutdown(self):
+        """
+        Stop the worker pool, waiting for running jobs
+        """
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown()
+
+
+executor = HashExecutor()
@@ -1,18 +1,268 @@
+import hashlib
+import io
+import json
+import os
 import pickle
+import threading
+import time
 import numpy as np
-from keras.utils import load_img, img_to_array
-from keras.models import load_model
-
-# load model data
-model = load_model('../model/model.keras')
-with open('../model/class_names.pickle', 'rb') as f:
-    class_names = pickle.load(f)
-
-
-# predict medication using trained image model
-def predict(image_path):
-    img = load_img(image_path, target_size=(128, 128))
-    input_arr = img_to_array(img)
-    output = model.predict(np.array([input_arr]))
-    pred_ind = np.argmax(output)
-    return class_names[pred_ind], output[0][pred_ind]
+from PIL import Image
+from batching import MicroBatcher
+from cache import TTLCache
+from numpyengine import NumpyModel
+
+# model input height, width
+IMAGE_SIZE = (128, 128)
+MODEL_PATH = os.environ.get('CLASSIFIER_MODEL_PATH', '../model/model.keras')
+CLASS_NAMES_PATH = os.environ.get('CLASSIFIER_CLASS_NAMES_PATH', '../model/class_names.pickle')
+# 'keras' serves MODEL_PATH with Keras, 'tflite' serves the export written by model/export.py, whose manifest
+# (<TFLITE_PATH>.json) holds the class names, and 'numpy' serves the model saved by numpyengine.py without TensorFlow
+RUNTIME = os.environ.get('CLASSIFIER_RUNTIME', 'keras')
+TFLITE_PATH = os.environ.get('CLASSIFIER_TFLITE_PATH', '../model/model.tflite')
+NUMPY_PATH = os.environ.get('CLASSIFIER_NUMPY_PATH', '../model/model_numpy')
+# interpreter threads for the tflite runtime
+TFLITE_THREADS = int(os.environ.get('CLASSIFIER_TFLITE_THREADS', os.cpu_count() or 1))
+# 'background' loads the model on a thread when the server starts, 'eager' before it starts and 'lazy' on the first
+# classify request. Importing this module never loads it, so tests and scripts that don't classify skip TensorFlow
+LOAD_MODE = os.environ.get('CLASSIFIER_LOAD_MODE', 'background')
+# images run through the model in one call, and milliseconds the first queued image waits for a batch to fill up
+MAX_BATCH_SIZE = int(os.environ.get('CLASSIFIER_MAX_BATCH_SIZE', 16))
+MAX_BATCH_WAIT_MS = float(os.environ.get('CLASSIFIER_MAX_BATCH_WAIT_MS', 5))
+# images waiting for the model, beyond which classify requests get 503 responses
+QUEUE_LIMIT = int(os.environ.get('CLASSIFIER_QUEUE_LIMIT', 256))
+
+# repeated uploads of an image are answered from a cache of predictions, keyed by the model version and a hash of the
+# decoded image. With PREDICTION_CACHE_PHASH the hash is a 64-bit perceptual one, so some re-encoded copies of a photo
+# also hit (about half of the sample images re-saved as quality 95 JPEGs keep their hash). Keys are only ever matched
+# exactly: different sample pills are as few as 2 bits apart, too close for a distance threshold
+PREDICTION_CACHE_SIZE = int(os.environ.get('PREDICTION_CACHE_SIZE', 1024))
+PREDICTION_CACHE_TTL = float(os.environ.get('PREDICTION_CACHE_TTL', 600))
+PREDICTION_CACHE_PHASH = os.environ.get('PREDICTION_CACHE_PHASH', '0') == '1'
+
+# model data, set by load(). model has predict_on_batch whichever runtime serves it
+model = None
+class_names = None
+# identifies the served model files in prediction cache keys. the model is loaded once per process and never reloaded,
+# so serving a new model takes a restart, which starts with an empty cache
+model_version = None
+# (model version, image hash) -> most probable (class name, probability) pairs, filled in by the classify endpoint
+prediction_cache = TTLCache(max_size=PREDICTION_CACHE_SIZE, ttl=PREDICTION_CACHE_TTL)
+_load_lock = threading.Lock()
+_load_state = {
+    'runtime': RUNTIME,
+    'loading': False,
+    'loadSeconds': None,
+    'warmupSeconds': None,
+    'error': None
+}
+
+
+# batch size a batch of n images is padded to: the next power of two, so a model that is allocated per batch size
+# (TFLiteModel) needs a handful of sizes for micro-batches of every size and wastes less than half of a padded batch
+def padded_batch_size(n: int):
+    return 1 << (n - 1).bit_length()
+
+
+class TFLiteModel:
+    """
+    TFLite interpreters with Keras' predict_on_batch. Batches are padded to padded_batch_size() and each padded size
+    gets its own interpreter, allocated once, so micro-batches of changing sizes never reallocate tensors. Also used by
+    model/export.py and model/quantize.py to evaluate exports before they are written
+    """
+
+    def __init__(self, path: str = None, threads: int = None, model_content: bytes = None):
+        # the standalone tflite-runtime package is a few MB, full TensorFlow also has the interpreter
+        try:
+            from tflite_runtime.interpreter import Interpreter
+        except ImportError:
+            from tensorflow.lite import Interpreter
+        self._new_interpreter = lambda: Interpreter(model_path=path, model_content=model_content, num_threads=threads)
+        interpreter = self._new_interpreter()
+        input_details = interpreter.get_input_details()[0]
+        self.input_shape = tuple(input_details['shape_signature'])
+        self._input = input_details['index']
+        self._output = interpreter.get_output_details()[0]['index']
+        interpreter.allocate_tensors()
+        # padded batch size -> interpreter allocated for it
+        self._interpreters = {int(input_details['shape'][0]): interpreter}
+
+    def _interpreter(self, batch_size: int):
+        interpreter = self._interpreters.get(batch_size)
+        if interpreter is None:
+            interpreter = self._new_interpreter()
+            interpreter.resize_input_tensor(self._input, (batch_size, *self.input_shape[1:]))
+            interpreter.allocate_tensors()
+            self._interpreters[batch_size] = interpreter
+        return interpreter
+
+    def predict_on_batch(self, images):
+        # batches are run by one thread at a time (the batcher's worker), the interpreters are not thread safe
+        images = np.asarray(images, dtype=np.float32)
+        n = len(images)
+        batch_size = padded_batch_size(n)
+        if batch_size != n:
+            images = np.concatenate([images, np.zeros((batch_size - n, *images.shape[1:]), dtype=np.float32)])
+        interpreter = self._interpreter(batch_size)
+        interpreter.set_tensor(self._input, images)
+        interpreter.invoke()
+        return interpreter.get_tensor(self._output)[:n].copy()
+
+
+def _load_runtime():
+    if RUNTIME == 'keras':
+        # TensorFlow is imported here rather than at module level, it alone takes seconds and hundreds of MB
+        from keras.models import load_model
+        loaded_model = load_model(MODEL_PATH)
+        input_shape = loaded_model.input_shape
+        with open(CLASS_NAMES_PATH, 'rb') as f:
+            loaded_class_names = pickle.load(f)
+    elif RUNTIME == 'tflite':
+        loaded_model = TFLiteModel(TFLITE_PATH, TFLITE_THREADS)
+        input_shape = loaded_model.input_shape
+        with open(f'{TFLITE_PATH}.json') as f:
+            loaded_class_names = json.load(f)['classNames']
+    elif RUNTIME == 'numpy':
+        loaded_model = NumpyModel(NUMPY_PATH)
+        input_shape = loaded_model.input_shape
+        loaded_class_names = loaded_model.class_names
+    else:
+        raise ValueError(f'Unknown classifier runtime {RUNTIME}, expected keras, tflite or numpy')
+    # images are decoded to IMAGE_SIZE, a model trained at another size would classify them wrongly rather than fail
+    if tuple(input_shape[1:3]) != IMAGE_SIZE:
+        raise ValueError(f'Model input {tuple(input_shape[1:3])} does not match IMAGE_SIZE {IMAGE_SIZE}')
+    return loaded_model, loaded_class_names
+
+
+def _model_version():
+    paths = {
+        'keras': [MODEL_PATH, CLASS_NAMES_PATH],
+        'tflite': [TFLITE_PATH, f'{TFLITE_PATH}.json'],
+        'numpy': [os.path.join(NUMPY_PATH, 'model.json')]
+    }[RUNTIME]
+    files = [(os.stat(path).st_size, os.stat(path).st_mtime_ns) for path in paths]
+    return f'{RUNTIME}:{hashlib.sha1(repr(files).encode()).hexdigest()[:12]}'
+
+
+# load the model and class names once, then run warmup inferences so the first request doesn't pay for graph setup
+def load(warmup: bool = True):
+    global model, class_names, model_version
+    if model is not None:
+        return
+    with _load_lock:
+        if model is not None:
+            return
+        _load_state['loading'] = True
+        try:
+            start = time.perf_counter()
+            loaded_model, loaded_class_names = _load_runtime()
+            _load_state['loadSeconds'] = round(time.perf_counter() - start, 3)
+
+            if warmup:
+                start = time.perf_counter()
+                # every padded batch size a micro-batch can have
+                for batch_size in sorted({padded_batch_size(n) for n in range(1, MAX_BATCH_SIZE + 1)}):
+                    loaded_model.predict_on_batch(np.zeros((batch_size, *IMAGE_SIZE, 3), dtype=np.float32))
+                _load_state['warmupSeconds'] = round(time.perf_counter() - start, 3)
+
+            model_version = _model_version()
+            class_names = loaded_class_names
+            model = loaded_model
+            _load_state['error'] = None
+        except Exception as e:
+            _load_state['error'] = str(e)
+            raise
+        finally:
+            _load_state['loading'] = False
+
+
+def _load_in_background():
+    try:
+        load()
+    except Exception as e:
+        print(e)
+
+
+# start loading the model as LOAD_MODE asks, called when the server starts
+def start():
+    if LOAD_MODE == 'eager':
+        load()
+    elif LOAD_MODE == 'background':
+        threading.Thread(target=_load_in_background, name='classifier-load', daemon=True).start()
+
+
+def is_ready():
+    return model is not None
+
+
+def is_loading():
+    return _load_state['loading']
+
+
+def status():
+    return {
+        'ready': is_ready(),
+        'loadMode': LOAD_MODE,
+        'modelVersion': model_version,
+        **_load_state
+    }
+
+
+# decode an uploaded image in memory, the same way keras' load_img(path, target_size=IMAGE_SIZE) reads it from disk
+def load_image(image):
+    if not isinstance(image, (bytes, bytearray)):
+        image = image.read()
+    try:
+        with Image.open(io.BytesIO(image)) as img:
+            if img.mode != 'RGB':
+                img = img.convert('RGB')
+            if img.size != (IMAGE_SIZE[1], IMAGE_SIZE[0]):
+                img = img.resize((IMAGE_SIZE[1], IMAGE_SIZE[0]), Image.NEAREST)
+            return np.asarray(img, dtype=np.float32)
+    except (OSError, Image.DecompressionBombError) as e:
+        raise ValueError(f'Unable to decode image: {e}')
+
+
+# perceptual (difference) hash: a bit per horizontally adjacent pixel pair of the grayscale image shrunk to 9x8, set
+# where brightness increases to the right
+def perceptual_hash(arr):
+    with Image.fromarray(arr.astype(np.uint8)) as img:
+        pixels = np.asarray(img.convert('L').resize((9, 8), Image.BOX), dtype=np.int16)
+    return np.packbits(pixels[:, 1:] > pixels[:, :-1]).tobytes().hex()
+
+
+# prediction cache key of a decoded image, loading the model first so the key names its version
+def cache_key(arr):
+    load()
+    if PREDICTION_CACHE_PHASH:
+        return model_version, f'p:{perceptual_hash(arr)}'
+    return model_version, hashlib.blake2b(arr.tobytes(), digest_size=16).hexdigest()
+
+
+# class probabilities of decoded images, run through the model in one call. predict_on_batch skips the per-call setup
+# of model.predict. the model is loaded here if it hasn't been yet (or waited for, if it is loading in the background)
+def predict_probabilities(input_arrs):
+    load()
+    return list(np.asarray(model.predict_on_batch(np.stack(input_arrs))))
+
+
+# the k most probable (class name, probability) pairs of a model output, most probable first
+def top_k(probs, k: int):
+    pred_inds = np.argsort(-probs, kind='stable')[:k]
+    return [(class_names[pred_ind], float(probs[pred_ind])) for pred_ind in pred_inds]
+
+
+# concurrent requests' images are queued and run through the model together
+batcher = MicroBatcher(predict_probabilities, MAX_BATCH_SIZE, MAX_BATCH_WAIT_MS / 1000, QUEUE_LIMIT,
+                       name='classifier')
+
+
+# the k most probable medication classes of an image decoded by load_image, with their probabilities. raises
+# batching.BatchQueueFullError when too many images are waiting
+def predict_top_k(arr, k: int):
+    return top_k(batcher.submit(arr), k)
+
+
+# predict medication using trained image model, image is the uploaded bytes or a binary stream.
+# decoding runs on the calling thread, raises batching.BatchQueueFullError when too many images are waiting
+def predict(image):
+    return predict_top_k(load_image(image), 1)[0]
@@ -0,0 +1,202 @@
+# numpyengine.py
+# Runs the pill classifier's Sequential CNN with NumPy alone, so serving it doesn't import TensorFlow
+#
+# A model is saved as a directory of one .npy file per weight tensor plus model.json, which lists the layers in order
+# with their settings, the input shape and the class names. Weights are opened memory-mapped, so loading takes
+# milliseconds and API worker processes on one host share the weights' pages instead of holding a copy each.
+#
+# Supported layers are the ones model/train.py builds: Rescaling, Conv2D, MaxPooling2D, Flatten and Dense with relu,
+# softmax or linear activations (Dropout and InputLayer are skipped). Convolutions are im2col followed by one matrix
+# multiply, which runs in NumPy's multithreaded BLAS.
+#
+# Usage (from api), saving a trained Keras model (needs TensorFlow, the engine itself doesn't):
+#   python numpyengine.py [-model ../model/model.keras] [-classnames ../model/class_names.pickle] [-out ../model/model_numpy]
+
+import argparse
+import json
+import os
+import pickle
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+# im2col matrices are built for as many images at a time as fit in this many bytes
+IM2COL_BYTES = 64 * 2 ** 20
+
+
+def relu(x):
+    return np.maximum(x, 0, out=x)
+
+
+def softmax(x):
+    x = np.exp(x - x.max(axis=-1, keepdims=True))
+    return x / x.sum(axis=-1, keepdims=True)
+
+
+ACTIVATIONS = {
+    'linear': lambda x: x,
+    'relu': relu,
+    'softmax': softmax
+}
+
+
+# pad images for 'same' padding the way Keras does, with any odd row or column at the bottom or right
+def pad_same(x, kernel_size: tuple, strides: tuple, value: float = 0.0):
+    pads = []
+    for size, kernel, stride in zip(x.shape[1:3], kernel_size, strides):
+        total = max(kernel - (size % stride or stride), 0)
+        pads.append((total // 2, total - total // 2))
+    return np.pad(x, ((0, 0), *pads, (0, 0)), constant_values=value)
+
+
+def conv2d(x, kernel, bias, strides: tuple, padding: str):
+    """
+    2D convolution of NHWC images with a Keras (height, width, in, out) kernel
+
+    :param x: images, (batch, height, width, channels)
+    :param kernel: kernel, (kernel height, kernel width, in channels, out channels)
+    :param bias: bias, (out channels,) or None
+    :param strides: (vertical, horizontal) strides
+    :param padding: 'valid' or 'same'
+    :return: feature maps, (batch, out height, out width, out channels)
+    """
+    kh, kw, cin, cout = kernel.shape
+    if padding == 'same':
+        x = pad_same(x, (kh, kw), strides)
+    # windows are (batch, out height, out width, channels, kh, kw) views of x, reordered to match the kernel's layout
+    windows = sliding_window_view(x, (kh, kw), axis=(1, 2))[:, ::strides[0], ::strides[1]]
+    windows = windows.transpose(0, 1, 2, 4, 5, 3)
+    n, oh, ow = windows.shape[:3]
+    # reshaping the kernel is a view, so a memory-mapped kernel isn't copied
+    weights = kernel.reshape(kh * kw * cin, cout)
+    out = np.empty((n, oh, ow, cout), dtype=np.float32)
+    chunk = max(1, IM2COL_BYTES // (oh * ow * kh * kw * cin * 4))
+    for i in range(0, n, chunk):
+        cols = windows[i:i + chunk].reshape(-1, kh * kw * cin)
+        out[i:i + chunk] = (cols @ weights).reshape(-1, oh, ow, cout)
+    if bias is not None:
+        out += bias
+    return out
+
+
+def max_pool2d(x, pool_size: tuple, strides: tuple, padding: str):
+    """
+    2D max pooling of NHWC images
+
+    :param x: images, (batch, height, width, channels)
+    :param pool_size: (height, width) of the pooling window
+    :param strides: (vertical, horizontal) strides
+    :param padding: 'valid' or 'same'
+    :return: pooled images
+    """
+    ph, pw = pool_size
+    if padding == 'same':
+        x = pad_same(x, pool_size, strides, -np.inf)
+    if tuple(strides) == tuple(pool_size):
+        # non-overlapping windows: drop the remainder rows and columns and reduce over a reshape
+        n, h, w, c = x.shape
+        oh, ow = h // ph, w // pw
+        return x[:, :oh * ph, :ow * pw].reshape(n, oh, ph, ow, pw, c).max(axis=(2, 4))
+    windows = sliding_window_view(x, pool_size, axis=(1, 2))[:, ::strides[0], ::strides[1]]
+    return windows.max(axis=(4, 5))
+
+
+class NumpyModel:
+    """
+    Sequential CNN saved with save(), with Keras' predict_on_batch
+
+    Attributes:
+        layers: list of (type, config, weights) in order
+        input_shape: Keras-style (None, height, width, channels)
+        class_names: class names in output order
+    """
+
+    def __init__(self, path: str):
+        with open(os.path.join(path, 'model.json')) as f:
+            spec = json.load(f)
+        self.input_shape = (None, *spec['inputShape'])
+        self.class_names = spec['classNames']
+        self.layers = [
+            (layer['type'], layer,
+             [np.load(os.path.join(path, file), mmap_mode='r') for file in layer.get('weights', [])])
+            for layer in spec['layers']
+        ]
+
+    def predict_on_batch(self, images):
+        x = np.asarray(images, dtype=np.float32)
+        for layer_type, config, weights in self.layers:
+            if layer_type == 'Rescaling':
+                x = x * np.float32(config['scale']) + np.float32(config['offset'])
+            elif layer_type == 'Conv2D':
+                x = conv2d(x, weights[0], weights[1] if config['useBias'] else None, config['strides'],
+                           config['padding'])
+                x = ACTIVATIONS[config['activation']](x)
+            elif layer_type == 'MaxPooling2D':
+                x = max_pool2d(x, config['poolSize'], config['strides'], config['padding'])
+            elif layer_type == 'Flatten':
+                x = x.reshape(len(x), -1)
+            elif layer_type == 'Dense':
+                x = x @ weights[0]
+                if config['useBias']:
+                    x += weights[1]
+                x = ACTIVATIONS[config['activation']](x)
+        # products with memory-mapped weights are np.memmap instances, return a plain array
+        return np.asarray(x)
+
+
+def save(model, path: str, class_names: list):
+    """
+    Save a Keras Sequential model for NumpyModel
+
+    :param model: Keras model
+    :param path: directory to write, created if missing
+    :param class_names: class names in output order
+    """
+    os.makedirs(path, exist_ok=True)
+    layers = []
+    for i, layer in enumerate(model.layers):
+        layer_type, config = type(layer).__name__, layer.get_config()
+        if layer_type in ('InputLayer', 'Dropout'):
+            continue
+        if layer_type == 'Rescaling':
+            spec = {'scale': float(config['scale']), 'offset': float(config['offset'])}
+        elif layer_type == 'Conv2D':
+            if tuple(config['dilation_rate']) != (1, 1) or config.get('groups', 1) != 1:
+                raise ValueError(f'{layer.name}: dilated and grouped convolutions are not supported')
+            spec = {'strides': list(config['strides']), 'padding': config['padding'],
+                    'activation': config['activation'], 'useBias': config['use_bias']}
+        elif layer_type == 'MaxPooling2D':
+            spec = {'poolSize': list(config['pool_size']), 'strides': list(config['strides']),
+                    'padding': config['padding']}
+        elif layer_type == 'Flatten':
+            spec = {}
+        elif layer_type == 'Dense':
+            spec = {'activation': config['activation'], 'useBias': config['use_bias']}
+        else:
+            raise ValueError(f'{layer.name}: {layer_type} layers are not supported')
+        if spec.get('activation', 'linear') not in ACTIVATIONS:
+            raise ValueError(f'{layer.name}: {spec["activation"]} activation is not supported')
+        if config.get('data_format', 'channels_last') != 'channels_last':
+            raise ValueError(f'{layer.name}: only channels_last data is supported')
+        spec['type'] = layer_type
+        spec['weights'] = []
+        for j, weight in enumerate(layer.get_weights()):
+            file = f'{i:02d}_{layer.name}_{j}.npy'
+            np.save(os.path.join(path, file), np.ascontiguousarray(weight, dtype=np.float32))
+            spec['weights'].append(file)
+        layers.append(spec)
+    with open(os.path.join(path, 'model.json'), 'w') as f:
+        json.dump({'inputShape': list(model.input_shape[1:]), 'classNames': list(class_names), 'layers': layers}, f,
+                  indent=2)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-model', default='../model/model.keras')
+    parser.add_argument('-classnames', default='../model/class_names.pickle')
+    parser.add_argument('-out', default='../model/model_numpy')
+    args = parser.parse_args()
+
+    from keras.models import load_model
+    with open(args.classnames, 'rb') as f:
+        save(load_model(args.model), args.out, pickle.load(f))
+    print(f'Wrote {args.out}')
@@ -0,0 +1,227 @@
+# prices.py
+# Price store: per-source medication prices loaded from JSON feeds, with the best price materialized on Medications
+#
+# Feeds are JSON arrays of {"name": ..., "price": "$1,234.56"} items. They are parsed item by item, so a feed never
+# has to fit in memory as a document, and only prices that differ from the stored ones are written. After a refresh
+# the best price of every affected medication name is written to Medications.price/priceSource, where search reads it
+# without touching the price store. The updated medications are passed to the medication listeners, so in-memory indexes
+# of the refreshing process see the new prices without a rebuild (other processes pick them up on their next rebuild).
+
+import argparse
+import json
+import re
+import time
+import db
+
+# price feeds in order of preference when prices are equal
+PRICE_FEEDS = [
+    ('Amazon', './static/price_data/amazondrugprice.json'),
+    ('Costco', './static/price_data/costcoprice.json')
+]
+PRICE_SOURCES = [source for source, _ in PRICE_FEEDS]
+
+WHITESPACE_RE = re.compile(r'[ \t\r\n]*')
+# whitespace and the comma between array items
+SEPARATOR_RE = re.compile(r'[ \t\r\n,]*')
+
+
+def price_name(name: str):
+    """
+    Normalize a medication name to the key prices are stored and joined under
+
+    :param name: feed item or medication name, e.g. 'Requip (Tablets, Brand for Ropinirole)'
+    :return: lowercase name without the parenthesized form, e.g. 'requip'
+    """
+    return str(name).split('(')[0].strip().lower()[:255]
+
+
+def parse_price(price):
+    """
+    Parse a feed price
+
+    :param price: price string such as '$1,312.40 ', or a number
+    :return: price rounded to cents, None if it can't be parsed
+    """
+    try:
+        if isinstance(price, str):
+            price = price.replace(',', '').replace('$', '').strip()
+        return round(float(price), 2)
+    except (TypeError, ValueError):
+        return None
+
+
+def iter_feed(path: str, chunk_size: int = 1 << 16):
+    """
+    Iterate over the items of a JSON array file, reading it chunk_size characters at a time
+
+    :param path: path to JSON file holding one array
+    :param chunk_size: characters read per chunk
+    :return: generator of decoded array items
+    """
+    decoder = json.JSONDecoder()
+    with open(path, encoding='utf-8') as f:
+        buf = f.read(chunk_size)
+        eof = not buf
+        pos = 0
+
+        def skip(pattern: re.Pattern):
+            nonlocal buf, pos, eof
+            while True:
+                pos = pattern.match(buf, pos).end()
+                if pos < len(buf) or eof:
+                    return
+                buf, pos = f.read(chunk_size), 0
+                eof = not buf
+
+        skip(WHITESPACE_RE)
+        if buf[pos:pos + 1] != '[':
+            raise ValueError(f'{path} is not a JSON array')
+        pos += 1
+        while True:
+            skip(SEPARATOR_RE)
+            if eof:
+                raise ValueError(f'{path} ends before the closing bracket')
+            if buf[pos] == ']':
+                return
+            try:
+                item, end = decoder.raw_decode(buf, pos)
+                error = None
+            except json.JSONDecodeError as e:
+                item, end, error = None, None, e
+            # an item touching the end of the buffer may be cut short (e.g. a number), so read on before trusting it
+            if end is None or (end == len(buf) and not eof):
+                more = f.read(chunk_size)
+                if not more:
+                    if error is not None:
+                        raise error
+                    eof = True
+                    continue
+                buf, pos = buf[pos:] + more, 0
+                continue
+            yield item
+            pos = end
+            if pos > chunk_size:
+                buf, pos = buf[pos:], 0
+
+
+def read_feed(path: str):
+    """
+    Read the prices of a feed, the last listing of a name winning
+
+    :param path: path to JSON feed
+    :return: dict of price name -> price, number of items without a usable name or price
+    """
+    feed = {}
+    skipped = 0
+    for item in iter_feed(path):
+        name = price_name(item.get('name', '')) if isinstance(item, dict) else ''
+        price = parse_price(item.get('price')) if name else None
+        if price is None:
+            skipped += 1
+            continue
+        feed[name] = price
+    return feed, skipped
+
+
+def best_prices(rows):
+    """
+    Pick the best (lowest) price of every name, preferring sources listed first in PRICE_SOURCES on ties
+
+    :param rows: price store rows with priceName, source and price
+    :return: dict of price name -> (price, source)
+    """
+    rank = {source: i for i, source in enumerate(PRICE_SOURCES)}
+    best = {}
+    for row in rows:
+        key = (float(row['price']), rank.get(row['source'], len(rank)))
+        current = best.get(row['priceName'])
+        if current is None or key < current[0]:
+            best[row['priceName']] = (key, row['source'])
+    return {name: (key[0], source) for name, (key, source) in best.items()}
+
+
+def materialize_best_prices(names: list, batch_size: int = 1000):
+    """
+    Write the best stored price of each name to the medications with that name, clearing names without prices
+
+    :param names: price names whose stored prices changed
+    :param batch_size: names per query
+    :return: number of names written, err
+    """
+    names = list(dict.fromkeys(names))
+    for i in range(0, len(names), batch_size):
+        batch = names[i:i + batch_size]
+        rows, err = db.read_prices_by_name(batch)
+        if err is not None:
+            return i, err
+        best = best_prices(rows)
+        updates = [(*best.get(name, (None, None)), name) for name in batch]
+        _, err = db.update_medication_prices(updates)
+        if err is not None:
+            return i, err
+    return len(names), None
+
+
+def refresh_feed(source: str, path: str, batch_size: int = 1000, prune: bool = False):
+    """
+    Load a price feed into the price store, writing only new and changed prices, then materialize best prices
+
+    :param source: price source name
+    :param path: path to JSON feed
+    :param batch_size: rows per statement
+    :param prune: delete stored prices of this source that are missing from the feed
+    :return: dict of prices/changed/removed/skipped counts, err
+    """
+    rows, err = db.read_prices(source)
+    if err is not None:
+        return None, err
+    stored = {row['priceName']: float(row['price']) for row in rows}
+
+    feed, skipped = read_feed(path)
+    counts = {'prices': len(feed), 'changed': 0, 'removed': 0, 'skipped': skipped}
+    changed = [(name, price) for name, price in feed.items() if stored.get(name) != price]
+    removed = [name for name in stored if name not in feed] if prune else []
+    _, err = db.upsert_prices(source, changed, batch_size)
+    if err is None:
+        _, err = db.delete_prices(source, removed, batch_size)
+    if err is not None:
+        return counts, err
+    counts['changed'], counts['removed'] = len(changed), len(removed)
+
+    _, err = materialize_best_prices([name for name, _ in changed] + removed, batch_size)
+    return counts, err
+
+
+def refresh_feeds(feeds: list = PRICE_FEEDS, batch_size: int = 1000, prune: bool = False):
+    """
+    Refresh every price feed
+
+    :param feeds: list of (source name, JSON feed path)
+    :param batch_size: rows per statement
+    :param prune: delete stored prices missing from their feed
+    :return: dict of source -> counts, err
+    """
+    results = {}
+    for source, path in feeds:
+        counts, err = refresh_feed(source, path, batch_size, prune)
+        if err is not None:
+            return results, err
+        results[source] = counts
+    return results, None
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-source', type=str, help='refresh only this source, from -path')
+    parser.add_argument('-path', type=str)
+    parser.add_argument('-batchsize', type=int, default=1000)
+    parser.add_argument('-prune', action='store_true', help='delete stored prices missing from the feed')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    feeds = [(args.source, args.path or dict(PRICE_FEEDS).get(args.source))] if args.source else PRICE_FEEDS
+    result, err = refresh_feeds(feeds, args.batchsize, args.prune)
+    if err is not None:
+        print(err['err'])
+    else:
+        print(f'Refreshed prices in {time.perf_counter() - start:.1f}s: {result}')
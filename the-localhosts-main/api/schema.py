@@ -1,8 +1,8 @@
 # schema.py
 # Pydantic models for request and response validation
 
-from pydantic import BaseModel
-from typing import Optional
+from pydantic import BaseModel, constr
+from typing import Optional, Literal
 
 
 class Medication(BaseModel):
@@ -152,8 +152,51 @@ class SearchMedicationsReq(BaseModel):
 
     Request:
         query: query string
+        [sort]: 'relevance' or 'price'
+        [minPrice]: lowest medication price
+        [maxPrice]: highest medication price
     """
     query: str
+    sort: Optional[Literal['relevance', 'price']] = 'relevance'
+    minPrice: Optional[float] = None
+    maxPrice: Optional[float] = None
+
+
+class SuggestMedicationsReq(BaseModel):
+    """
+    Req schema /api/v1/medications/suggest {GET}
+
+    Request:
+        prefix: beginning of a medication name
+        [limit]: maximum number of suggestions
+    """
+    prefix: str
+    limit: Optional[int] = 10
+
+
+class MedicationsByIngredientReq(BaseModel):
+    """
+    Req schema /api/v1/medications/by-ingredient {GET}
+
+    Request:
+        name: ingredient name or beginning of one, not blank
+        [activeOnly]: only match active ingredients
+        [limit]: maximum number of medications
+    """
+    # a blank name would be an empty prefix matching every ingredient
+    name: constr(strip_whitespace=True, min_length=1)
+    activeOnly: Optional[bool] = False
+    limit: Optional[int] = 50
+
+
+class SimilarMedicationsReq(BaseModel):
+    """
+    Req schema /api/v1/medications/<med_id>/similar {GET}
+
+    Request:
+        [limit]: maximum number of medications
+    """
+    limit: Optional[int] = 20
 
 
 class ClassifyMedicationByImageReq(BaseModel):
@@ -161,9 +204,11 @@ class ClassifyMedicationByImageReq(BaseModel):
     Req schema /api/v1/medications/classify-by-image {POST}
 
     Request:
-        img: binary image data
+        img: binary image data (sent as a file)
+        [topK]: number of most probable classes to return with their medications
     """
-    img: str
+    img: Optional[str]
+    topK: Optional[int]
 
 
 class ClassifyMedicationByDescriptionReq(BaseModel):
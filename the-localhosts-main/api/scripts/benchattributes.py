@@ -0,0 +1,70 @@
+# benchattributes.py
+# Benchmarks classify-by-description attribute search: LIKE scan over TEXT columns vs indexed attribute codes
+#
+# Usage (from api/scripts, after running dbupdatemedattrs.py):
+#   python benchattributes.py [-queries 200]
+#
+# Queries are sampled from the shape, size and color of existing medications.
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import db
+
+LEGACY_SQL = '''
+            SELECT * FROM Medications
+            WHERE
+                `shape` LIKE CONCAT('%%', %s, '%%')
+                AND `size` LIKE CONCAT('%%', %s, '%%')
+                AND `color` LIKE CONCAT('%%', %s, '%%')
+                LIMIT 50
+            '''
+
+
+def legacy_search(shape: str, size: int, color: str):
+    with db.pool.connection() as conn, conn.cursor() as curs:
+        curs.execute(LEGACY_SQL, (shape.upper(), size, color.upper()))
+        conn.commit()
+        return curs.fetchall()
+
+
+def coded_search(shape: str, size: int, color: str):
+    res, err = db.search_medication_by_attributes(shape, size, None, None, color, None)
+    if err is not None:
+        raise RuntimeError(err)
+    return res
+
+
+def timed(label: str, fn, queries: list):
+    latencies = []
+    for q in queries:
+        start = time.perf_counter()
+        fn(*q)
+        latencies.append(time.perf_counter() - start)
+    latencies.sort()
+    p50 = latencies[len(latencies) // 2] * 1000
+    p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000
+    print(f'{label:<7} p50={p50:8.2f}ms  p99={p99:8.2f}ms  mean={sum(latencies) / len(latencies) * 1000:8.2f}ms')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-queries', type=int, default=200)
+    args = parser.parse_args()
+
+    rows, err = db.read_all_medications()
+    if err is not None:
+        raise RuntimeError(err)
+    rows = [r for r in rows if r['shape'] and r['color'] and r['size'] is not None and r['size'] > 0]
+    print(f'{len(rows)} medications with shape, size and color')
+
+    rng = random.Random(0)
+    queries = [(r['shape'], r['size'], r['color'].split(';')[0]) for r in (rng.choice(rows) for _ in range(args.queries))]
+
+    timed('legacy', legacy_search, queries)
+    timed('coded', coded_search, queries)
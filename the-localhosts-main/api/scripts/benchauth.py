@@ -0,0 +1,67 @@
+# benchauth.py
+# Benchmarks requests/sec for GET /api/v1/users/<user_id> with database-backed and signed session tokens
+#
+# Usage (from api/scripts):
+#   python benchauth.py [-threads 8] [-requests 2000]
+#
+# Modes:
+#   db-nocache: uuid token, every request reads the Sessions table
+#   db:         uuid token, validated through the in-process session cache
+#   signed:     HMAC-signed token, verified in memory
+
+import argparse
+import os
+import sys
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+os.chdir(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import apis
+import db
+import tokens
+
+
+def run(label: str, user_id: int, token: str, threads: int, n_requests: int):
+    def worker(n: int):
+        client = apis.app.test_client()
+        for _ in range(n):
+            res = client.get(f'/api/v1/users/{user_id}', headers={'Authorization': token})
+            if res.status_code != 200:
+                raise RuntimeError(res.data)
+
+    per_thread = n_requests // threads
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as ex:
+        list(ex.map(worker, [per_thread] * threads))
+    elapsed = time.perf_counter() - start
+    print(f'{label:<11} threads={threads:<3} {per_thread * threads / elapsed:8.1f} req/s')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-threads', type=int, default=8)
+    parser.add_argument('-requests', type=int, default=2000)
+    args = parser.parse_args()
+
+    email = f'bench-{uuid.uuid4()}@email.com'
+    user_id, err = db.create_user('Bench', 'User', email, b'x' * 32, b'x' * 16)
+    if err is not None:
+        raise RuntimeError(err)
+
+    try:
+        tokens.TOKEN_MODE = 'db'
+        db_token = apis.generate_session_token(user_id)
+        cache_size = db.session_cache.max_size
+        db.session_cache.max_size = 0
+        run('db-nocache', user_id, db_token, args.threads, args.requests)
+        db.session_cache.max_size = cache_size
+        run('db', user_id, db_token, args.threads, args.requests)
+
+        tokens.TOKEN_MODE = 'signed'
+        signed_token = apis.generate_session_token(user_id)
+        run('signed', user_id, signed_token, args.threads, args.requests)
+    finally:
+        db.delete_user(user_id)
@@ -0,0 +1,60 @@
+# benchbatching.py
+# Benchmarks classifier throughput and latency with and without micro-batching at several concurrency levels
+#
+# Usage (from api/scripts):
+#   python benchbatching.py [-requests 400] [-concurrency 1,4,16,32] [-batchsize 16] [-waitms 5]
+#
+# Sample images from static/img are decoded once up front, so only queueing and inference are timed. Unbatched runs
+# use a batch size of 1 and no wait, i.e. one model call per request.
+
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+os.chdir(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import newclassifier
+from batching import MicroBatcher
+
+
+def run(label: str, batcher: MicroBatcher, inputs: list, concurrency: int):
+    def request(input_arr):
+        start = time.perf_counter()
+        batcher.submit(input_arr)
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        latencies = sorted(pool.map(request, inputs))
+    elapsed = time.perf_counter() - start
+    p50 = latencies[len(latencies) // 2] * 1000
+    p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000
+    stats = batcher.stats()
+    print(f'{label:<10} c={concurrency:<3} {len(inputs) / elapsed:8.1f} img/s  p50={p50:8.2f}ms  p99={p99:8.2f}ms  '
+          f'avg batch={stats["avgBatchSize"]:5.2f}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-requests', type=int, default=400)
+    parser.add_argument('-concurrency', type=str, default='1,4,16,32')
+    parser.add_argument('-batchsize', type=int, default=newclassifier.MAX_BATCH_SIZE)
+    parser.add_argument('-waitms', type=float, default=newclassifier.MAX_BATCH_WAIT_MS)
+    args = parser.parse_args()
+
+    images = []
+    for file in sorted(os.listdir('./static/img')):
+        with open(os.path.join('./static/img', file), 'rb') as f:
+            images.append(newclassifier.load_image(f.read()))
+    inputs = [images[i % len(images)] for i in range(args.requests)]
+
+    # warm the model up so the first measured call doesn't pay graph setup
+    newclassifier.predict_probabilities(images[:args.batchsize])
+    for concurrency in (int(c) for c in args.concurrency.split(',')):
+        queue_limit = max(concurrency, 1)
+        run('unbatched', MicroBatcher(newclassifier.predict_probabilities, 1, 0, queue_limit), inputs, concurrency)
+        run('batched', MicroBatcher(newclassifier.predict_probabilities, args.batchsize, args.waitms / 1000,
+                                    queue_limit), inputs, concurrency)
@@ -0,0 +1,76 @@
+# benchclassify.py
+# Benchmarks classify-by-image input handling: upload saved to temp/ and read back with load_img vs in-memory decode
+#
+# Usage (from api/scripts):
+#   python benchclassify.py [-requests 200] [-threads 1] [-predict]
+#
+# Uploads are the sample images in static/img. Without -predict only the save/decode/resize stage is timed, which is
+# the part the two paths differ in; with -predict each request also runs the model.
+
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+os.chdir(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import numpy as np
+from keras.utils import load_img, img_to_array
+import newclassifier
+
+
+def legacy_input(data: bytes, temp_dir: str):
+    # each thread writes its own file, the old endpoint used the upload's filename and could clobber other requests
+    path = os.path.join(temp_dir, f'{threading.get_ident()}.jpg')
+    with open(path, 'wb') as f:
+        f.write(data)
+    arr = img_to_array(load_img(path, target_size=newclassifier.IMAGE_SIZE))
+    os.remove(path)
+    return arr
+
+
+def in_memory_input(data: bytes, temp_dir: str):
+    return newclassifier.load_image(data)
+
+
+def timed(label: str, fn, uploads: list, threads: int, predict: bool, temp_dir: str):
+    def request(data: bytes):
+        start = time.perf_counter()
+        arr = fn(data, temp_dir)
+        if predict:
+            newclassifier.model.predict_on_batch(np.array([arr]))
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        latencies = sorted(pool.map(request, uploads))
+    elapsed = time.perf_counter() - start
+    p50 = latencies[len(latencies) // 2] * 1000
+    p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000
+    print(f'{label:<10} p50={p50:8.2f}ms  p99={p99:8.2f}ms  {len(uploads) / elapsed:7.1f} req/s')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-requests', type=int, default=200)
+    parser.add_argument('-threads', type=int, default=1)
+    parser.add_argument('-predict', action='store_true', help='include model inference in every request')
+    args = parser.parse_args()
+
+    if args.predict:
+        newclassifier.load()
+
+    images = []
+    for file in sorted(os.listdir('./static/img')):
+        with open(os.path.join('./static/img', file), 'rb') as f:
+            images.append(f.read())
+    uploads = [images[i % len(images)] for i in range(args.requests)]
+    print(f'{args.requests} uploads from {len(images)} sample images, {args.threads} threads')
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        timed('temp file', legacy_input, uploads, args.threads, args.predict, temp_dir)
+        timed('in-memory', in_memory_input, uploads, args.threads, args.predict, temp_dir)
@@ -0,0 +1,81 @@
+# benchdbpool.py
+# Benchmarks concurrent session + saved medication reads against the database connection pool
+#
+# Usage (from api/scripts):
+#   python benchdbpool.py [-threads 8] [-requests 2000]
+#
+# Runs the same workload twice:
+#   single: one connection pinged before every call, the behaviour of the old module-global connection
+#   pool:   one pooled connection per worker thread with idle validation
+
+import argparse
+import os
+import sys
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import db
+from dbpool import ConnectionPool
+
+
+def make_pool(size: int, idle_check: float):
+    return ConnectionPool(max_size=size,
+                          timeout=60,
+                          idle_check=idle_check,
+                          **db.pool._connect_kwargs)
+
+
+def request_once(token: str):
+    start = time.perf_counter()
+    user_id, err = db.read_session(token)
+    if err is not None:
+        raise RuntimeError(err)
+    _, err = db.read_user_medications(user_id)
+    if err is not None:
+        raise RuntimeError(err)
+    return time.perf_counter() - start
+
+
+def run(label: str, token: str, threads: int, n_requests: int):
+    with ThreadPoolExecutor(max_workers=threads) as ex:
+        start = time.perf_counter()
+        latencies = sorted(ex.map(lambda _: request_once(token), range(n_requests)))
+        elapsed = time.perf_counter() - start
+
+    p50 = latencies[int(len(latencies) * 0.50)] * 1000
+    p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000
+    print(f'{label:<8} threads={threads:<3} p50={p50:7.2f}ms  p99={p99:7.2f}ms  throughput={n_requests / elapsed:8.1f} req/s')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-threads', type=int, default=8)
+    parser.add_argument('-requests', type=int, default=2000)
+    args = parser.parse_args()
+
+    # set up a throwaway user with a session and a saved medication
+    email = f'bench-{uuid.uuid4()}@email.com'
+    user_id, err = db.create_user('Bench', 'User', email, b'x' * 32, b'x' * 16)
+    if err is not None:
+        raise RuntimeError(err)
+    token = str(uuid.uuid4())
+    db.create_session(user_id, token)
+    med_id, _ = db.create_medication('', 'Benchmark', '', 'ROUND', 10, 'B1', '', 'WHITE', None, None)
+    db.create_user_medication_map(user_id, med_id)
+
+    try:
+        # before: every call shares a single connection and pings it first
+        db.pool = make_pool(1, 0)
+        run('single', token, args.threads, args.requests)
+        db.pool.close_all()
+
+        # after: pooled connections, one per worker thread
+        db.pool = make_pool(args.threads, 30)
+        run('pool', token, args.threads, args.requests)
+    finally:
+        db.delete_user(user_id)
+        db.delete_medication(med_id)
+        db.pool.close_all()
@@ -0,0 +1,76 @@
+# benchimprint.py
+# Benchmarks fuzzy imprint lookups through the bigram imprint index against a scan of every stored imprint
+#
+# Usage (from api/scripts):
+#   python benchimprint.py [-rows 50000] [-queries 1000]
+#
+# Queries are stored imprints with one character substituted, dropped or misread (O/0, I/1, ...).
+
+import argparse
+import os
+import random
+import string
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from search import ImprintIndex, imprint_distance, normalize_imprint
+
+ALPHABET = string.ascii_uppercase + string.digits
+
+
+def synthetic_rows(n: int):
+    rng = random.Random(0)
+    for med_id in range(n):
+        yield {
+            'medId': med_id,
+            'imprintFront': ';'.join(''.join(rng.choice(ALPHABET) for _ in range(rng.randint(1, 4))) for _ in range(rng.randint(1, 2))),
+            'imprintBack': ''.join(rng.choice(string.digits) for _ in range(rng.randint(0, 3)))
+        }
+
+
+def garble(imprint: str, rng: random.Random):
+    i = rng.randrange(len(imprint))
+    edit = rng.choice(['substitute', 'drop', 'misread'])
+    if edit == 'substitute':
+        return imprint[:i] + rng.choice(ALPHABET) + imprint[i + 1:]
+    if edit == 'drop':
+        return imprint[:i] + imprint[i + 1:]
+    return imprint.replace('0', 'O').replace('1', 'I')
+
+
+def scan(rows: list, query: str):
+    query = normalize_imprint(query)
+    max_distance = (len(query) - 1) // 3
+    return [row['medId'] for row in rows if imprint_distance(query, normalize_imprint(row['imprintFront']), max_distance) <= max_distance]
+
+
+def timed(label: str, fn, queries: list):
+    latencies = []
+    for q in queries:
+        start = time.perf_counter()
+        fn(q)
+        latencies.append(time.perf_counter() - start)
+    latencies.sort()
+    p50 = latencies[len(latencies) // 2] * 1000
+    p99 = latencies[int(len(latencies) * 0.99)] * 1000
+    print(f'{label:<6} p50={p50:8.2f}ms  p99={p99:8.2f}ms')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-rows', type=int, default=50000)
+    parser.add_argument('-queries', type=int, default=1000)
+    args = parser.parse_args()
+
+    rows = list(synthetic_rows(args.rows))
+    index = ImprintIndex(max_age=0)
+    start = time.perf_counter()
+    index.load(rows)
+    print(f'built index over {args.rows} rows in {time.perf_counter() - start:.2f}s')
+
+    rng = random.Random(1)
+    queries = [garble(rng.choice(rows)['imprintFront'], rng) for _ in range(args.queries)]
+    timed('index', lambda q: index.match('imprintFront', q), queries)
+    timed('scan', lambda q: scan(rows, q), queries[:args.queries // 10])
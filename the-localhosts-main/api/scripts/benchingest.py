@@ -0,0 +1,58 @@
+# benchingest.py
+# Benchmarks medication catalog ingest: one create_medication call per row vs batched create_medications
+#
+# Usage (from api/scripts):
+#   python benchingest.py [-rows 100000] [-legacy-rows 5000] [-batchsize 1000]
+#
+# Rows come from synthpillbox.py and are deleted again afterwards.
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import db
+from synthpillbox import synthetic_rows
+
+MARKER = 'benchingest'
+
+
+def medication_tuples(n: int):
+    return [(
+        row['rxstring'], row['medicine_name'], MARKER, row['splshape_text'], row['splsize'] or -1,
+        row['splimprint'].split(';')[0], row['splimprint'].split(';')[1] if ';' in row['splimprint'] else '',
+        row['splcolor_text'], None, None, None, None
+    ) for row in synthetic_rows(n)]
+
+
+def cleanup():
+    with db.pool.connection() as conn, conn.cursor() as curs:
+        curs.execute('DELETE FROM Medications WHERE `medDetails`=%s', (MARKER,))
+        conn.commit()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-rows', type=int, default=100000)
+    parser.add_argument('-legacy-rows', type=int, default=5000)
+    parser.add_argument('-batchsize', type=int, default=1000)
+    args = parser.parse_args()
+
+    try:
+        medications = medication_tuples(args.legacy_rows)
+        start = time.perf_counter()
+        for med in medications:
+            db.create_medication(*med[:10])
+        print(f'per-row: {args.legacy_rows / (time.perf_counter() - start):10.0f} rows/s')
+        cleanup()
+
+        medications = medication_tuples(args.rows)
+        start = time.perf_counter()
+        count, err = db.create_medications(medications, args.batchsize)
+        if err is not None:
+            raise RuntimeError(err)
+        print(f'batched: {count / (time.perf_counter() - start):10.0f} rows/s  (batch size {args.batchsize})')
+    finally:
+        cleanup()
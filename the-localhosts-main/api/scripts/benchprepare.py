@@ -0,0 +1,97 @@
+# benchprepare.py
+# Benchmarks getdbdata.py's preparation stage (price join, imprint split, size fill): row loop vs vectorized pandas
+#
+# Usage (from api/scripts):
+#   python benchprepare.py [-rows 1000000] [-legacy-rows 100000]
+#
+# Rows come from synthpillbox.py. The row loop is a copy of the preparation code getdbdata.py used before it was
+# vectorized, timed on a smaller slice since it is much slower.
+
+import argparse
+import json
+import os
+import sys
+import time
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+os.chdir(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from getdbdata import PILLBOX_COLUMNS, load_price_data, prepare_medications
+from prices import PRICE_FEEDS, read_feed
+from synthpillbox import synthetic_rows
+
+
+def legacy_prepare(df: pd.DataFrame):
+    price_data = {}
+    with open('./static/price_data/amazondrugprice.json') as f:
+        data = json.load(f)
+        for _, item in enumerate(data):
+            med_name = item['name'].split('(')[0].strip()
+            med_price = float(item['price'].replace(',', '').replace('$', '').strip())
+            price_data[med_name.lower()] = {
+                'source': 'Amazon',
+                'price': med_price
+            }
+    with open('./static/price_data/costcoprice.json') as f:
+        data = json.load(f)
+        for _, item in enumerate(data):
+            med_name = item['name'].split('(')[0].strip()
+            med_price = float(item['price'].replace(',', '').replace('$', '').strip())
+            if med_name not in price_data or price_data[med_name]['price'] > med_price:
+                price_data[med_name.lower()] = {
+                    'source': 'Costco',
+                    'price': med_price
+                }
+
+    df[['price', 'price_source']] = None
+    for i, row in df.iterrows():
+        med_name_l = row['medicine_name'].lower()
+        if med_name_l in price_data:
+            df.at[i, 'price'] = price_data[med_name_l]['price']
+            df.at[i, 'price_source'] = price_data[med_name_l]['source']
+
+    medications = []
+    for _, row in df.iterrows():
+        imprints = str(row['splimprint']).split(';')
+        medications.append((
+            row['rxstring'],
+            row['medicine_name'],
+            f'Active ingredients: {row["spl_ingredients"]}. Inactive ingredients: {row["spl_inactive_ing"]}.',
+            row['splshape_text'],
+            row['splsize'] if row['splsize'] != '' else -1,
+            imprints[0],
+            imprints[1] if len(imprints) == 2 else '',
+            row['splcolor_text'],
+            row['price'],
+            row['price_source']
+        ))
+    return medications
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-rows', type=int, default=1000000)
+    parser.add_argument('-legacy-rows', type=int, default=100000)
+    args = parser.parse_args()
+
+    df = pd.DataFrame(synthetic_rows(args.rows), columns=PILLBOX_COLUMNS).fillna('')
+
+    start = time.perf_counter()
+    legacy = legacy_prepare(df.head(args.legacy_rows).copy())
+    elapsed = time.perf_counter() - start
+    print(f'row loop:   {args.legacy_rows:>8} rows in {elapsed:6.2f}s ({args.legacy_rows / elapsed:10.0f} rows/s)')
+
+    # price store rows straight from the feeds, so no database is needed
+    price_rows = [{'priceName': name, 'source': source, 'price': price}
+                  for source, path in PRICE_FEEDS for name, price in read_feed(path)[0].items()]
+    price_data, _ = load_price_data(price_rows)
+
+    start = time.perf_counter()
+    vectorized = prepare_medications(df, price_data)
+    elapsed = time.perf_counter() - start
+    print(f'vectorized: {args.rows:>8} rows in {elapsed:6.2f}s ({args.rows / elapsed:10.0f} rows/s)')
+
+    # everything but the price columns must match (the row loop let Costco override cheaper Amazon prices)
+    mismatches = sum(a[:8] != b[:8] for a, b in zip(legacy, vectorized))
+    print(f'{mismatches} of {len(legacy)} rows differ outside the price columns')
@@ -0,0 +1,67 @@
+# benchprices.py
+# Benchmarks price feed parsing: json.load of the whole feed vs prices.py's incremental item parser
+#
+# Usage (from api/scripts):
+#   python benchprices.py [-items 1000000]
+#
+# A synthetic feed in the Amazon/Costco format is written to a temporary file. Peak memory is measured with
+# tracemalloc, so it counts Python allocations only.
+
+import argparse
+import json
+import os
+import random
+import string
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import prices
+
+
+def write_feed(path: str, n: int):
+    rng = random.Random(0)
+    with open(path, 'w') as f:
+        f.write('[\n')
+        for i in range(n):
+            name = ''.join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(6, 14))).title()
+            item = {'name': f'{name} (Tablets, Brand for {name}ine)', 'price': f'${rng.uniform(2, 2000):,.2f} '}
+            f.write(('' if i == 0 else ',\n') + json.dumps(item, indent=1))
+        f.write('\n]')
+
+
+def legacy_read(path: str):
+    with open(path) as f:
+        items = json.load(f)
+    return {prices.price_name(item['name']): prices.parse_price(item['price']) for item in items}
+
+
+def measure(label: str, fn, path: str):
+    tracemalloc.start()
+    start = time.perf_counter()
+    feed = fn(path)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f'{label:<12} {elapsed:6.2f}s  peak={peak / 2 ** 20:8.1f}MiB  names={len(feed)}')
+    return feed
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-items', type=int, default=1000000)
+    args = parser.parse_args()
+
+    fd, path = tempfile.mkstemp(suffix='.json')
+    os.close(fd)
+    try:
+        write_feed(path, args.items)
+        print(f'{args.items} items, {os.path.getsize(path) / 2 ** 20:.1f}MiB feed')
+        legacy = measure('json.load', legacy_read, path)
+        incremental = measure('incremental', lambda p: prices.read_feed(p)[0], path)
+        print(f'{sum(legacy[name] != incremental.get(name) for name in legacy)} names differ')
+    finally:
+        os.remove(path)
@@ -0,0 +1,61 @@
+# benchrank.py
+# Benchmarks ranked classify-by-description scoring on a synthetic medication catalog
+#
+# Usage (from api/scripts):
+#   python benchrank.py [-rows 1000000] [-queries 200]
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import attributes
+from search import AttributeIndex
+
+
+def synthetic_rows(n: int):
+    rng = random.Random(0)
+    for med_id in range(n):
+        yield {
+            'medId': med_id,
+            'shape': rng.choice(attributes.SHAPES),
+            'color': ';'.join(rng.sample(attributes.COLORS, rng.choice([1, 1, 1, 2]))),
+            'size': rng.choice([None] + list(range(3, 25)))
+        }
+
+
+def random_description(rng: random.Random):
+    return (
+        rng.choice([None, rng.choice(attributes.SHAPES).lower()]),
+        rng.choice([None, rng.randint(3, 24)]),
+        rng.choice([None, rng.choice(attributes.COLORS).lower()]),
+        rng.choice([None, None, rng.choice(attributes.COLORS).lower()]),
+        {rng.randrange(1000): rng.random() for _ in range(rng.choice([0, 20]))}
+    )
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-rows', type=int, default=1000000)
+    parser.add_argument('-queries', type=int, default=200)
+    args = parser.parse_args()
+
+    index = AttributeIndex(max_age=0)
+    start = time.perf_counter()
+    index.load(list(synthetic_rows(args.rows)))
+    print(f'built index over {args.rows} rows in {time.perf_counter() - start:.2f}s')
+
+    rng = random.Random(1)
+    latencies = []
+    for _ in range(args.queries):
+        description = random_description(rng)
+        start = time.perf_counter()
+        index.rank(*description)
+        latencies.append(time.perf_counter() - start)
+    latencies.sort()
+    p50 = latencies[len(latencies) // 2] * 1000
+    p99 = latencies[int(len(latencies) * 0.99)] * 1000
+    print(f'rank: p50={p50:8.2f}ms  p99={p99:8.2f}ms')
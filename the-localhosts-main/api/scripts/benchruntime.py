@@ -0,0 +1,81 @@
+# benchruntime.py
+# Compares the classifier runtimes (CLASSIFIER_RUNTIME): Keras serving model.keras, TFLite serving model/export.py's
+# export and the NumPy engine serving the model saved by numpyengine.py
+#
+# Usage (from api/scripts):
+#   python benchruntime.py [-runs 200] [-batchsize 16] [-runtimes keras,tflite,numpy]
+#
+# Every runtime runs in a fresh process so resident memory isn't shared between them. "load" is the time to load and
+# warm up the model, p50/p99 the latency of single-image inferences, "throughput" images per second through full
+# batches, and RSS the peak resident memory of the process. Predictions on the sample images in static/img are
+# compared with the first runtime's.
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+API_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+CHILD = '''
+import json, os, resource, sys, time
+import numpy as np
+import newclassifier
+runs, batch_size = int(sys.argv[1]), int(sys.argv[2])
+start = time.perf_counter()
+newclassifier.load()
+load = time.perf_counter() - start
+images = []
+for file in sorted(os.listdir('./static/img')):
+    with open('./static/img/' + file, 'rb') as f:
+        images.append(newclassifier.load_image(f.read()))
+latencies = []
+for i in range(runs):
+    start = time.perf_counter()
+    newclassifier.model.predict_on_batch(np.stack([images[i % len(images)]]))
+    latencies.append(time.perf_counter() - start)
+latencies.sort()
+batch = np.stack([images[i % len(images)] for i in range(batch_size)])
+batches = max(1, runs // batch_size)
+start = time.perf_counter()
+for _ in range(batches):
+    newclassifier.model.predict_on_batch(batch)
+throughput = batches * batch_size / (time.perf_counter() - start)
+print(json.dumps({
+    'load': load,
+    'p50': latencies[len(latencies) // 2],
+    'p99': latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))],
+    'throughput': throughput,
+    'rssMb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    'predictions': [list(newclassifier.predict_top_k(image, 1)[0]) for image in images]
+}))
+'''
+
+
+def measure(runtime: str, runs: int, batch_size: int):
+    env = dict(os.environ, CLASSIFIER_RUNTIME=runtime, CLASSIFIER_MAX_BATCH_SIZE=str(batch_size))
+    out = subprocess.run([sys.executable, '-c', CHILD, str(runs), str(batch_size)], cwd=API_DIR, env=env,
+                         capture_output=True, text=True, check=True).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-runs', type=int, default=200)
+    parser.add_argument('-batchsize', type=int, default=16)
+    parser.add_argument('-runtimes', default='keras,tflite,numpy')
+    args = parser.parse_args()
+
+    reference = None
+    for runtime in args.runtimes.split(','):
+        result = measure(runtime, args.runs, args.batchsize)
+        predictions = result['predictions']
+        if reference is None:
+            reference = predictions
+        agree = sum(p[0] == r[0] for p, r in zip(predictions, reference))
+        prob_diff = max(abs(p[1] - r[1]) for p, r in zip(predictions, reference))
+        print(f'{runtime:<8} load={result["load"]:6.2f}s  p50={result["p50"] * 1000:8.2f}ms  '
+              f'p99={result["p99"] * 1000:8.2f}ms  throughput={result["throughput"]:7.1f} img/s  '
+              f'RSS={result["rssMb"]:7.1f}MB  top-1 agreement={agree}/{len(predictions)} '
+              f'(max prob diff {prob_diff:.5f})')
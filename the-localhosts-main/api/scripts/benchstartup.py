@@ -0,0 +1,58 @@
+# benchstartup.py
+# Measures apis.py startup time and memory for each classifier load mode (CLASSIFIER_LOAD_MODE)
+#
+# Usage (from api/scripts):
+#   python benchstartup.py [-runs 3]
+#
+# Every run is a fresh process. "import" is the time until the app can serve requests, "ready" the time until the
+# classifier is loaded and warmed up, "first" the latency of the first classify call, and RSS the peak resident
+# memory of the process before and after that call. Lazy mode loads nothing until the first classify call.
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+API_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+CHILD = '''
+import json, resource, sys, time
+start = time.perf_counter()
+import apis
+import newclassifier
+newclassifier.start()
+started = time.perf_counter() - start
+while not newclassifier.is_ready() and newclassifier.LOAD_MODE == 'background':
+    time.sleep(0.01)
+ready = time.perf_counter() - start if newclassifier.is_ready() else None
+ready_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+with open('./static/img/' + sys.argv[1], 'rb') as f:
+    image = f.read()
+first_start = time.perf_counter()
+newclassifier.predict(image)
+first = time.perf_counter() - first_start
+print(json.dumps({'import': started, 'ready': ready, 'first': first, 'readyRssMb': ready_rss,
+                  'rssMb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024}))
+'''
+
+
+def measure(mode: str, image: str):
+    env = dict(os.environ, CLASSIFIER_LOAD_MODE=mode)
+    out = subprocess.run([sys.executable, '-c', CHILD, image], cwd=API_DIR, env=env, capture_output=True, text=True,
+                         check=True).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-runs', type=int, default=3)
+    args = parser.parse_args()
+
+    image = sorted(os.listdir(os.path.join(API_DIR, 'static', 'img')))[0]
+    for mode in ('lazy', 'background', 'eager'):
+        runs = [measure(mode, image) for _ in range(args.runs)]
+        best = {key: min((r[key] for r in runs if r[key] is not None), default=None) for key in runs[0]}
+        ready = f'{best["ready"]:6.2f}s' if best['ready'] is not None else '     -'
+        print(f'{mode:<10} import={best["import"]:6.2f}s  ready={ready}  first={best["first"] * 1000:8.1f}ms  '
+              f'RSS={best["readyRssMb"]:7.1f}MB -> {best["rssMb"]:7.1f}MB')
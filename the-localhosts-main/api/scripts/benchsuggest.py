@@ -0,0 +1,55 @@
+# benchsuggest.py
+# Benchmarks typeahead suggestion lookups on a synthetic medication catalog
+#
+# Usage (from api/scripts):
+#   python benchsuggest.py [-rows 100000] [-queries 10000]
+
+import argparse
+import os
+import random
+import string
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from search import PrefixIndex
+
+FORMS = ['Oral Tablet', 'Oral Capsule', 'Extended Release Oral Tablet', 'Chewable Tablet']
+
+
+def synthetic_rows(n: int):
+    rng = random.Random(0)
+    names = [''.join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(5, 12))) for _ in range(n // 4)]
+    for med_id in range(n):
+        name = rng.choice(names)
+        yield {
+            'medId': med_id,
+            'medName': name.title(),
+            'rxString': f'{name} {rng.choice([5, 10, 20, 50, 100, 200, 500])} MG {rng.choice(FORMS)}'
+        }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-rows', type=int, default=100000)
+    parser.add_argument('-queries', type=int, default=10000)
+    args = parser.parse_args()
+
+    index = PrefixIndex(max_age=0)
+    start = time.perf_counter()
+    index.load(list(synthetic_rows(args.rows)))
+    print(f'built index over {args.rows} rows ({len(index._keys)} distinct names) in {time.perf_counter() - start:.2f}s')
+
+    rng = random.Random(1)
+    for length in (1, 2, 3, 5):
+        prefixes = [index._keys[rng.randrange(len(index._keys))][:length] for _ in range(args.queries)]
+        latencies = []
+        for prefix in prefixes:
+            start = time.perf_counter()
+            index.suggest(prefix, 10)
+            latencies.append(time.perf_counter() - start)
+        latencies.sort()
+        p50 = latencies[len(latencies) // 2] * 1e6
+        p99 = latencies[int(len(latencies) * 0.99)] * 1e6
+        print(f'prefix length {length}: p50={p50:8.1f}us  p99={p99:8.1f}us')
@@ -0,0 +1,89 @@
+# loadtest.py
+# Load test of mixed login and medication search traffic against a running API server
+#
+# Usage (from api/scripts, with the server running, e.g. `python apis.py -prod`):
+#   python loadtest.py [-url http://localhost:8080] [-login-threads 16] [-search-threads 4] [-duration 20]
+#
+# Login threads keep posting valid credentials while search threads keep querying medications. Compare the search
+# latencies with PASSWORD_HASH_EXECUTOR=inline (hashing on the request threads) and process/thread on the server.
+# Logins rejected with 503 because the hashing queue is full are counted separately.
+
+import argparse
+import json
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+
+
+def call(url: str, method: str, body: dict = None, token: str = None):
+    req = urllib.request.Request(url, method=method, data=json.dumps(body).encode() if body is not None else None)
+    if token is not None:
+        req.add_header('Authorization', token)
+    try:
+        with urllib.request.urlopen(req, timeout=60) as res:
+            return res.status, json.loads(res.read() or b'{}')
+    except urllib.error.HTTPError as e:
+        return e.code, {}
+
+
+def worker(label: str, request, deadline: float, results: dict, lock: threading.Lock):
+    while time.monotonic() < deadline:
+        start = time.perf_counter()
+        status, _ = request()
+        elapsed = time.perf_counter() - start
+        with lock:
+            results.setdefault(label, {}).setdefault(status, []).append(elapsed)
+
+
+def report(label: str, by_status: dict, duration: float):
+    latencies = sorted(t for status, times in by_status.items() if status == 200 for t in times)
+    other = ', '.join(f'{status}: {len(times)}' for status, times in sorted(by_status.items()) if status != 200)
+    if not latencies:
+        print(f'{label:<7} no successful requests ({other})')
+        return
+    p50 = latencies[len(latencies) // 2] * 1000
+    p99 = latencies[int(len(latencies) * 0.99)] * 1000
+    print(f'{label:<7} {len(latencies) / duration:8.1f} ok/s  p50={p50:8.1f}ms  p99={p99:8.1f}ms  {other}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-url', type=str, default='http://localhost:8080')
+    parser.add_argument('-login-threads', type=int, default=16)
+    parser.add_argument('-search-threads', type=int, default=4)
+    parser.add_argument('-duration', type=float, default=20)
+    parser.add_argument('-query', type=str, default='ibuprofen')
+    args = parser.parse_args()
+
+    api = args.url.rstrip('/') + '/api/v1/'
+    credentials = {'email': f'loadtest-{uuid.uuid4()}@email.com', 'password': 'loadtest-password'}
+    status, user = call(api + 'users/signup', 'POST', {**credentials, 'firstName': 'Load', 'lastName': 'Test'})
+    if status != 200:
+        raise RuntimeError(f'signup failed with status {status}')
+
+    try:
+        results = {}
+        lock = threading.Lock()
+        deadline = time.monotonic() + args.duration
+        threads = [
+            threading.Thread(target=worker, args=('login', lambda: call(api + 'users/login', 'POST', credentials),
+                                                  deadline, results, lock))
+            for _ in range(args.login_threads)
+        ] + [
+            threading.Thread(target=worker, args=('search', lambda: call(api + 'medications/search', 'POST',
+                                                                         {'query': args.query}),
+                                                  deadline, results, lock))
+            for _ in range(args.search_threads)
+        ]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        for label in ('login', 'search'):
+            report(label, results.get(label, {}), args.duration)
+        print(json.dumps(call(api + 'metrics', 'GET')[1].get('passwordHashing'), indent=2))
+    finally:
+        call(api + f'users/{user["userId"]}', 'DELETE', {'password': credentials['password']}, user['token'])
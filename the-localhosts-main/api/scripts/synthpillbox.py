@@ -0,0 +1,70 @@
+# synthpillbox.py
+# Writes a synthetic Pillbox export with the columns read by getdbdata.py, for import benchmarks
+#
+# Usage (from api/scripts):
+#   python synthpillbox.py [-rows 100000] [-out ../static/synthpillbox.csv]
+
+import argparse
+import csv
+import json
+import os
+import random
+import string
+
+COLUMNS = ['splsize', 'splshape_text', 'splimprint', 'splcolor_text', 'spl_strength', 'spl_ingredients',
+           'spl_inactive_ing', 'source', 'rxstring', 'rxcui', 'medicine_name', 'author']
+SHAPES = ['ROUND', 'OVAL', 'CAPSULE', 'TRIANGLE', 'SQUARE', 'PENTAGON (5 SIDED)', 'DIAMOND']
+COLORS = ['WHITE', 'BLUE', 'YELLOW', 'PINK', 'ORANGE', 'GREEN', 'RED', 'BROWN']
+FORMS = ['Oral Tablet', 'Oral Capsule', 'Extended Release Oral Tablet', 'Chewable Tablet']
+INACTIVE = ['CELLULOSE, MICROCRYSTALLINE', 'MAGNESIUM STEARATE', 'LACTOSE MONOHYDRATE', 'SILICON DIOXIDE',
+            'TITANIUM DIOXIDE', 'POVIDONE', 'CROSPOVIDONE', 'TALC']
+
+
+def priced_names():
+    """
+    Medication names with Amazon or Costco prices, so part of the synthetic rows join to price data
+    """
+    names = []
+    price_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'static', 'price_data')
+    for file in ('amazondrugprice.json', 'costcoprice.json'):
+        with open(os.path.join(price_dir, file)) as f:
+            names += [item['name'].split('(')[0].strip() for item in json.load(f)]
+    return names
+
+
+def synthetic_rows(n: int, seed: int = 0):
+    rng = random.Random(seed)
+    names = priced_names() + [''.join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(6, 12))).title()
+                              for _ in range(5000)]
+    for i in range(n):
+        name = rng.choice(names)
+        strength = rng.choice([5, 10, 20, 50, 100, 200, 500])
+        imprint = ';'.join(''.join(rng.choice(string.ascii_uppercase + string.digits) for _ in range(rng.randint(1, 4)))
+                           for _ in range(rng.randint(1, 2)))
+        yield {
+            'splsize': rng.choice(['', rng.randint(4, 22)]),
+            'splshape_text': rng.choice(SHAPES),
+            'splimprint': imprint,
+            'splcolor_text': ';'.join(rng.sample(COLORS, rng.choice([1, 1, 1, 2]))),
+            'spl_strength': f'{name.upper()} {strength} mg',
+            'spl_ingredients': f'{name.upper()}[{strength} mg]',
+            'spl_inactive_ing': ';'.join(rng.sample(INACTIVE, rng.randint(2, 5))),
+            'source': 'SYNTHETIC',
+            'rxstring': f'{name} {strength} MG {rng.choice(FORMS)}',
+            'rxcui': 100000 + i,
+            'medicine_name': name,
+            'author': 'Synthetic Labs'
+        }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-rows', type=int, default=100000)
+    parser.add_argument('-out', type=str, default='../static/synthpillbox.csv')
+    args = parser.parse_args()
+
+    with open(args.out, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=COLUMNS)
+        writer.writeheader()
+        writer.writerows(synthetic_rows(args.rows))
+    print(f'Wrote {args.rows} rows to {args.out}')
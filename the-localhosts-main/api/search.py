@@ -0,0 +1,757 @@
+# search.py
+# In-memory search indexes built from the Medications table
+
+import bisect
+import heapq
+import math
+import os
+import re
+import threading
+import time
+import numpy as np
+import attributes
+import db
+
+# seconds after which an index is rebuilt in the background to pick up rows written by other processes (0 = never)
+INDEX_MAX_AGE = float(os.environ.get('SEARCH_INDEX_MAX_AGE', 3600))
+
+# searchable medication columns and the weight of a term found in each
+SEARCH_FIELDS = {
+    'medName': 3.0,
+    'rxString': 2.0,
+    'imprintFront': 1.5,
+    'imprintBack': 1.5,
+    'shape': 1.0,
+    'color': 1.0,
+    'size': 0.5,
+    'price': 0.5
+}
+# score multiplier for query terms that only match as a prefix of an indexed term
+PREFIX_MATCH_WEIGHT = 0.5
+# maximum number of indexed terms a single query prefix expands to
+MAX_PREFIX_EXPANSION = 200
+# maximum number of edits tolerated between a described imprint and a stored one
+IMPRINT_MAX_DISTANCE = int(os.environ.get('IMPRINT_MAX_DISTANCE', 2))
+# maximum number of medications a described imprint narrows the attribute search to
+MAX_IMPRINT_CANDIDATES = 500
+# score of a medication for each described attribute it matches (imprint and size scaled by match quality)
+ATTRIBUTE_WEIGHTS = {
+    'shape': 2.0,
+    'size': 1.0,
+    'color': 1.5,
+    'imprint': 3.0
+}
+# maximum number of medications returned for a physical description
+MAX_ATTRIBUTE_RESULTS = 50
+
+TOKEN_RE = re.compile(r'[a-z0-9]+(?:\.[0-9]+)?')
+IMPRINT_RE = re.compile(r'[^A-Z0-9]')
+# characters commonly misread on imprints, folded onto the same character
+IMPRINT_CONFUSABLES = str.maketrans('OQDILSBZ', '00011582')
+
+
+def tokenize(text):
+    """
+    Split text into lowercase alphanumeric terms (decimals such as prices are kept whole)
+
+    :param text: text to tokenize
+    :return: list of terms
+    """
+    if text is None:
+        return []
+    return TOKEN_RE.findall(str(text).lower())
+
+
+def normalize_imprint(imprint):
+    """
+    Normalize imprint text for fuzzy matching: uppercase, alphanumerics only, confusable characters folded
+
+    :param imprint: imprint text, e.g. 'M;365'
+    :return: normalized imprint, e.g. 'M365'
+    """
+    if imprint is None:
+        return ''
+    return IMPRINT_RE.sub('', str(imprint).upper()).translate(IMPRINT_CONFUSABLES)
+
+
+def imprint_distance(query: str, imprint: str, max_distance: int):
+    """
+    Get the number of edits needed to turn a query into some part of an imprint, so missing characters at either end
+    of the query are free
+
+    :param query: normalized query
+    :param imprint: normalized imprint
+    :param max_distance: distance above which computation stops
+    :return: edit distance, or max_distance + 1 if it is larger than max_distance
+    """
+    if query in imprint:
+        return 0
+    # every query character missing from the imprint costs an edit
+    missing = sum(max(0, query.count(c) - imprint.count(c)) for c in set(query))
+    if missing > max_distance:
+        return max_distance + 1
+    # rows are imprint positions; the first row is all zeros so a match may start anywhere in the imprint
+    prev = [0] * (len(imprint) + 1)
+    for i, qc in enumerate(query, 1):
+        cur = [i] + [0] * len(imprint)
+        for j, ic in enumerate(imprint, 1):
+            cur[j] = min(prev[j] + 1, cur[j - 1] + 1, prev[j - 1] + (qc != ic))
+        if min(cur) > max_distance:
+            return max_distance + 1
+        prev = cur
+    return min(prev)
+
+
+def price_in_range(price, min_price: float = None, max_price: float = None):
+    """
+    Check a medication price against optional bounds, unpriced medications are outside any bound
+
+    :param price: medication price or None
+    :param min_price: lower bound or None
+    :param max_price: upper bound or None
+    :return: boolean indicating whether the price is within the bounds
+    """
+    if min_price is None and max_price is None:
+        return True
+    if price is None:
+        return False
+    return (min_price is None or price >= min_price) and (max_price is None or price <= max_price)
+
+
+def price_order(price):
+    """
+    Sort key ordering medications cheapest first, unpriced ones last
+
+    :param price: medication price or None
+    :return: sort key
+    """
+    return (price is None, price or 0.0)
+
+
+class CatalogIndex:
+    """
+    Base class for in-memory structures built from the Medications table
+
+    The index is loaded lazily on first use, kept current through db medication listeners when this process changes
+    a medication, and rebuilt in the background once it is older than INDEX_MAX_AGE to pick up rows written by
+    other processes (e.g. getdbdata.py). Subclasses implement _build, _swap, _add and _remove.
+    """
+
+    def __init__(self, max_age: float = INDEX_MAX_AGE):
+        self.max_age = max_age
+        self._lock = threading.RLock()
+        self._loaded_at = None
+        self._refreshing = False
+        # one list per rebuild in progress, of the (medId, row) changes made since it started reading rows
+        self._rebuilds = []
+        db.add_medication_listener(self._on_change)
+
+    def _build(self, rows):
+        raise NotImplementedError
+
+    def _swap(self, state):
+        raise NotImplementedError
+
+    def _add(self, med_id: int, row: dict):
+        raise NotImplementedError
+
+    def _remove(self, med_id: int):
+        raise NotImplementedError
+
+    def load(self, rows=None):
+        """
+        (Re)build the index. Changes made while the rows are read and built are replayed on the new index, so the
+        rebuild never undoes them
+
+        :param rows: medication rows, read from the database if not given
+        :return: boolean indicating success
+        """
+        changes = []
+        with self._lock:
+            self._rebuilds.append(changes)
+        try:
+            if rows is None:
+                rows, err = db.read_all_medications()
+                if err is not None:
+                    return False
+            state = self._build(rows)
+            with self._lock:
+                self._swap(state)
+                # a change may also be in the rows read, replaying it again is harmless
+                for med_id, row in changes:
+                    self._apply(med_id, row)
+                self._loaded_at = time.monotonic()
+            return True
+        finally:
+            with self._lock:
+                self._rebuilds.remove(changes)
+
+    def ensure_loaded(self):
+        """
+        Load the index if it hasn't been loaded yet, and schedule a background rebuild if it is stale
+
+        :return: boolean indicating whether the index is usable
+        """
+        if self._loaded_at is None:
+            with self._lock:
+                if self._loaded_at is None and not self.load():
+                    return False
+        elif self.max_age and time.monotonic() - self._loaded_at > self.max_age:
+            with self._lock:
+                if self._refreshing:
+                    return True
+                self._refreshing = True
+            threading.Thread(target=self._refresh, daemon=True).start()
+        return True
+
+    def _refresh(self):
+        try:
+            self.load()
+        finally:
+            with self._lock:
+                self._refreshing = False
+
+    def _apply(self, med_id: int, row: [dict, None]):
+        self._remove(med_id)
+        if row is not None:
+            self._add(med_id, row)
+
+    def _on_change(self, med_id: int, row: [dict, None]):
+        with self._lock:
+            for changes in self._rebuilds:
+                changes.append((med_id, row))
+            if self._loaded_at is not None:
+                self._apply(med_id, row)
+
+
+class MedicationSearchIndex(CatalogIndex):
+    """
+    Inverted index of medication terms
+
+    Every query term must match (AND), each term also matches indexed terms it is a prefix of, and results are ranked
+    by the field-weighted, IDF-scaled sum of matched terms.
+    """
+
+    def __init__(self, max_age: float = INDEX_MAX_AGE):
+        self._postings = {}
+        self._doc_terms = {}
+        self._terms = []
+        # materialized best price of every medication, for sorting and filtering results by price
+        self._prices = {}
+        super().__init__(max_age)
+
+    @staticmethod
+    def _row_terms(row: dict):
+        terms = {}
+        for field, weight in SEARCH_FIELDS.items():
+            for term in tokenize(row.get(field)):
+                terms[term] = terms.get(term, 0.0) + weight
+        return terms
+
+    def _build(self, rows):
+        postings = {}
+        doc_terms = {}
+        prices = {}
+        for row in rows:
+            terms = self._row_terms(row)
+            doc_terms[row['medId']] = list(terms)
+            prices[row['medId']] = row.get('price')
+            for term, weight in terms.items():
+                postings.setdefault(term, {})[row['medId']] = weight
+        return postings, doc_terms, sorted(postings), prices
+
+    def _swap(self, state):
+        self._postings, self._doc_terms, self._terms, self._prices = state
+
+    def _add(self, med_id: int, row: dict):
+        terms = self._row_terms(row)
+        self._doc_terms[med_id] = list(terms)
+        self._prices[med_id] = row.get('price')
+        for term, weight in terms.items():
+            if term not in self._postings:
+                self._postings[term] = {}
+                bisect.insort(self._terms, term)
+            self._postings[term][med_id] = weight
+
+    def _remove(self, med_id: int):
+        self._prices.pop(med_id, None)
+        for term in self._doc_terms.pop(med_id, []):
+            posting = self._postings.get(term)
+            if posting is None:
+                continue
+            posting.pop(med_id, None)
+            if not posting:
+                del self._postings[term]
+                i = bisect.bisect_left(self._terms, term)
+                if i < len(self._terms) and self._terms[i] == term:
+                    del self._terms[i]
+
+    def _expand(self, term: str):
+        """
+        Get indexed terms matching a query term exactly or by prefix
+
+        :param term: query term
+        :return: list of (indexed term, match weight)
+        """
+        matches = [(term, 1.0)] if term in self._postings else []
+        i = bisect.bisect_left(self._terms, term)
+        while i < len(self._terms) and len(matches) < MAX_PREFIX_EXPANSION and self._terms[i].startswith(term):
+            if self._terms[i] != term:
+                matches.append((self._terms[i], PREFIX_MATCH_WEIGHT))
+            i += 1
+        return matches
+
+    def search(self, query: str, limit: int = 10, sort: str = 'relevance', min_price: float = None,
+               max_price: float = None):
+        """
+        Search medications matching every term of a query
+
+        :param query: query string
+        :param limit: maximum number of results
+        :param sort: 'relevance', or 'price' for cheapest first (unpriced last, then by relevance)
+        :param min_price: only medications priced at least this much
+        :param max_price: only medications priced at most this much
+        :return: list of medIds ordered by relevance or price
+        """
+        terms = list(dict.fromkeys(tokenize(query)))
+        if not terms:
+            return []
+        with self._lock:
+            n_docs = max(len(self._doc_terms), 1)
+            scores = None
+            for term in terms:
+                term_scores = {}
+                for indexed_term, match_weight in self._expand(term):
+                    posting = self._postings[indexed_term]
+                    idf = math.log(1 + n_docs / len(posting))
+                    for med_id, weight in posting.items():
+                        score = weight * idf * match_weight
+                        if score > term_scores.get(med_id, 0.0):
+                            term_scores[med_id] = score
+
+                # AND semantics, keep only medications matching every term so far
+                if scores is None:
+                    scores = term_scores
+                else:
+                    scores = {med_id: score + term_scores[med_id] for med_id, score in scores.items() if med_id in term_scores}
+                if not scores:
+                    return []
+
+            if min_price is not None or max_price is not None:
+                scores = {med_id: score for med_id, score in scores.items()
+                          if price_in_range(self._prices.get(med_id), min_price, max_price)}
+            if sort == 'price':
+                prices = {med_id: self._prices.get(med_id) for med_id in scores}
+                return sorted(scores, key=lambda med_id: (*price_order(prices[med_id]), -scores[med_id], med_id))[:limit]
+        return sorted(scores, key=lambda med_id: (-scores[med_id], med_id))[:limit]
+
+
+class PrefixIndex(CatalogIndex):
+    """
+    Sorted array of distinct medication names (medName and rxString) for typeahead suggestions
+
+    A prefix lookup is a binary search for the range of names starting with the prefix; when the range holds more
+    names than requested, the names shared by the most medications are returned. Top names for wide ranges (short
+    prefixes) are precomputed at build time and memoized afterwards, and only the memoized prefixes of a changed name
+    are dropped on incremental updates.
+    """
+
+    # maximum number of suggestions per lookup
+    MAX_SUGGESTIONS = 50
+    # ranges wider than this are memoized
+    MEMO_RANGE = 256
+    # prefixes up to this length are precomputed when the index is built
+    PRECOMPUTE_LENGTH = 2
+
+    def __init__(self, max_age: float = INDEX_MAX_AGE):
+        self._keys = []
+        self._names = []
+        self._counts = {}
+        self._doc_keys = {}
+        self._memo = {}
+        super().__init__(max_age)
+
+    @staticmethod
+    def _row_names(row: dict):
+        names = {}
+        for field in ('medName', 'rxString'):
+            name = ' '.join(str(row.get(field) or '').split())
+            if name:
+                names.setdefault(name.lower(), name)
+        return names
+
+    @classmethod
+    def _top(cls, keys: list, names: list, counts: dict, lo: int, hi: int):
+        if hi - lo <= cls.MAX_SUGGESTIONS:
+            return names[lo:hi]
+        idx = heapq.nsmallest(cls.MAX_SUGGESTIONS, range(lo, hi), key=lambda i: (-counts[keys[i]], i))
+        return [names[i] for i in idx]
+
+    def _build(self, rows):
+        counts = {}
+        display = {}
+        doc_keys = {}
+        for row in rows:
+            names = self._row_names(row)
+            doc_keys[row['medId']] = list(names)
+            for key, name in names.items():
+                counts[key] = counts.get(key, 0) + 1
+                display.setdefault(key, name)
+        keys = sorted(counts)
+        names = [display[k] for k in keys]
+
+        # precompute the widest ranges, found in one pass over the sorted keys
+        memo = {}
+        for length in range(1, self.PRECOMPUTE_LENGTH + 1):
+            lo = 0
+            while lo < len(keys):
+                prefix = keys[lo][:length]
+                hi = bisect.bisect_left(keys, prefix + '\uffff', lo)
+                if hi - lo > self.MEMO_RANGE:
+                    memo[prefix] = self._top(keys, names, counts, lo, hi)
+                lo = hi
+        return keys, names, counts, doc_keys, memo
+
+    def _swap(self, state):
+        self._keys, self._names, self._counts, self._doc_keys, self._memo = state
+
+    def _forget(self, key: str):
+        for i in range(1, len(key) + 1):
+            self._memo.pop(key[:i], None)
+
+    def _add(self, med_id: int, row: dict):
+        names = self._row_names(row)
+        self._doc_keys[med_id] = list(names)
+        for key, name in names.items():
+            if key not in self._counts:
+                i = bisect.bisect_left(self._keys, key)
+                self._keys.insert(i, key)
+                self._names.insert(i, name)
+                self._counts[key] = 0
+            self._counts[key] += 1
+            self._forget(key)
+
+    def _remove(self, med_id: int):
+        for key in self._doc_keys.pop(med_id, []):
+            self._counts[key] -= 1
+            if self._counts[key] == 0:
+                del self._counts[key]
+                i = bisect.bisect_left(self._keys, key)
+                del self._keys[i]
+                del self._names[i]
+            self._forget(key)
+
+    def suggest(self, prefix: str, limit: int = 10):
+        """
+        Get medication names starting with a prefix
+
+        :param prefix: name prefix (case-insensitive)
+        :param limit: maximum number of names (1 to MAX_SUGGESTIONS)
+        :return: list of names, most common first
+        """
+        prefix = ' '.join(prefix.split()).lower()
+        if not prefix:
+            return []
+        limit = max(1, min(limit, self.MAX_SUGGESTIONS))
+        with self._lock:
+            if prefix in self._memo:
+                return self._memo[prefix][:limit]
+
+            lo = bisect.bisect_left(self._keys, prefix)
+            hi = bisect.bisect_left(self._keys, prefix + '\uffff', lo)
+            top = self._top(self._keys, self._names, self._counts, lo, hi)
+            if hi - lo > self.MEMO_RANGE:
+                self._memo[prefix] = top
+            return top[:limit]
+
+
+class ImprintIndex(CatalogIndex):
+    """
+    Bigram index of normalized front and back imprints for fuzzy imprint lookup
+
+    Candidates for a described imprint are the stored imprints sharing enough of its bigrams to be within
+    IMPRINT_MAX_DISTANCE edits (each edit destroys at most two bigrams), so only those are compared character by
+    character. Descriptions tolerate one edit per three characters, so short ones don't match every imprint.
+    """
+
+    FIELDS = ('imprintFront', 'imprintBack')
+
+    def __init__(self, max_age: float = INDEX_MAX_AGE):
+        self._imprints = {field: {} for field in self.FIELDS}
+        self._bigrams = {field: {} for field in self.FIELDS}
+        self._doc_imprints = {}
+        super().__init__(max_age)
+
+    @staticmethod
+    def _grams(imprint: str):
+        return {imprint[i:i + 2] for i in range(len(imprint) - 1)}
+
+    @classmethod
+    def _index(cls, imprints: dict, bigrams: dict, field: str, imprint: str, med_id: int):
+        if imprint not in imprints[field]:
+            imprints[field][imprint] = set()
+            for gram in cls._grams(imprint):
+                bigrams[field].setdefault(gram, set()).add(imprint)
+        imprints[field][imprint].add(med_id)
+
+    def _build(self, rows):
+        imprints = {field: {} for field in self.FIELDS}
+        bigrams = {field: {} for field in self.FIELDS}
+        doc_imprints = {}
+        for row in rows:
+            doc_imprints[row['medId']] = []
+            for field in self.FIELDS:
+                imprint = normalize_imprint(row.get(field))
+                if imprint:
+                    doc_imprints[row['medId']].append((field, imprint))
+                    self._index(imprints, bigrams, field, imprint, row['medId'])
+        return imprints, bigrams, doc_imprints
+
+    def _swap(self, state):
+        self._imprints, self._bigrams, self._doc_imprints = state
+
+    def _add(self, med_id: int, row: dict):
+        self._doc_imprints[med_id] = []
+        for field in self.FIELDS:
+            imprint = normalize_imprint(row.get(field))
+            if imprint:
+                self._doc_imprints[med_id].append((field, imprint))
+                self._index(self._imprints, self._bigrams, field, imprint, med_id)
+
+    def _remove(self, med_id: int):
+        for field, imprint in self._doc_imprints.pop(med_id, []):
+            med_ids = self._imprints[field].get(imprint)
+            if med_ids is None:
+                continue
+            med_ids.discard(med_id)
+            if not med_ids:
+                del self._imprints[field][imprint]
+                for gram in self._grams(imprint):
+                    self._bigrams[field][gram].discard(imprint)
+                    if not self._bigrams[field][gram]:
+                        del self._bigrams[field][gram]
+
+    def _candidates(self, field: str, query: str, max_distance: int):
+        grams = self._grams(query)
+        required = len(grams) - 2 * max_distance
+        if required <= 0:
+            return [imprint for imprint in self._imprints[field] if max_distance or query in imprint]
+        shared = {}
+        for gram in grams:
+            for imprint in self._bigrams[field].get(gram, ()):
+                shared[imprint] = shared.get(imprint, 0) + 1
+        return [imprint for imprint, n in shared.items() if n >= required]
+
+    def match(self, field: str, imprint: str, limit: int = MAX_IMPRINT_CANDIDATES):
+        """
+        Find medications whose imprint is close to a described imprint
+
+        :param field: 'imprintFront' or 'imprintBack'
+        :param imprint: described imprint
+        :param limit: maximum number of medications
+        :return: dict of medId to match score in (0, 1], 1 being an exact match
+        """
+        query = normalize_imprint(imprint)
+        if not query:
+            return {}
+        max_distance = min(IMPRINT_MAX_DISTANCE, (len(query) - 1) // 3)
+        scored = []
+        with self._lock:
+            for candidate in self._candidates(field, query, max_distance):
+                distance = imprint_distance(query, candidate, max_distance)
+                if distance <= max_distance:
+                    # fewer edits first, then imprints the description covers more of
+                    score = len(query) / max(len(query), len(candidate)) / (1 + distance)
+                    scored.append((score, candidate))
+            scored.sort(key=lambda s: (-s[0], s[1]))
+
+            matches = {}
+            for score, candidate in scored:
+                for med_id in self._imprints[field][candidate]:
+                    matches.setdefault(med_id, score)
+                if len(matches) >= limit:
+                    break
+        return matches
+
+
+class AttributeIndex(CatalogIndex):
+    """
+    Columnar snapshot of medication shape codes, color bitmasks and sizes for ranked classify-by-description
+
+    Every medication is scored against the described attributes in one vectorized pass, so a medication matching
+    most of a description still ranks even when one attribute was described wrong. Rows changed by this process are
+    appended and the rows they replace are masked out until the next rebuild.
+    """
+
+    def __init__(self, max_age: float = INDEX_MAX_AGE):
+        self._med_ids = np.zeros(0, dtype=np.int64)
+        self._shapes = np.zeros(0, dtype=np.uint8)
+        self._colors = np.zeros(0, dtype=np.uint16)
+        self._sizes = np.zeros(0, dtype=np.float32)
+        self._alive = np.zeros(0, dtype=bool)
+        self._count = 0
+        self._positions = {}
+        super().__init__(max_age)
+
+    @staticmethod
+    def _row_values(row: dict):
+        size = row.get('size')
+        return (attributes.shape_code(row.get('shape')), attributes.color_mask(row.get('color')),
+                float(size) if size is not None else np.nan)
+
+    def _build(self, rows):
+        n = len(rows)
+        med_ids = np.fromiter((row['medId'] for row in rows), dtype=np.int64, count=n)
+        values = [self._row_values(row) for row in rows]
+        shapes = np.fromiter((v[0] for v in values), dtype=np.uint8, count=n)
+        colors = np.fromiter((v[1] for v in values), dtype=np.uint16, count=n)
+        sizes = np.fromiter((v[2] for v in values), dtype=np.float32, count=n)
+        positions = {row['medId']: i for i, row in enumerate(rows)}
+        return med_ids, shapes, colors, sizes, np.ones(n, dtype=bool), n, positions
+
+    def _swap(self, state):
+        self._med_ids, self._shapes, self._colors, self._sizes, self._alive, self._count, self._positions = state
+
+    def _grow(self):
+        capacity = max(2 * len(self._med_ids), 1024)
+        for name in ('_med_ids', '_shapes', '_colors', '_sizes', '_alive'):
+            column = getattr(self, name)
+            grown = np.zeros(capacity, dtype=column.dtype)
+            grown[:len(column)] = column
+            setattr(self, name, grown)
+
+    def _add(self, med_id: int, row: dict):
+        if self._count == len(self._med_ids):
+            self._grow()
+        i = self._count
+        self._med_ids[i] = med_id
+        self._shapes[i], self._colors[i], self._sizes[i] = self._row_values(row)
+        self._alive[i] = True
+        self._positions[med_id] = i
+        self._count += 1
+
+    def _remove(self, med_id: int):
+        i = self._positions.pop(med_id, None)
+        if i is not None:
+            self._alive[i] = False
+
+    def _score(self, shape: str, size: int, color: str, color2: str, imprint_scores: [dict, None]):
+        n = self._count
+        scores = np.zeros(n, dtype=np.float32)
+        if shape is not None:
+            # score of every possible shape code, looked up per row
+            shape_scores = np.zeros(256, dtype=np.float32)
+            shape_scores[attributes.matching_shape_codes(shape)] = ATTRIBUTE_WEIGHTS['shape']
+            scores += shape_scores[self._shapes[:n]]
+        if size is not None:
+            # full score within the tolerance, then decaying with every further mm (unknown sizes score 0)
+            off = np.abs(self._sizes[:n] - np.float32(size))
+            off -= attributes.SIZE_TOLERANCE
+            np.maximum(off, 0, out=off)
+            off += 1
+            np.divide(ATTRIBUTE_WEIGHTS['size'], off, out=off)
+            scores += np.nan_to_num(off, copy=False)
+        for c in (color, color2):
+            if c is not None:
+                matched = (self._colors[:n] & attributes.matching_color_bits(c)) != 0
+                scores += np.float32(ATTRIBUTE_WEIGHTS['color']) * matched
+        if imprint_scores:
+            matched = [(self._positions[med_id], score) for med_id, score in imprint_scores.items()
+                       if med_id in self._positions]
+            if matched:
+                positions, imprint = zip(*matched)
+                scores[list(positions)] += ATTRIBUTE_WEIGHTS['imprint'] * np.array(imprint, dtype=np.float32)
+        scores[~self._alive[:n]] = 0
+        return scores
+
+    def rank(self, shape: str, size: int, color: str, color2: str, imprint_scores: dict = None,
+             limit: int = MAX_ATTRIBUTE_RESULTS):
+        """
+        Rank medications by how well they match a physical description
+
+        :param shape: shape of medication
+        :param size: size of medication
+        :param color: color of medication
+        :param color2: secondary color of medication
+        :param imprint_scores: dict of medId to imprint match score, from ImprintIndex.match
+        :param limit: maximum number of medications
+        :return: list of medIds, best match first
+        """
+        with self._lock:
+            scores = self._score(shape, size, color, color2, imprint_scores)
+            top = np.flatnonzero(scores > 0)
+            if len(top) > limit:
+                top = top[np.argpartition(-scores[top], limit - 1)[:limit]]
+            # highest score first, ties by medId
+            top = top[np.lexsort((self._med_ids[top], -scores[top]))]
+            return [int(med_id) for med_id in self._med_ids[top]]
+
+
+medication_index = MedicationSearchIndex()
+prefix_index = PrefixIndex()
+imprint_index = ImprintIndex()
+attribute_index = AttributeIndex()
+
+
+def search_medications(query: str, limit: int = 10, sort: str = 'relevance', min_price: float = None,
+                       max_price: float = None):
+    """
+    Search medications through the in-memory index, falling back to the database query if it can't be loaded
+
+    :param query: query string
+    :param limit: maximum number of results
+    :param sort: 'relevance', or 'price' for cheapest first
+    :param min_price: only medications priced at least this much
+    :param max_price: only medications priced at most this much
+    :return: list of medication rows ordered by relevance or price, err
+    """
+    if not medication_index.ensure_loaded():
+        rows, err = db.search_medication(query)
+        if err is not None:
+            return None, err
+        rows = [row for row in rows if price_in_range(row['price'], min_price, max_price)]
+        if sort == 'price':
+            rows.sort(key=lambda row: price_order(row['price']))
+        return rows[:limit], None
+    return db.read_medications(medication_index.search(query, limit, sort, min_price, max_price))
+
+
+def suggest_medications(prefix: str, limit: int = 10):
+    """
+    Get typeahead suggestions for medication names
+
+    :param prefix: name prefix
+    :param limit: maximum number of suggestions
+    :return: list of names, err
+    """
+    if not prefix_index.ensure_loaded():
+        return None, {
+            'err': 'Unable to load medication names.'
+        }
+    return prefix_index.suggest(prefix, limit), None
+
+
+def search_medications_by_attributes(shape: str, size: int, imprint_front: str, imprint_back: str, color: str,
+                                     color2: str):
+    """
+    Search medications by physical attributes, ranked by how many described attributes they match and how well
+
+    :param shape: shape of medication
+    :param size: size of medication
+    :param imprint_front: imprint on front of medication
+    :param imprint_back: imprint on back of medication
+    :param color: color of medication
+    :param color2: secondary color of medication
+    :return: list of medication rows, best match first, err
+    """
+    if not attribute_index.ensure_loaded() or not imprint_index.ensure_loaded():
+        return db.search_medication_by_attributes(shape, size, imprint_front, imprint_back, color, color2)
+
+    # imprints add the sum of their match scores, so a medication matching either side still ranks
+    imprint_scores = {}
+    for field, imprint in (('imprintFront', imprint_front), ('imprintBack', imprint_back)):
+        if imprint is None:
+            continue
+        for med_id, score in imprint_index.match(field, imprint).items():
+            imprint_scores[med_id] = imprint_scores.get(med_id, 0.0) + score
+    return db.read_medications(attribute_index.rank(shape, size, color, color2, imprint_scores))
@@ -0,0 +1,251 @@
+# tokens.py
+# Stateless HMAC-signed session tokens
+#
+# Signed tokens carry the user ID, issue time, expiry and signing key ID, so they are verified in memory without a
+# database lookup. They are selected with SESSION_TOKEN_MODE=signed; database-backed uuid tokens keep working in either
+# mode. Revocations (logout, password change, account deletion) are stored in the Revocations table and every process
+# holds the live ones in memory, reading new ones at most every SESSION_REVOCATION_SYNC_INTERVAL seconds, so a token
+# revoked by another process (or before a restart) is rejected within that interval. Revocations are never evicted,
+# only dropped once the tokens they revoke would have expired anyway.
+
+import base64
+import hashlib
+import hmac
+import os
+import struct
+import threading
+import time
+import uuid
+import db
+
+# 'db' issues uuid tokens stored in the Sessions table, 'signed' issues HMAC-signed tokens
+TOKEN_MODE = os.environ.get('SESSION_TOKEN_MODE', 'db')
+# lifetime of signed tokens in seconds
+TOKEN_TTL = int(os.environ.get('SESSION_TTL', 3600))
+# seconds between reads of revocations made by other processes
+REVOCATION_SYNC_INTERVAL = float(os.environ.get('SESSION_REVOCATION_SYNC_INTERVAL', 5))
+
+# payload: userId, issued at (ms), expires at (s), random token ID
+_PAYLOAD = struct.Struct('>IQQ8s')
+
+
+def _load_signing_keys():
+    """
+    Parse SESSION_SIGNING_KEYS ("kid:secret,kid2:secret2"), generating a process-local key if none are configured
+
+    :return: dict of key ID to key bytes, active key ID
+    """
+    keys = {}
+    for entry in os.environ.get('SESSION_SIGNING_KEYS', '').split(','):
+        if ':' in entry:
+            kid, secret = entry.split(':', 1)
+            keys[kid.strip()] = secret.strip().encode()
+    if not keys:
+        if TOKEN_MODE == 'signed':
+            print('SESSION_SIGNING_KEYS not set, signed session tokens will not survive a restart.')
+        keys['local'] = os.urandom(32)
+    active = os.environ.get('SESSION_SIGNING_KEY_ID', next(iter(keys)))
+    return keys, active
+
+
+signing_keys, active_key_id = _load_signing_keys()
+
+# revoked token ID -> expires at (s), and userId -> (not before (ms), token ID exempt from the revocation, expires at)
+revoked_tokens = {}
+revoked_users = {}
+_revocation_lock = threading.Lock()
+_revocation_sync = {'lastId': 0, 'syncedAt': None}
+
+
+def _b64encode(data: bytes):
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode()
+
+
+def _b64decode(data: str):
+    return base64.urlsafe_b64decode(data + '=' * (-len(data) % 4))
+
+
+def _sign(kid: str, payload: str):
+    return hmac.new(signing_keys[kid], f'{kid}.{payload}'.encode(), hashlib.sha256).digest()
+
+
+def is_signed_token(token: str):
+    """
+    Check whether a token has the signed token format
+
+    :param token: session token
+    :return: boolean indicating signed token format
+    """
+    return token is not None and token.count('.') == 2
+
+
+def issue_token(user_id: int):
+    """
+    Issue a signed session token
+
+    :param user_id: user's ID
+    :return: signed session token
+    """
+    now = time.time()
+    payload = _b64encode(_PAYLOAD.pack(user_id, int(now * 1000), int(now) + TOKEN_TTL, os.urandom(8)))
+    return f'{active_key_id}.{payload}.{_b64encode(_sign(active_key_id, payload))}'
+
+
+def decode_token(token: str):
+    """
+    Verify a signed token's signature and expiry
+
+    :param token: signed session token
+    :return: (userId, issued at in ms, token ID, expires at in s) or None if the token is invalid or expired
+    """
+    try:
+        kid, payload, sig = token.split('.')
+        if kid not in signing_keys or not hmac.compare_digest(_sign(kid, payload), _b64decode(sig)):
+            return None
+        user_id, issued_at, expires_at, token_id = _PAYLOAD.unpack(_b64decode(payload))
+    except (ValueError, struct.error):
+        return None
+    if expires_at <= time.time():
+        return None
+    return user_id, issued_at, token_id, expires_at
+
+
+def _apply_revocation(token_id: bytes, user_id: int, not_before: int, exempt_token_id: bytes, expires_at: int):
+    # called with _revocation_lock held. a later user revocation supersedes an earlier one
+    if token_id is not None:
+        revoked_tokens[token_id] = max(expires_at, revoked_tokens.get(token_id, 0))
+    if user_id is not None:
+        current = revoked_users.get(user_id)
+        if current is None or not_before >= current[0]:
+            revoked_users[user_id] = (not_before, exempt_token_id, expires_at)
+
+
+def sync_revocations(force: bool = False):
+    """
+    Read revocations stored since the last sync, at most once per REVOCATION_SYNC_INTERVAL, and drop expired ones.
+    The first sync of a process loads every live revocation. If the read fails, the revocations already held stay in
+    force and the read is retried at the next interval
+
+    :param force: sync even if the interval hasn't passed
+    """
+    with _revocation_lock:
+        synced_at = _revocation_sync['syncedAt']
+        if not force and synced_at is not None and time.monotonic() - synced_at < REVOCATION_SYNC_INTERVAL:
+            return
+        _revocation_sync['syncedAt'] = time.monotonic()
+        after_id = _revocation_sync['lastId']
+    rows, err = db.read_revocations(after_id)
+    if err is not None:
+        return
+    now = time.time()
+    with _revocation_lock:
+        for row in rows:
+            _apply_revocation(row['tokenId'], row['userId'], row['notBefore'], row['exemptTokenId'],
+                              int(row['expiresAt']))
+            _revocation_sync['lastId'] = max(_revocation_sync['lastId'], row['revocationId'])
+        for token_id in [t for t, expires_at in revoked_tokens.items() if expires_at <= now]:
+            del revoked_tokens[token_id]
+        for user_id in [u for u, (_, _, expires_at) in revoked_users.items() if expires_at <= now]:
+            del revoked_users[user_id]
+
+
+def verify_token(token: str):
+    """
+    Verify a signed token against its signature, expiry and the revocation list
+
+    :param token: signed session token
+    :return: user's ID, or None if the token is not valid
+    """
+    decoded = decode_token(token)
+    if decoded is None:
+        return None
+    user_id, issued_at, token_id, _ = decoded
+    sync_revocations()
+    with _revocation_lock:
+        if token_id in revoked_tokens:
+            return None
+        user_revocation = revoked_users.get(user_id)
+    if user_revocation is not None:
+        not_before, exempt_token_id, _ = user_revocation
+        if issued_at < not_before and token_id != exempt_token_id:
+            return None
+    return user_id
+
+
+def _revoke(token_id: bytes, user_id: int, not_before: int, exempt_token_id: bytes, expires_at: int):
+    # in force in this process at once, and in the others once they have synced
+    with _revocation_lock:
+        _apply_revocation(token_id, user_id, not_before, exempt_token_id, expires_at)
+    _, err = db.create_revocation(token_id, user_id, not_before, exempt_token_id, expires_at)
+    return None, err
+
+
+def revoke_token(token: str):
+    """
+    Revoke a single signed token, e.g. on logout
+
+    :param token: signed session token
+    :return: None, err
+    """
+    decoded = decode_token(token)
+    if decoded is None:
+        return None, None
+    return _revoke(decoded[2], None, None, None, decoded[3])
+
+
+def revoke_user(user_id: int, keep_token: str = None):
+    """
+    Revoke every signed token issued to a user up to now, e.g. on password change or account deletion
+
+    :param user_id: user's ID
+    :param keep_token: optional token that stays valid (the session that made the change)
+    :return: None, err
+    """
+    decoded = decode_token(keep_token) if keep_token is not None else None
+    # every token issued up to now expires within TOKEN_TTL
+    return _revoke(None, user_id, int(time.time() * 1000), decoded[2] if decoded is not None else None,
+                   int(time.time()) + TOKEN_TTL)
+
+
+def create_session(user_id: int):
+    """
+    Create a session in the configured token mode
+
+    :param user_id: user's ID
+    :return: session token, or None if the session could not be created
+    """
+    if TOKEN_MODE == 'signed':
+        return issue_token(user_id)
+    token = str(uuid.uuid4())
+    res, err = db.create_session(user_id, token)
+    return token if res is not None and err is None else None
+
+
+def read_session(token: str):
+    """
+    Resolve a session token of either kind to its user
+
+    :param token: signed or database-backed session token
+    :return: userId, err
+    """
+    if is_signed_token(token):
+        user_id = verify_token(token)
+        if user_id is None:
+            return None, {
+                'err': 'Invalid or expired session token.'
+            }
+        return user_id, None
+    return db.read_session(token)
+
+
+def delete_session(user_id: int, token: str):
+    """
+    End a session of either kind
+
+    :param user_id: user's ID
+    :param token: signed or database-backed session token
+    :return: None, err
+    """
+    if is_signed_token(token):
+        return revoke_token(token)
+    return db.delete_session(user_id, token)
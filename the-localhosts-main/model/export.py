@@ -0,0 +1,177 @@
+# export.py
+# Exports the trained Keras model (model.keras) to a TFLite flatbuffer for CPU inference in the API
+#
+# The export is written next to a JSON manifest (<out>.json) holding the class names and input shape, so the API can
+# serve it without class_names.pickle or Keras. Before anything is written, the exported model is run against the
+# Keras model on the held-out validation split of data_full (the same split train.py validates on) and the export is
+# refused if their top-1 predictions agree on fewer than -min-agreement of the images.
+#
+# Usage:
+#   python export.py [-model model.keras] [-out model.tflite] [-min-agreement 0.99] [-skipcheck]
+#
+# The API serves the export with CLASSIFIER_RUNTIME=tflite.
+
+import argparse
+import datetime
+import hashlib
+import json
+import os
+import pickle
+import sys
+import time
+import numpy as np
+import tensorflow as tf
+from keras.models import load_model
+from keras.utils import image_dataset_from_directory
+
+# the API's TFLite wrapper, so exports are evaluated exactly the way they will be served
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'api'))
+from newclassifier import TFLiteModel
+
+DATA_ROOT = './data_full'
+# train.py's validation split, so the held-out set is data the model was not fitted on
+VALIDATION_SPLIT = 0.2
+SPLIT_SEED = 123
+
+
+def held_out_dataset(input_size: tuple, data_root: str = DATA_ROOT, batch_size: int = 32):
+    """
+    Load train.py's validation subset of the training data
+
+    :param input_size: model input (height, width)
+    :param data_root: directory of one subdirectory of images per class
+    :param batch_size: images per batch
+    :return: dataset of (images, labels) batches
+    """
+    return image_dataset_from_directory(
+        data_root,
+        validation_split=VALIDATION_SPLIT,
+        subset='validation',
+        seed=SPLIT_SEED,
+        batch_size=batch_size,
+        image_size=input_size
+    )
+
+
+def convert(model, representative_dataset=None, quantization: str = 'float32'):
+    """
+    Convert a Keras model to a TFLite flatbuffer
+
+    :param model: Keras model
+    :param representative_dataset: generator of calibration input lists, required for 'int8'
+    :param quantization: 'float32', 'dynamic' (int8 weights, float activations) or 'int8' (int8 weights and activations)
+    :return: TFLite model bytes
+    """
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    if quantization in ('dynamic', 'int8'):
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    if quantization == 'int8':
+        # activations are quantized with ranges calibrated on the representative inputs, the model's float input and
+        # output tensors are kept so callers don't change
+        converter.representative_dataset = representative_dataset
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+    return converter.convert()
+
+
+def evaluate(models: dict, dataset):
+    """
+    Run models side by side over a labelled dataset
+
+    :param models: dict of name -> object with predict_on_batch(images), the first one is the reference model
+    :param dataset: dataset of (images, labels) batches
+    :return: dict of name -> {top1, top5, agreement (top-1 agreement with the reference), maxProbDiff, ms per image}
+    """
+    names = list(models)
+    counts = {name: {'top1': 0, 'top5': 0, 'agreement': 0, 'maxProbDiff': 0.0, 'seconds': 0.0} for name in names}
+    n = 0
+    for images, labels in dataset:
+        images, labels = images.numpy(), labels.numpy()
+        n += len(labels)
+        reference = None
+        for name in names:
+            start = time.perf_counter()
+            probs = np.asarray(models[name].predict_on_batch(images))
+            counts[name]['seconds'] += time.perf_counter() - start
+            top5 = np.argsort(-probs, axis=1)[:, :5]
+            counts[name]['top1'] += int((top5[:, 0] == labels).sum())
+            counts[name]['top5'] += int((top5 == labels[:, None]).any(axis=1).sum())
+            if reference is None:
+                reference = probs
+            counts[name]['agreement'] += int((probs.argmax(axis=1) == reference.argmax(axis=1)).sum())
+            counts[name]['maxProbDiff'] = max(counts[name]['maxProbDiff'], float(np.abs(probs - reference).max()))
+    return {name: {
+        'top1': round(c['top1'] / n, 4),
+        'top5': round(c['top5'] / n, 4),
+        'agreement': round(c['agreement'] / n, 4),
+        'maxProbDiff': round(c['maxProbDiff'], 5),
+        'msPerImage': round(c['seconds'] / n * 1000, 3),
+        'images': n
+    } for name, c in counts.items()}
+
+
+def write_export(tflite_model: bytes, out: str, class_names: list, input_shape: tuple, quantization: str,
+                 source: str, evaluation: dict = None):
+    """
+    Write a TFLite model and its manifest (<out>.json)
+
+    :param tflite_model: TFLite model bytes
+    :param out: model output path
+    :param class_names: class names in output order
+    :param input_shape: model input (height, width, channels)
+    :param quantization: quantization the model was converted with
+    :param source: path of the Keras model it was converted from
+    :param evaluation: held-out evaluation results to record, if any
+    :return: manifest dict
+    """
+    with open(source, 'rb') as f:
+        source_sha1 = hashlib.sha1(f.read()).hexdigest()
+    manifest = {
+        'format': 'tflite',
+        'quantization': quantization,
+        'inputShape': list(input_shape),
+        'classNames': list(class_names),
+        'source': os.path.basename(source),
+        'sourceSha1': source_sha1,
+        'exportedAt': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+        'evaluation': evaluation
+    }
+    with open(out, 'wb') as f:
+        f.write(tflite_model)
+    with open(f'{out}.json', 'w') as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-model', default='model.keras')
+    parser.add_argument('-classnames', default='class_names.pickle')
+    parser.add_argument('-out', default='model.tflite')
+    parser.add_argument('-data', default=DATA_ROOT, help='training data, whose validation split is the held-out set')
+    parser.add_argument('-min-agreement', type=float, default=0.99,
+                        help='fraction of held-out images whose top-1 prediction must match the Keras model')
+    parser.add_argument('-skipcheck', action='store_true', help='export without the held-out parity check')
+    args = parser.parse_args()
+
+    model = load_model(args.model)
+    with open(args.classnames, 'rb') as f:
+        class_names = pickle.load(f)
+    input_shape = tuple(model.input_shape[1:])
+
+    tflite_model = convert(model)
+    print(f'Converted {args.model} ({os.path.getsize(args.model) / 2 ** 20:.1f}MB) to TFLite '
+          f'({len(tflite_model) / 2 ** 20:.1f}MB)')
+
+    evaluation = None
+    if not args.skipcheck:
+        results = evaluate({'keras': model, 'tflite': TFLiteModel(model_content=tflite_model)},
+                           held_out_dataset(input_shape[:2], args.data))
+        for name, result in results.items():
+            print(f'{name:<7} {result}')
+        evaluation = results['tflite']
+        if evaluation['agreement'] < args.min_agreement:
+            print(f'Not exported: top-1 agreement {evaluation["agreement"]} is below {args.min_agreement}')
+            sys.exit(1)
+
+    write_export(tflite_model, args.out, class_names, input_shape, 'float32', args.model, evaluation)
+    print(f'Wrote {args.out} and {args.out}.json')
@@ -0,0 +1,128 @@
+# quantize.py
+# Post-training quantization of the trained Keras model (model.keras) to an 8-bit TFLite model for the API
+#
+# 'int8' quantizes weights and activations, with activation ranges calibrated on -calibration images from the training
+# split of data_full. 'dynamic' quantizes only the weights (most of them are in the Dense head) and needs no
+# calibration. The float Keras model and the quantized model are evaluated side by side on train.py's held-out
+# validation split, and the quantized model is only written if its top-1 accuracy is no more than -max-drop below the
+# float model's. Size and latency of both are reported either way.
+#
+# Usage:
+#   python quantize.py [-mode int8|dynamic] [-out model.int8.tflite] [-calibration 200] [-max-drop 0.01]
+#
+# The API serves the output with CLASSIFIER_RUNTIME=tflite and CLASSIFIER_TFLITE_PATH pointing at it.
+
+import argparse
+import os
+import pickle
+import sys
+import time
+import numpy as np
+from keras.models import load_model
+from keras.utils import image_dataset_from_directory
+from export import DATA_ROOT, VALIDATION_SPLIT, SPLIT_SEED, TFLiteModel, convert, evaluate, held_out_dataset, \
+    write_export
+
+
+def calibration_images(input_size: tuple, count: int, data_root: str = DATA_ROOT):
+    """
+    Sample calibration images from train.py's training subset, so none of them are in the held-out set
+
+    :param input_size: model input (height, width)
+    :param count: number of images
+    :param data_root: directory of one subdirectory of images per class
+    :return: array of images
+    """
+    dataset = image_dataset_from_directory(
+        data_root,
+        validation_split=VALIDATION_SPLIT,
+        subset='training',
+        seed=SPLIT_SEED,
+        batch_size=None,
+        image_size=input_size
+    )
+    # the training subset is shuffled with the split seed, so the first images are a sample across all classes
+    return np.stack([image.numpy() for image, _ in dataset.take(count)])
+
+
+def calibration_dataset(images: np.ndarray):
+    """
+    Representative dataset for the TFLite converter
+
+    :param images: calibration images
+    :return: function returning a generator of single-image input lists
+    """
+    def generate():
+        for image in images:
+            yield [image[None]]
+    return generate
+
+
+def latency(model, input_shape: tuple, runs: int = 50):
+    """
+    Median single-image inference time
+
+    :param model: object with predict_on_batch(images)
+    :param input_shape: model input (height, width, channels)
+    :param runs: timed inferences, after one warmup
+    :return: milliseconds
+    """
+    image = np.random.default_rng(0).uniform(0, 255, (1, *input_shape)).astype(np.float32)
+    model.predict_on_batch(image)
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        model.predict_on_batch(image)
+        times.append(time.perf_counter() - start)
+    return sorted(times)[len(times) // 2] * 1000
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-model', default='model.keras')
+    parser.add_argument('-classnames', default='class_names.pickle')
+    parser.add_argument('-mode', default='int8', choices=['int8', 'dynamic'])
+    parser.add_argument('-out', default=None, help='default model.<mode>.tflite')
+    parser.add_argument('-data', default=DATA_ROOT)
+    parser.add_argument('-calibration', type=int, default=200, help='training images used to calibrate int8 ranges')
+    parser.add_argument('-max-drop', type=float, default=0.01,
+                        help='largest held-out top-1 accuracy drop from the float model that is published')
+    args = parser.parse_args()
+    out = args.out or f'model.{args.mode}.tflite'
+
+    model = load_model(args.model)
+    with open(args.classnames, 'rb') as f:
+        class_names = pickle.load(f)
+    input_shape = tuple(model.input_shape[1:])
+
+    if args.mode == 'int8':
+        images = calibration_images(input_shape[:2], args.calibration, args.data)
+        print(f'Calibrating on {len(images)} training images')
+    representative_dataset = calibration_dataset(images) if args.mode == 'int8' else None
+
+    start = time.perf_counter()
+    quantized_model = convert(model, representative_dataset, args.mode)
+    print(f'Quantized ({args.mode}) in {time.perf_counter() - start:.1f}s')
+    quantized = TFLiteModel(model_content=quantized_model)
+
+    results = evaluate({'float': model, args.mode: quantized}, held_out_dataset(input_shape[:2], args.data))
+    for name, result in results.items():
+        print(f'{name:<7} {result}')
+    float_size, quantized_size = os.path.getsize(args.model), len(quantized_model)
+    float_latency, quantized_latency = latency(model, input_shape), latency(quantized, input_shape)
+    print(f'size     {float_size / 2 ** 20:8.1f}MB -> {quantized_size / 2 ** 20:8.1f}MB '
+          f'({float_size / quantized_size:.1f}x smaller)')
+    print(f'latency  {float_latency:8.2f}ms -> {quantized_latency:8.2f}ms per image '
+          f'({float_latency / quantized_latency:.1f}x faster)')
+
+    evaluation = results[args.mode]
+    drop = results['float']['top1'] - evaluation['top1']
+    if drop > args.max_drop:
+        print(f'Not published: top-1 accuracy dropped {drop:.4f} ({results["float"]["top1"]} -> '
+              f'{evaluation["top1"]}), more than {args.max_drop}')
+        sys.exit(1)
+
+    evaluation['top1Drop'] = round(drop, 4)
+    evaluation['top5Drop'] = round(results['float']['top5'] - evaluation['top5'], 4)
+    write_export(quantized_model, out, class_names, input_shape, args.mode, args.model, evaluation)
+    print(f'Wrote {out} and {out}.json')